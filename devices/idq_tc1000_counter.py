@@ -1,4 +1,4 @@
-from utils.common import zmq_exec
+from utils.common import zmq_exec, ScpiBatch
 import time
 from typing import Literal
 
@@ -38,7 +38,7 @@ class CountData:
     @staticmethod 
     def input(data: dict) -> bool:
         try:
-            if data.get("count") and data.get("integration-time-s") and data.get("counter-timestamp"):
+            if data.get("count") is not None and data.get("integration-time-s") and data.get("counter-timestamp"):
                 obj = CountData(count=data.get("count"), integration_time_s=data.get("integration-time-s"), time_created=data.get("counter-timestamp"))
                 return obj
             else:
@@ -61,12 +61,13 @@ class TCCounter:
         self.verbose = verbose
         self.input = None
         self.integration_time_ms = None
+        self.mode = None
+        self.accumulation_start = None
 
         input = self._input_channel_parser(input)
         if input:
             self.input = input
-            self.set_integration_time(int_time_ms)
-            self.set_count_mode(mode)
+            self.configure(int_time_ms, mode)
 
 
     ################################################ FUNCTIONS ###########################################################
@@ -97,12 +98,35 @@ class TCCounter:
         return False
         
    
+    def configure(self, int_time_ms: int = None, mode: str = None) -> bool:
+        # Integration time and count mode in a single round trip.
+        if int_time_ms == None:
+            raise ValueError("TCCounter.configure(): no integration time specified.")
+        if mode.upper() not in ["CYCLE", "ACCUM"]:
+            raise ValueError(f"TCCounter.configure(): {mode} not a valid count mode.")
+
+        batch = ScpiBatch(self.tc, raise_on_error=False)
+        batch.set(f"{self.input}:COUN:INTE", int_time_ms)
+        batch.set(f"{self.input}:COUN:MODE", mode.upper())
+        int_time_response, mode_response = batch.execute()
+
+        if int_time_response.strip() == f'Value set to {int_time_ms}':
+            self.integration_time_ms = int_time_ms
+        if mode_response.upper().strip() == f'VALUE SET TO {mode.upper()}':
+            self.mode = mode.upper()
+
+        return self.integration_time_ms == int_time_ms and self.mode == mode.upper()
+
     def set_count_mode(self, mode: str):
         if mode.upper() not in ["CYCLE", "ACCUM"]:
             raise ValueError(f"TCCounter.set_count_mode(): {mode} not a valid count mode.") 
 
+        if self.mode == mode.upper():
+            return True
+
         mode_response = zmq_exec(self.tc, f"{self.input}:COUN:MODE {mode.upper()}")
         if mode_response.upper().strip() == f'VALUE SET TO {mode.upper()}':
+            self.mode = mode.upper()
             return True
             
         return False
@@ -116,8 +140,25 @@ class TCCounter:
         
         return False
     
+    def start_accumulation(self) -> bool:
+        # ACCUM mode only: resets the counter and starts timing the accumulation window.
+        response = zmq_exec(self.tc, f"{self.input}:COUN:RESE")
+        self.accumulation_start = time.time()
+        return response.upper().strip() == 'COUNTER VALUE SET TO 0'
+
+    def read_accumulation(self, answer: str = None) -> CountData:
+        # Counts accumulated since start_accumulation(), over the wall time elapsed in between.
+        # `answer` is the reply to COUN? when it was already read as part of a ScpiBatch.
+        if self.accumulation_start is None:
+            raise ValueError("TCCounter.read_accumulation(): accumulation was never started.")
+        value = int(answer if answer is not None else zmq_exec(self.tc, f'{self.input}:COUN?'))
+        elapsed = time.time() - self.accumulation_start
+        self.accumulation_start = None
+        return CountData(value, elapsed)
+
     def count(self) -> int|None:
         try:
+            self.set_count_mode("cycle")                            # no-op unless a combined acquisition left it in ACCUM
             time.sleep(self.integration_time_ms*1e-3)               # Forcing sleep time (converted to seconds) here to avoid having to do it elsewhere. 
             value = int(zmq_exec(self.tc, f'{self.input}:COUN?'))
             data = CountData(value, self.integration_time_ms * 1e-3)
@@ -1,16 +1,19 @@
-from utils.common import zmq_exec, connect
+from utils.common import connect, ScpiBatchError, SCPI_PORT
 from devices.idq_tc1000_counter import *
 from devices.idq_tc1000_tol import *
+from devices.idq_tc1000_state import TCState, normalize
 
 class TimeController:
-    def __init__(self, machine_ip = None, verbose: bool = False):
+    def __init__(self, machine_ip = None, verbose: bool = False, port: int = SCPI_PORT):
         if machine_ip == None or type(machine_ip) != str:
             raise ValueError("TimeController: need to provide me with a valid zmq connection context object.")
         
         self.verbose = verbose
-        self.connection = connect(machine_ip)
+        self.connection = connect(machine_ip, port=port)
         self.devices = []
         self.status = {}
+        self.state = TCState(self.connection, verbose=verbose)       # configuration mirror, setters only send what changed
+        self.state.load()
 
     '''    
     def get_status(self) -> dict:
@@ -68,7 +71,7 @@ class TimeController:
     def get_tol(self, input: 1|2|3|4 = None):
         if input == None:
             raise ValueError("TimeController.get_tol(): did not supply an input channel.")
-        self.devices.append(TCToL(self.connection, input))
+        self.devices.append(TCToL(self.connection, input, state=self.state))
         return self.devices[-1]
 
     def remove_device(self, device):
@@ -99,18 +102,11 @@ class TimeController:
                     
         if delay:
             if type(delay) == int:
-                response = zmq_exec(self.connection, f"DELA{input}:VALU {delay}")
-                if response.upper().strip() == f"VALUE SET TO {delay}":
-                    return True
-                if self.verbose:
-                    print(f"TCToL.set_bcount(): Error from device -> {response}")
-                return False
+                return self.state.set(f"DELA{input}:VALU", delay)
             else:
                 raise ValueError("TimeController.delay(): delay type is wrong.")
         else:
-            response = zmq_exec(self.connection, f"DELA{input}:VALU?")
-            response = int(response.replace("TB", ""))
-            return response
+            return int(self.state.get_number(f"DELA{input}:VALU"))
     
             
     def threshold(self, input: int|str, threshold: int|float = None) -> str|bool:
@@ -119,50 +115,46 @@ class TimeController:
         
         elif threshold == None:
             input = self._input_channel_parser(input)
-            response = zmq_exec(self.connection, f"{input}:THRE?")
             try:
-                response = float(response.replace("V", ""))
-                return response
+                return self.state.get_number(f"{input}:THRE")
             except Exception:
                 return None
         else:
             input = self._input_channel_parser(input)
-            response = zmq_exec(self.connection, f"{input}:THRE {threshold}")
-            if "VALUE SET TO" in response.upper():
-                return True
-            else:
-                return False
+            return self.state.set(f"{input}:THRE", threshold)
             
-    def _enabled(self, input: str|int) -> bool:
-        if zmq_exec(self.connection, f"{input}:ENAB?") == 'ON':
+    def setup_inputs(self, thresholds: dict = None) -> bool:
+        # Threshold and enable of several inputs in a single round trip, e.g. {"start": -0.3, 1: -0.1}.
+        if not thresholds:
+            raise ValueError("TimeController.setup_inputs(): no input thresholds supplied.")
+
+        settings = {}
+        for input, threshold in thresholds.items():
+            if type(threshold) not in [float, int]:
+                raise ValueError("TimeController.setup_inputs(): invalid threshold type supplied.")
+            input = self._input_channel_parser(input)
+            settings[f"{input}:THRE"] = threshold
+            settings[f"{input}:ENAB"] = "ON"
+
+        try:
+            self.state.apply(settings)
             return True
-        
-        return False
+        except ScpiBatchError:
+            return False
+
+    def apply_profile(self, name: str) -> list:
+        # Named configuration (see TCState.add_profile), sent as one diff against the current configuration.
+        return self.state.apply_profile(name)
+
+    def _enabled(self, input: str|int) -> bool:
+        return normalize(self.state.get(f"{input}:ENAB")) == 'ON'
                 
 
     def enable_input(self, input: str|int) -> bool:
         input = self._input_channel_parser(input)
-        if self._enabled(input):
-            return True
-        else:
-            response = zmq_exec(self.connection, f"{input}:ENAB")
-            if response.strip().upper() == 'VALUE SET TO ON':
-                return True
-            else:
-                if self.verbose:
-                    print(response)
-                return False
+        return self.state.set(f"{input}:ENAB", "ON")                # nothing is sent if the mirror says it is already on
         
     def disable_input(self, input: str|int) -> bool:
         input = self._input_channel_parser(input)
-        if not self._enabled(input):
-            return True
-        else:
-            response = zmq_exec(self.connection, f"{input}:ENAB OFF")
-        if response.strip().upper() == 'VALUE SET TO OFF':
-            return True
-        else:
-            if self.verbose:
-                print(response)
-            return False
+        return self.state.set(f"{input}:ENAB", "OFF")
     
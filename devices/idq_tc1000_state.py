@@ -0,0 +1,180 @@
+import re
+import sys
+import json
+from utils.common import ScpiBatch, ScpiBatchError
+
+'''
+Copia locale della configurazione del TC1000.
+
+TCState legge con un'unica richiesta (ScpiBatch) soglie e abilitazione degli input, ritardi, impostazioni degli
+istogrammi, del generatore REC e dei link. Da quel momento le letture arrivano dalla copia locale e i setter mandano al
+dispositivo solo i valori che sono cambiati, tutti insieme in un solo messaggio.
+
+Le chiavi sono i comandi SCPI in forma breve (solo le lettere maiuscole di ogni nodo): "INPU1:THRE", "DELA2:VALU",
+"HIST1:BCOU", "REC:DUR"... Qualunque forma si usi ("HIST1:BCOUnt", "REC:DURation") viene ridotta a quella breve.
+
+I profili sono insiemi di impostazioni con un nome, applicati come un'unica differenza rispetto allo stato corrente:
+
+    state.add_profile("tol", {"INPU1:THRE": -0.1, "DELA1:VALU": 1400000, "HIST1:BWID": 1000})
+    state.apply_profile("tol")
+'''
+
+INPUTS = ("STAR", "INPU1", "INPU2", "INPU3", "INPU4")
+DELAYS = range(1, 9)
+HISTOGRAMS = range(1, 5)
+REC_SETTINGS = ("REC:TRIG:ARM:MODE", "REC:ENAB", "REC:NUM", "REC:DUR")
+
+MIRRORED_SETTINGS = (
+    *(f"{block}:THRE" for block in INPUTS),
+    *(f"{block}:ENAB" for block in INPUTS),
+    *(f"DELA{i}:VALU" for i in DELAYS),
+    *(f"HIST{i}:{setting}" for i in HISTOGRAMS for setting in ("BWID", "BCOU", "REF:LINK", "STOP:LINK")),
+    *REC_SETTINGS,
+    "TSCO1:FIR:LINK",
+)
+
+_NUMBER_WITH_UNIT = re.compile(r"^\s*([-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?)\s*[A-Za-z]*\s*$")
+
+
+def short_form(cmd: str) -> str:
+    # SCPI short form of a command header: "HIST1:BCOUnt" -> "HIST1:BCOU", "REC:DURation" -> "REC:DUR".
+    nodes = cmd.strip().lstrip(":").split(":")
+    return ":".join("".join(c for c in node if c.isupper() or c.isdigit()) or node.upper() for node in nodes)
+
+
+def normalize(value) -> float|str:
+    # Numbers compare as numbers whatever their unit ("100TB", "-0.1V", 1e12), the rest as upper case strings.
+    if isinstance(value, bool):
+        return "ON" if value else "OFF"
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = _NUMBER_WITH_UNIT.match(str(value))
+    if match:
+        return float(match.group(1))
+    return str(value).strip().upper()
+
+
+def same_value(a, b) -> bool:
+    a, b = normalize(a), normalize(b)
+    if isinstance(a, float) or isinstance(b, float):
+        return a == b
+    # Enumerations may be given in short or long form: "MANU" / "MANUAL", "CYCL" / "CYCLE". Block names are not
+    # abbreviated: "TSCO1" is not "TSCO12".
+    if any(c.isdigit() for c in a + b):
+        return a == b
+    return bool(a) and bool(b) and (a.startswith(b) or b.startswith(a))
+
+
+class TCState:
+    def __init__(self, tc, settings: tuple = MIRRORED_SETTINGS, verbose: bool = False):
+        self.tc = tc
+        self.verbose = verbose
+        self.settings = tuple(short_form(setting) for setting in settings)
+        self.values = {}                # short form -> last value read from or accepted by the device
+        self.profiles = {}              # name -> {short form: value}
+        self.sent = 0                   # settings actually sent / skipped because already set
+        self.skipped = 0
+
+    def load(self) -> dict:
+        # Reads every mirrored setting in one round trip. To be called again after a DEVI:CONF:LOAD.
+        batch = ScpiBatch(self.tc)
+        for setting in self.settings:
+            batch.query(setting)
+        self.values = dict(zip(self.settings, (answer.strip() for answer in batch.execute())))
+        return dict(self.values)
+
+    def invalidate(self, setting: str = None):
+        # Forgets one setting (or all): the next set() sends it whatever its value.
+        if setting is None:
+            self.values.clear()
+        else:
+            self.values.pop(short_form(setting), None)
+
+    def get(self, setting: str):
+        setting = short_form(setting)
+        if setting not in self.values:
+            batch = ScpiBatch(self.tc)
+            batch.query(setting)
+            self.values[setting] = batch.execute()[0].strip()
+        return self.values[setting]
+
+    def get_number(self, setting: str) -> float:
+        value = normalize(self.get(setting))
+        if not isinstance(value, float):
+            raise ValueError(f"TCState.get_number(): {setting} is not numeric ({value}).")
+        return value
+
+    def changed(self, settings: dict) -> dict:
+        # The subset of `settings` that differs from the mirror (unknown settings count as different).
+        return {
+            short_form(setting): value
+            for setting, value in settings.items()
+            if short_form(setting) not in self.values or not same_value(self.values[short_form(setting)], value)
+        }
+
+    def apply(self, settings: dict, before: list = (), after: list = ()) -> list:
+        # Sends only the settings that changed, in one message together with the unconditional commands `before` and
+        # `after` (e.g. REC:STOP, HIST1:FLUSh). Returns the settings that were sent. Settings the device refused are
+        # dropped from the mirror and raise ScpiBatchError.
+        changes = self.changed(settings)
+        self.sent += len(changes)
+        self.skipped += len(settings) - len(changes)
+        if not changes and not before and not after:
+            return []
+
+        batch = ScpiBatch(self.tc, raise_on_error=False)
+        for cmd in before:
+            batch.add(cmd)
+        indices = {setting: batch.set(setting, value) for setting, value in changes.items()}
+        for cmd in after:
+            batch.add(cmd)
+        batch.execute()
+
+        failed = {short_form(cmd.split(" ", 1)[0]) for cmd, _ in batch.errors}
+        for setting, value in changes.items():
+            if setting in failed:
+                self.values.pop(setting, None)
+            else:
+                self.values[setting] = str(value)
+
+        if failed:
+            if self.verbose:
+                print(f"TCState.apply(): Error from device -> {batch.errors}")
+            raise ScpiBatchError("; ".join(f"{cmd} -> {result.strip() or 'no answer'}" for cmd, result in batch.errors))
+        return list(changes)
+
+    def set(self, setting: str, value) -> bool:
+        try:
+            self.apply({setting: value})
+            return True
+        except ScpiBatchError:
+            return False
+
+    ############################################ profiles ############################################
+
+    def add_profile(self, name: str, settings: dict):
+        self.profiles[name] = {short_form(setting): value for setting, value in settings.items()}
+
+    def snapshot(self, name: str, settings: list = None):
+        # Stores the current mirror (or part of it) as a profile, to restore it later with apply_profile().
+        settings = [short_form(setting) for setting in settings] if settings else list(self.values)
+        self.profiles[name] = {setting: self.get(setting) for setting in settings}
+
+    def apply_profile(self, name: str) -> list:
+        if name not in self.profiles:
+            raise ValueError(f"TCState.apply_profile(): unknown profile \"{name}\" {tuple(self.profiles)}.")
+        return self.apply(self.profiles[name])
+
+    def save_profiles(self, path: str) -> bool:
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(self.profiles, f, indent=2)
+            return True
+        except Exception as e:
+            print(f"Error saving TCState profiles to {path}: {e}", file=sys.stderr)
+            return False
+
+    def load_profiles(self, path: str):
+        with open(path, "r", encoding="utf-8") as f:
+            for name, settings in json.load(f).items():
+                self.add_profile(name, settings)
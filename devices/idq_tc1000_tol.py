@@ -1,15 +1,17 @@
 import time
-from utils.common import zmq_exec
-from utils.acquisitions.histograms import wait_end_of_acquisition
-from ast import literal_eval
+import numpy as np
+from utils.common import zmq_exec, ScpiBatch, ScpiBatchError
+from utils.acquisitions.histograms import parse_histogram
+from typing import Literal
+from devices.idq_tc1000_counter import TCCounter, CountData
 
 # needs work to implement the class
 
 
 class ToLData:
-    def __init__(self, x_data: list = None, y_data: list = None, time_created: float = None):
+    def __init__(self, x_data: list|np.ndarray = None, y_data: list|np.ndarray = None, time_created: float = None, acquisition_time_s: float = None):
         
-        if x_data != None and y_data != None and len(x_data) == len(y_data):
+        if x_data is not None and y_data is not None and len(x_data) == len(y_data):
             self.x_data = x_data
             self.y_data = y_data
         else:
@@ -20,15 +22,26 @@ class ToLData:
         else:
             self.time_created = time_created
 
+        self.acquisition_time_s = acquisition_time_s        # actual recording time, may be shorter than requested with early termination
+
+    def rate(self) -> np.ndarray:
+        # Histogram normalised by the acquisition time (counts per second per bin).
+        if not self.acquisition_time_s:
+            raise ValueError("ToLData.rate(): acquisition time unknown for this histogram.")
+        return np.asarray(self.y_data) / self.acquisition_time_s
+
     def out(self) -> dict:
-        data = {"tol-x": self.x_data, "tol-y": self.y_data, "tol-timestamp": self.time_created}
+        # Histograms acquired from the device are NumPy arrays, they are saved as plain lists.
+        x_data = self.x_data.tolist() if isinstance(self.x_data, np.ndarray) else self.x_data
+        y_data = self.y_data.tolist() if isinstance(self.y_data, np.ndarray) else self.y_data
+        data = {"tol-x": x_data, "tol-y": y_data, "tol-timestamp": self.time_created, "tol-acquisition-time-s": self.acquisition_time_s}
         return data
 
     @staticmethod 
     def input(data: dict) -> bool:
         try:
             if data.get("tol-x") and data.get("tol-y") and data.get("tol-timestamp"):
-                obj = ToLData(x_data=data.get("tol-x"), y_data=data.get("tol-y"), time_created=data.get("tol-timestamp"))
+                obj = ToLData(x_data=data.get("tol-x"), y_data=data.get("tol-y"), time_created=data.get("tol-timestamp"), acquisition_time_s=data.get("tol-acquisition-time-s"))
                 return obj
             else:
                 return None
@@ -42,17 +55,23 @@ class TCToL:
                     input: 1|2|3|4, 
                     bwidth: int = 100, 
                     bcount: int = 1000, 
-                    verbose: bool = False
+                    verbose: bool = False,
+                    state = None,
                  ):
         self.bwidth = None
         self.bcount = None
         self.connection = tc
         self.verbose = verbose
+        self.state = state              # TCState shared with the TimeController: only changed settings are sent
+        self.last_timings = {}          # wall time (s) of each phase of the last acquisition: tol-arm, tol-record, tol-readout, count
         
         if input in range(0,4):
             self.input = input
-            self.set_bwidth(bwidth)
-            self.set_bcount(bcount)
+            self.set_histogram(bwidth, bcount)
+            # Links at creation, restored at every arm if another acquisition (counts over time) relinked the histogram
+            self.links = {} if state is None else {
+                setting: state.get(setting) for setting in (f"HIST{input}:REF:LINK", f"HIST{input}:STOP:LINK")
+            }
         else:
             raise ValueError("TCToL: Failed to initialise. Invalid input channel for histogram acquisition.")
         
@@ -60,7 +79,12 @@ class TCToL:
             raise Exception("TCToL: Failed to initialise. User verbose mode for more info.")
 
     def set_bwidth(self, bwidth: int) -> bool:   ## value in picoseconds.
-        if bwidth:
+        if bwidth and self.state is not None:
+            if self.state.set(f"HIST{self.input}:BWID", bwidth):
+                self.bwidth = bwidth
+                return True
+            return False
+        elif bwidth:
             response = zmq_exec(self.connection, f"HIST{self.input}:BWID {bwidth}")
             if response.upper().strip() == f"VALUE SET TO {bwidth}":
                 self.bwidth = bwidth
@@ -74,7 +98,12 @@ class TCToL:
             raise ValueError(f"TCToL.set_bwidth(): invalid bin width supplied: {bwidth}")
     
     def set_bcount(self, bcount: int) -> bool:
-        if bcount:
+        if bcount and self.state is not None:
+            if self.state.set(f"HIST{self.input}:BCOU", bcount):
+                self.bcount = bcount
+                return True
+            return False
+        elif bcount:
             response = zmq_exec(self.connection, f"HIST{self.input}:BCOU {bcount}")
             if response.upper().strip() == f"VALUE SET TO {bcount}":
                 self.bcount = bcount
@@ -86,32 +115,231 @@ class TCToL:
         else:
             raise ValueError(f"TCToL.set_bcount(): invalid bin count supplied: {bcount}")
 
+    def set_histogram(self, bwidth: int, bcount: int) -> bool:
+        # Bin width and bin count in a single round trip.
+        if not bwidth or not bcount:
+            raise ValueError(f"TCToL.set_histogram(): invalid bin width/count supplied: {bwidth}/{bcount}")
+
+        if self.state is not None:
+            try:
+                self.state.apply({f"HIST{self.input}:BWID": bwidth, f"HIST{self.input}:BCOU": bcount})
+                self.bwidth, self.bcount = bwidth, bcount
+                return True
+            except ScpiBatchError as e:
+                if self.verbose:
+                    print(f"TCToL.set_histogram(): Error from device -> {e}")
+                return False
+
+        batch = ScpiBatch(self.connection, raise_on_error=False)
+        batch.set(f"HIST{self.input}:BWID", bwidth)
+        batch.set(f"HIST{self.input}:BCOU", bcount)
+        bwidth_response, bcount_response = batch.execute()
+
+        if bwidth_response.upper().strip() == f"VALUE SET TO {bwidth}":
+            self.bwidth = bwidth
+        elif self.verbose:
+            print(f"TCToL.set_histogram(): Error from device -> {bwidth_response}")
+        if bcount_response.upper().strip() == f"VALUE SET TO {bcount}":
+            self.bcount = bcount
+        elif self.verbose:
+            print(f"TCToL.set_histogram(): Error from device -> {bcount_response}")
+
+        return self.bwidth == bwidth and self.bcount == bcount
+
+    def _arm(self, duration: float):
+        arm_start = time.perf_counter()
+        self.last_timings = {}
+
+        ### Configure the acquisition timer, all in one round trip
+
+        if self.state is not None:
+            # Only the settings that changed since the last acquisition are sent along with STOP and FLUSh: the REC
+            # settings and, if another acquisition changed them, the histogram's own bins and links.
+            self.state.apply(
+                {
+                    "REC:TRIG:ARM:MODE": "MANUal",
+                    "REC:ENABle": "ON",
+                    "REC:NUM": 1,
+                    "REC:DURation": duration * 1e12,
+                    f"HIST{self.input}:BWID": self.bwidth,
+                    f"HIST{self.input}:BCOU": self.bcount,
+                    **self.links,
+                },
+                before=["REC:STOP"],
+                after=[f"HIST{self.input}:FLUSh"],
+            )
+            self.last_timings["tol-arm"] = time.perf_counter() - arm_start
+            return
+
+        with ScpiBatch(self.connection) as batch:
+            # Trigger RECord signal manually (PLAY command)
+            batch.set("REC:TRIG:ARM:MODE", "MANUal")
+            # Enable the RECord generator
+            batch.set("REC:ENABle", "ON")
+            # STOP any already ongoing acquisition
+            batch.add("REC:STOP")
+            # Record a single acquisition
+            batch.set("REC:NUM", 1)
+            # Record for the request duration (in ps)
+            batch.set("REC:DURation", duration * 1e12)
+            # Flush previous data
+            batch.add(f"HIST{self.input}:FLUSh")
+
+        self.last_timings["tol-arm"] = time.perf_counter() - arm_start
+
+    def _read(self) -> np.ndarray:
+        return parse_histogram(zmq_exec(self.connection, f"HIST{self.input}:DATA?"))
+
+    def _record(self, max_duration: float, target_reached = None, poll_interval: float = 1, counter: TCCounter = None) -> tuple[np.ndarray, float, CountData|None]:
+        # Plays an armed record and returns (histogram, actual acquisition time in seconds, counter data). If
+        # target_reached(histogram) is given, the histogram is read while REC is still playing and the record is
+        # stopped as soon as it returns True. With an ACCUM mode counter, its reset goes out with REC:PLAY and its
+        # value with the histogram readout, so the count window matches the record with no extra round trips.
+        record_start = time.perf_counter()
+        play_start = time.time()
+        with ScpiBatch(self.connection) as batch:
+            if counter is not None:
+                batch.add(f"{counter.input}:COUN:RESE")
+            batch.add("REC:PLAY")  # Start the acquisition
+        play_time = (play_start + time.time()) / 2
+        if counter is not None:
+            counter.accumulation_start = play_time
+
+        # Stage and histogram in the same message: the histogram read when the stage is no longer PLAYING is final.
+        Y_data = None
+        stop_time = None
+        while True:
+            time.sleep(poll_interval)
+            batch = ScpiBatch(self.connection)
+            batch.query("REC:STAGe")
+            if target_reached is not None:
+                batch.query(f"HIST{self.input}:DATA")
+            answers = batch.execute()
+
+            if answers[0].strip().upper() != "PLAYING":
+                Y_data = parse_histogram(answers[1]) if target_reached is not None and counter is None else None
+                break
+            if target_reached is not None and target_reached(parse_histogram(answers[1])):
+                stop_start = time.time()
+                zmq_exec(self.connection, "REC:STOP")
+                stop_time = (stop_start + time.time()) / 2
+                break
+
+        # Get histogram data (and counter value), after the record is over
+        readout_start = time.perf_counter()
+        self.last_timings["tol-record"] = readout_start - record_start
+        count_object = None
+        if counter is not None:
+            batch = ScpiBatch(self.connection)
+            batch.query(f"HIST{self.input}:DATA")
+            batch.query(f"{counter.input}:COUN")
+            hist_answer, count_answer = batch.execute()
+            Y_data = parse_histogram(hist_answer)
+            count_object = counter.read_accumulation(count_answer)
+        elif Y_data is None:
+            Y_data = self._read()
+        self.last_timings["tol-readout"] = time.perf_counter() - readout_start
+        acquisition_time = min(stop_time - play_time, max_duration) if stop_time else max_duration
+        return Y_data, acquisition_time, count_object
+
+    def _targets(self, target_counts: int = None, target_relative_uncertainty: float = None):
+        if not target_counts and not target_relative_uncertainty:
+            return None
+
+        def target_reached(histogram: np.ndarray) -> bool:
+            if target_counts and histogram.sum() >= target_counts:
+                return True
+            if target_relative_uncertainty and self.peak_relative_uncertainty(histogram) <= target_relative_uncertainty:
+                return True
+            return False
+
+        return target_reached
 
     def acquire(self, duration: int = None) -> ToLData:
 
         if not duration:
             raise ValueError("TCToL.acquire(): need to provide me with a valid acquisition duration value in seconds.")
-        ### Configure the acquisition timer
-
-        # Trigger RECord signal manually (PLAY command)
-        zmq_exec(self.connection, "REC:TRIG:ARM:MODE MANUal")
-        # Enable the RECord generator
-        zmq_exec(self.connection, "REC:ENABle ON")
-        # STOP any already ongoing acquisition
-        zmq_exec(self.connection, "REC:STOP")
-        # Record a single acquisition
-        zmq_exec(self.connection, "REC:NUM 1")
-        # Record for the request duration (in ps)
-        zmq_exec(self.connection, f"REC:DURation {duration * 1e12}")
-        # Flush previous data
-        zmq_exec(self.connection, f"HIST{self.input}:FLUSh")  # Flush histogram
-
-        zmq_exec(self.connection, "REC:PLAY")  # Start the acquisition
-
-        wait_end_of_acquisition(self.connection)
-
-        # Get histogram data
-        Y_data = literal_eval(zmq_exec(self.connection, f"HIST{self.input}:DATA?"))
-        X_data = [i * self.bwidth for i in range(self.bcount)]
-        data_object = ToLData(x_data=X_data, y_data=Y_data)
-        return data_object
\ No newline at end of file
+
+        self._arm(duration)
+        Y_data, acquisition_time, _ = self._record(duration)
+
+        X_data = np.arange(self.bcount) * self.bwidth
+        data_object = ToLData(x_data=X_data, y_data=Y_data, acquisition_time_s=acquisition_time)
+        return data_object
+
+    @staticmethod
+    def peak_relative_uncertainty(histogram: list|np.ndarray) -> float:
+        # Poisson relative uncertainty on the peak area, the peak being the bins above half maximum: 1/sqrt(N).
+        histogram = np.asarray(histogram)
+        peak = histogram.max() if len(histogram) else 0
+        if peak == 0:
+            return float("inf")
+        peak_counts = histogram[histogram >= peak / 2].sum()
+        return float(1 / peak_counts ** 0.5)
+
+    def acquire_until(
+        self,
+        max_duration: float = None,
+        target_counts: int = None,
+        target_relative_uncertainty: float = None,
+        poll_interval: float = 1,
+    ) -> ToLData:
+        # Records for at most max_duration seconds, but stops as soon as the histogram holds target_counts in total or
+        # its peak reaches target_relative_uncertainty. The histogram is read while REC is still playing.
+        # The actual recording time is stored in ToLData.acquisition_time_s for normalisation.
+
+        if not max_duration:
+            raise ValueError("TCToL.acquire_until(): need to provide me with a valid maximum acquisition duration value in seconds.")
+
+        self._arm(max_duration)
+        Y_data, acquisition_time, _ = self._record(
+            max_duration, self._targets(target_counts, target_relative_uncertainty), poll_interval
+        )
+        X_data = np.arange(self.bcount) * self.bwidth
+
+        if self.verbose:
+            print(f"TCToL.acquire_until(): recorded {int(Y_data.sum())} counts in {round(acquisition_time, 3)} s")
+
+        data_object = ToLData(x_data=X_data, y_data=Y_data, acquisition_time_s=acquisition_time)
+        return data_object
+
+    def acquire_with_count(
+        self,
+        counter: TCCounter = None,
+        max_duration: float = None,
+        target_counts: int = None,
+        target_relative_uncertainty: float = None,
+        poll_interval: float = 1,
+        count_source: Literal["counter", "histogram"] = "counter",
+    ) -> tuple[CountData, ToLData]:
+        # Count rate and ToL histogram from the same REC window, instead of a counter dwell followed by a ToL record.
+        #   counter:    the input counter runs in ACCUM mode, reset in the same message as PLAY and read in the same
+        #               message as the histogram. Its integration time is the wall time between the two.
+        #   histogram:  the count is the histogram total over the acquisition time (only stops inside the ToL window).
+        # Early termination targets work as in acquire_until().
+
+        if not max_duration:
+            raise ValueError("TCToL.acquire_with_count(): need to provide me with a valid maximum acquisition duration value in seconds.")
+        if count_source == "counter" and counter is None:
+            raise ValueError("TCToL.acquire_with_count(): need a TCCounter to count from the counter.")
+
+        self._arm(max_duration)
+
+        if count_source == "counter":
+            count_start = time.perf_counter()
+            counter.set_count_mode("accum")                 # no-op once the counter is in ACCUM mode
+            self.last_timings["count"] = time.perf_counter() - count_start
+            Y_data, acquisition_time, count_object = self._record(
+                max_duration, self._targets(target_counts, target_relative_uncertainty), poll_interval, counter
+            )
+        elif count_source == "histogram":
+            Y_data, acquisition_time, _ = self._record(
+                max_duration, self._targets(target_counts, target_relative_uncertainty), poll_interval
+            )
+            count_object = CountData(int(Y_data.sum()), acquisition_time)
+        else:
+            raise ValueError(f"TCToL.acquire_with_count(): {count_source} not a valid count source.")
+
+        X_data = np.arange(self.bcount) * self.bwidth
+        tol_object = ToLData(x_data=X_data, y_data=Y_data, acquisition_time_s=acquisition_time)
+        return count_object, tol_object
@@ -10,6 +10,7 @@ e prendere il controllo del CrioGeneratore Monana CryoAdvance-50.
 import requests
 import json
 import time
+from devices.montana_transport import get_transport
 
 
 def string_or_json(data, string: bool):
@@ -22,18 +23,19 @@ def string_or_json(data, string: bool):
 
 class CryoController:
 
-    def __init__(controller, IPaddress):
+    def __init__(controller, IPaddress, port: int = 47101):
         
         if not IPaddress or type(IPaddress) is not str:
             raise ValueError("CryoController.__init__(): IP address must be provided")
             
         controller.IPaddress = IPaddress
-        controller.base_url = f"http://{IPaddress}:47101/v1"
-        controller.url = f"http://{IPaddress}:47101/v1/controller"
+        controller.base_url = f"http://{IPaddress}:{port}/v1"
+        controller.url = f"http://{IPaddress}:{port}/v1/controller"
         controller.vacuum_pump_url = controller.base_url + "/vacuumSystem" 
+        controller.transport = get_transport(IPaddress, port)      # pooled keep-alive session shared by every driver on this host
     
     def get_status(controller, string: bool = False):
-        response = requests.get(f"{controller.url}/properties/systemState")
+        response = controller.transport.get(f"{controller.url}/properties/systemState")
         response_json = response.json()
         if string:
             return json.dumps(response_json, indent=4)
@@ -41,7 +43,7 @@ class CryoController:
             return response_json
     
     def get_goal(controller, string: bool = False):
-        response = requests.get(f"{controller.url}/properties/systemGoal")
+        response = controller.transport.get(f"{controller.url}/properties/systemGoal")
         response_json = response.json()
         if string:
             return json.dumps(response_json, indent=4)
@@ -49,50 +51,50 @@ class CryoController:
             return response_json
 
     def abort_goal(controller):
-        response = requests.post(f"{controller.url}/methods/abortGoal()")
+        response = controller.transport.post(f"{controller.url}/methods/abortGoal()")
         return response.status_code == 200
 
     
 ############################################## vacuum system functions #################################################
 
     def get_target_pressure(controller):
-        response = requests.get(f"{controller.url}/properties/pullVacuumTargetPressure")
+        response = controller.transport.get(f"{controller.url}/properties/pullVacuumTargetPressure")
         response_json = response.json()
         
         return response_json['pullVacuumTargetPressure']
 
     def get_pressure(controller, string: bool = False):
-        response = requests.get(f"{controller.vacuum_pump_url}/vacuumGauges/sampleChamberPressure/properties/pressureSample")
+        response = controller.transport.get(f"{controller.vacuum_pump_url}/vacuumGauges/sampleChamberPressure/properties/pressureSample")
         response_json = response.json()
         return response_json['pressureSample']
 
     def pull_vacuum(controller):
-        response = requests.post(f"{controller.url}/methods/pullVacuum()")
+        response = controller.transport.post(f"{controller.url}/methods/pullVacuum()")
         return response.status_code == 200
     
     def vent(controller):
-        response = requests.post(f"{controller.url}/methods/vent()")
+        response = controller.transport.post(f"{controller.url}/methods/vent()")
         return response.status_code == 200
 
 
 ################################################ cooler functions #####################################################
 
     def get_target_temperature(controller):
-        response = requests.get(f"{controller.url}/properties/platformTargetTemperature")
+        response = controller.transport.get(f"{controller.url}/properties/platformTargetTemperature")
         response_json = response.json()
         return response_json["platformTargetTemperature"]
     
     def set_target_temperature(controller, temperature):
         data = {"platformTargetTemperature": temperature}
-        response = requests.put(f"{controller.url}/properties/platformTargetTemperature", json=data)
+        response = controller.transport.put(f"{controller.url}/properties/platformTargetTemperature", json=data)
         return response.status_code == 200
 
     def cooldown(controller):
-        response = requests.post(f"{controller.url}/methods/cooldown()")
+        response = controller.transport.post(f"{controller.url}/methods/cooldown()")
         return response.status_code == 200
     
     def warmup(controller):
-        response = requests.post(f"{controller.url}/methods/warmup()")
+        response = controller.transport.post(f"{controller.url}/methods/warmup()")
         return response.status_code == 200
 
 
@@ -104,11 +106,23 @@ class CryoController:
 ######################################### Rookie Nanopositioner Functions ###########################################
 
 class Positioner:
-    def __init__(self, IPaddress: str):
-        self.base_url = f"http://{IPaddress}:47171/v1"
+    def __init__(self, IPaddress: str, port: int = 47171):
+        self.base_url = f"http://{IPaddress}:{port}/v1"
         self.axes_base_url = f"{self.base_url}/stacks/stack1/axes"
         self.axis_url = {'X': f"{self.axes_base_url}/axis2", 'Y': f"{self.axes_base_url}/axis1", 'Z': f"{self.axes_base_url}/axis3"}
-        self.velocity = {'X': self.get_velocity("X"), 'Y': self.get_velocity("X"), 'Z': self.get_velocity("X")}
+        self.transport = get_transport(IPaddress, port)            # pooled keep-alive session, per endpoint timeouts/retries/latency
+        self.http_calls = 0                 # HTTP requests sent and time spent waiting for them, see move_and_wait() reports
+        self.http_time = 0
+        self.position = {}                  # last theoreticalPosition seen in a status payload, per axis
+        self.velocity = {'X': self.get_velocity("X"), 'Y': self.get_velocity("Y"), 'Z': self.get_velocity("Z")}
+
+    def _request(self, method: str, url: str, **kwargs) -> requests.Response:
+        request_start = time.perf_counter()
+        try:
+            return self.transport.request(method, url, **kwargs)
+        finally:
+            self.http_calls += 1
+            self.http_time += time.perf_counter() - request_start
 
     @staticmethod
     def _validate_axis(axis):
@@ -124,12 +138,15 @@ class Positioner:
     def get_status(self, axis: str = '') -> dict:
         axis = self._validate_axis(axis)
         
-        response = requests.get(f"{self.axis_url[axis]}/properties/status")
-        response_json = response.json()
-        return response_json['status']
+        response = self._request("GET", f"{self.axis_url[axis]}/properties/status")
+        if response.status_code != 200:
+            raise ConnectionError(f"Positioner.get_status(): status of {axis} not available ({response.status_code}).")
+        status = response.json()['status']
+        self.position[axis] = round(status["theoreticalPosition"], 9)
+        return status
 
     def is_connected(self) -> bool:
-        response = requests.get(f"{self.base_url}/motionController/properties/deviceConnected")
+        response = self._request("GET", f"{self.base_url}/motionController/properties/deviceConnected")
         response_json = response.json()
         return response_json["deviceConnected"]
     
@@ -141,7 +158,7 @@ class Positioner:
     def get_velocity(self, axis: str = '') -> list:
         axis = self._validate_axis(axis)
         
-        response = requests.get(f"{self.axis_url[axis]}/properties/velocity")
+        response = self._request("GET", f"{self.axis_url[axis]}/properties/velocity")
         response_json = response.json()
         return response_json["velocity"]
 
@@ -149,26 +166,31 @@ class Positioner:
     def stop(self, axis: str = '') -> bool:
         axis = self._validate_axis(axis)
         
-        response = requests.post(f"{self.axis_url[axis]}/methods/stop()")
+        response = self._request("POST", f"{self.axis_url[axis]}/methods/stop()")
         return response.status_code == 200
     
     
-    def move_to_position(self, axis: str = '', position: int|float = None) -> bool:
+    def move_to_position(self, axis: str = '', position: int|float = None, blocking: bool = True) -> bool:
         axis = self._validate_axis(axis)
 
         if not isinstance(position, (int, float)):
             raise ValueError("Position must be a numeric value")
         
-        position = format(position, '.17f')
-        response = requests.post(f"{self.axis_url[axis]}/methods/moveAbsolute(double:pos)", data=position, headers={"Content-Type": "text/plain"})
-        time.sleep(self._time_of_travel(axis, position))        
+        if blocking:
+            travel_time = self._time_of_travel(axis, position)
+        response = self._request("POST", f"{self.axis_url[axis]}/methods/moveAbsolute(double:pos)", data=format(position, '.17f'), headers={"Content-Type": "text/plain"})
+        if blocking:                # non blocking moves return as soon as the command is accepted (used by fly scans)
+            time.sleep(travel_time)
         return response.status_code == 200
 
     def zero_position(self, axis: str = '') -> bool:
         axis = self._validate_axis(axis)
 
-        response = requests.post(f"{self.axis_url[axis]}/methods/zero()")
-        return response.status_code == 200
+        response = self._request("POST", f"{self.axis_url[axis]}/methods/zero()")
+        if response.status_code == 200:
+            self.position[axis] = 0
+            return True
+        return False
 
     def move_to_limit(self, axis: str = '', direction: str = 'positive') -> bool:
         axis = self._validate_axis(axis)
@@ -177,16 +199,20 @@ class Positioner:
             raise ValueError("Direction must be 'positive' or 'negative'")
         
         method = "moveToPositiveLimit()" if direction == 'positive' else "moveToNegativeLimit()"
-        response = requests.post(f"{self.axis_url[axis]}/methods/{method}")
+        response = self._request("POST", f"{self.axis_url[axis]}/methods/{method}")
         return response.status_code == 200
 
     def set_velocity(self, axis: str = '', velocity: int|float = None) -> bool:
         axis = self._validate_axis(axis)
 
-        if not isinstance(velocity, (int, float)):
-            raise ValueError("Position must be a numeric value")
-        pass                
-        # Set velocity on the device
+        if not isinstance(velocity, (int, float)) or velocity <= 0:
+            raise ValueError("Velocity must be a positive numeric value")
+
+        response = self._request("PUT", f"{self.axis_url[axis]}/properties/velocity", json={"velocity": velocity})
+        if response.status_code == 200:
+            self.velocity[axis] = velocity
+            return True
+        return False
 
     def wait_end_motion(self, axis: str = '', polling_frequency = 100):
 
@@ -197,4 +223,96 @@ class Positioner:
 
         end=time.time()
 
-        return {round(end-start, 6)}
\ No newline at end of file
+        return {round(end-start, 6)}
+
+    def move_and_wait(
+        self,
+        axis: str = '',
+        position: int|float = None,
+        polling_frequency: int = 100,
+        timeout_margin: float = 1.0,
+    ) -> dict:
+        # Single axis version of move_axes_and_wait(), the report also carries axis, target and final position.
+        axis = self._validate_axis(axis)
+        report = self.move_axes_and_wait({axis: position}, polling_frequency, timeout_margin)
+        report.update({"axis": axis, "target": report["targets"][axis], "position": report["positions"][axis]})
+        return report
+
+    def move_axes_and_wait(
+        self,
+        targets: dict[str, int|float] = None,
+        polling_frequency: int = 100,
+        timeout_margin: float = 1.0,
+    ) -> dict:
+        # Motion completion with as few HTTP requests as possible: one moveAbsolute per axis, all sent before waiting,
+        # then a single stream of status polls over the axes still moving. The expected travel time comes from the
+        # commanded velocity and the last known position (no extra get_position); polling starts when the slowest axis
+        # should be arriving and gives up at that time + timeout_margin. Final positions come from the last status payloads.
+        # Returns a report: reached (every axis on target), per axis final position, the axes that failed, travel/settle
+        # times and the HTTP calls/latency spent on this move.
+        if not targets:
+            raise ValueError("Positioner.move_axes_and_wait(): at least one axis target must be given.")
+
+        targets = {self._validate_axis(axis): position for axis, position in targets.items()}
+        for axis, position in targets.items():
+            if not isinstance(position, (int, float)):
+                raise ValueError(f"Position of {axis} must be a numeric value")
+
+        calls_start, http_time_start = self.http_calls, self.http_time
+        move_start = time.perf_counter()
+
+        travel_time = 0
+        for axis, position in targets.items():
+            try:
+                if axis not in self.position:
+                    self.get_status(axis)
+            except (ConnectionError, requests.RequestException):
+                continue                    # unknown start: no expected travel time, the polls cover it
+            travel_time = max(travel_time, abs(round(position - self.position[axis], 9)) / self.velocity[axis])
+
+        # A refused or unanswered moveAbsolute (e.g. a transient 503 or timeout) is reported as a failed axis, for the
+        # caller's retry path. The requests exceptions are not builtin ConnectionErrors.
+        refused = []
+        for axis, position in targets.items():
+            try:
+                response = self._request("POST", f"{self.axis_url[axis]}/methods/moveAbsolute(double:pos)", data=format(position, '.17f'), headers={"Content-Type": "text/plain"})
+            except requests.RequestException:
+                refused.append(axis)
+                continue
+            if response.status_code != 200:
+                refused.append(axis)
+
+        moving = set(targets) - set(refused)
+        if moving:
+            time.sleep(max(0, travel_time - (time.perf_counter() - move_start)))
+        settle_start = time.perf_counter()
+        deadline = move_start + travel_time + timeout_margin
+
+        polls = 0
+        while moving:
+            for axis in list(moving):
+                try:
+                    if not self.get_status(axis)["moving"]:
+                        moving.discard(axis)
+                except (ConnectionError, requests.RequestException):
+                    pass                    # transient failure: the axis is polled again, or fails at the deadline
+            polls += 1
+            if not moving or time.perf_counter() > deadline:
+                break
+            time.sleep(1/polling_frequency)
+
+        end = time.perf_counter()
+        failed = [axis for axis, position in targets.items() if axis in moving or axis in refused or self.position.get(axis) != round(position, 9)]
+        return {
+            "targets": {axis: round(position, 9) for axis, position in targets.items()},
+            "positions": {axis: self.position.get(axis) for axis in targets},
+            "reached": not failed,
+            "failed": failed,
+            "refused": refused,
+            "timed-out": bool(moving),
+            "travel-s": round(settle_start - move_start, 6),
+            "settle-s": round(end - settle_start, 6),
+            "polls": polls,
+            "http-calls": self.http_calls - calls_start,
+            "http-time-s": round(self.http_time - http_time_start, 6),
+        }
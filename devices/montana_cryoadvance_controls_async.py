@@ -0,0 +1,362 @@
+'''
+Versione asyncio dei driver Montana (CryoController e Positioner), con le stesse funzionalità di
+devices/montana_cryoadvance_controls.py: stessi metodi e stessi report, ma ogni richiesta HTTP è una coroutine.
+
+Ogni oggetto usa un httpx.AsyncClient con connessioni keep-alive, gli stessi timeout per endpoint del trasporto sincrono
+(devices/montana_transport.py) e tentativi ripetuti sugli errori di connessione. Così posizionatore, telemetria del
+criostato e lettura del TC1000 (in un thread, asyncio.to_thread) possono procedere insieme sullo stesso event loop.
+
+Il Positioner va creato con `await Positioner.create(ip)`, che legge le velocità degli assi.
+'''
+
+import json
+import time
+import asyncio
+import httpx
+from devices.montana_transport import DEFAULT_TIMEOUT, ENDPOINT_TIMEOUTS
+
+
+def _timeout(endpoint: str) -> httpx.Timeout:
+    for suffix, (connect, read) in ENDPOINT_TIMEOUTS.items():
+        if endpoint.endswith(suffix):
+            return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(DEFAULT_TIMEOUT[1], connect=DEFAULT_TIMEOUT[0])
+
+
+class AsyncMontanaClient:
+    # httpx counterpart of MontanaTransport: pooled keep-alive client with per endpoint timeouts and latency counters.
+    def __init__(self, host: str, port: int, retries: int = 2, pool_size: int = 4):
+        if not host or type(host) is not str:
+            raise ValueError("AsyncMontanaClient.__init__(): host must be provided")
+
+        self.base_url = f"http://{host}:{port}/v1"
+        self.endpoint_stats = {}
+        self.client = httpx.AsyncClient(
+            transport=httpx.AsyncHTTPTransport(retries=retries),         # retries connection errors only
+            limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+        )
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        if not url.startswith("http"):
+            url = f"{self.base_url}{url}"
+        endpoint = url[len(self.base_url):] if url.startswith(self.base_url) else url
+        kwargs.setdefault("timeout", _timeout(endpoint))
+
+        request_start = time.perf_counter()
+        failed = True
+        try:
+            response = await self.client.request(method, url, **kwargs)
+            failed = response.status_code >= 400
+            return response
+        finally:
+            elapsed = time.perf_counter() - request_start
+            stats = self.endpoint_stats.setdefault(f"{method.upper()} {endpoint}", {"calls": 0, "errors": 0, "total-s": 0, "max-s": 0})
+            stats["calls"] += 1
+            stats["errors"] += failed
+            stats["total-s"] += elapsed
+            stats["max-s"] = max(stats["max-s"], elapsed)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def put(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("PUT", url, **kwargs)
+
+    def stats(self) -> dict:
+        report = {
+            endpoint: {**stats, "total-s": round(stats["total-s"], 6), "max-s": round(stats["max-s"], 6),
+                       "mean-s": round(stats["total-s"] / stats["calls"], 6)}
+            for endpoint, stats in self.endpoint_stats.items()
+        }
+        return dict(sorted(report.items(), key=lambda item: -item[1]["total-s"]))
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+############################################## Main CryoController Functions ############################################
+
+class CryoController:
+
+    def __init__(self, IPaddress: str, port: int = 47101):
+
+        if not IPaddress or type(IPaddress) is not str:
+            raise ValueError("CryoController.__init__(): IP address must be provided")
+
+        self.IPaddress = IPaddress
+        self.base_url = f"http://{IPaddress}:{port}/v1"
+        self.url = f"{self.base_url}/controller"
+        self.vacuum_pump_url = f"{self.base_url}/vacuumSystem"
+        self.client = AsyncMontanaClient(IPaddress, port)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def get_status(self, string: bool = False):
+        response = await self.client.get(f"{self.url}/properties/systemState")
+        response_json = response.json()
+        return json.dumps(response_json, indent=4) if string else response_json
+
+    async def get_goal(self, string: bool = False):
+        response = await self.client.get(f"{self.url}/properties/systemGoal")
+        response_json = response.json()
+        return json.dumps(response_json, indent=4) if string else response_json
+
+    async def abort_goal(self) -> bool:
+        response = await self.client.post(f"{self.url}/methods/abortGoal()")
+        return response.status_code == 200
+
+############################################## vacuum system functions #################################################
+
+    async def get_target_pressure(self):
+        response = await self.client.get(f"{self.url}/properties/pullVacuumTargetPressure")
+        return response.json()['pullVacuumTargetPressure']
+
+    async def get_pressure(self):
+        response = await self.client.get(f"{self.vacuum_pump_url}/vacuumGauges/sampleChamberPressure/properties/pressureSample")
+        return response.json()['pressureSample']
+
+    async def pull_vacuum(self) -> bool:
+        response = await self.client.post(f"{self.url}/methods/pullVacuum()")
+        return response.status_code == 200
+
+    async def vent(self) -> bool:
+        response = await self.client.post(f"{self.url}/methods/vent()")
+        return response.status_code == 200
+
+################################################ cooler functions #####################################################
+
+    async def get_target_temperature(self):
+        response = await self.client.get(f"{self.url}/properties/platformTargetTemperature")
+        return response.json()["platformTargetTemperature"]
+
+    async def set_target_temperature(self, temperature) -> bool:
+        data = {"platformTargetTemperature": temperature}
+        response = await self.client.put(f"{self.url}/properties/platformTargetTemperature", json=data)
+        return response.status_code == 200
+
+    async def cooldown(self) -> bool:
+        response = await self.client.post(f"{self.url}/methods/cooldown()")
+        return response.status_code == 200
+
+    async def warmup(self) -> bool:
+        response = await self.client.post(f"{self.url}/methods/warmup()")
+        return response.status_code == 200
+
+    async def close(self):
+        await self.client.aclose()
+
+
+######################################### Rookie Nanopositioner Functions ###########################################
+
+class Positioner:
+    def __init__(self, IPaddress: str, port: int = 47171):
+        # Use `await Positioner.create(ip)`: the velocity cache needs the axes velocities read from the controller.
+        self.base_url = f"http://{IPaddress}:{port}/v1"
+        self.axes_base_url = f"{self.base_url}/stacks/stack1/axes"
+        self.axis_url = {'X': f"{self.axes_base_url}/axis2", 'Y': f"{self.axes_base_url}/axis1", 'Z': f"{self.axes_base_url}/axis3"}
+        self.client = AsyncMontanaClient(IPaddress, port)
+        self.http_calls = 0                 # HTTP requests sent and time spent waiting for them, see move_and_wait() reports
+        self.http_time = 0
+        self.position = {}                  # last theoreticalPosition seen in a status payload, per axis
+        self.velocity = {}
+
+    @classmethod
+    async def create(cls, IPaddress: str, port: int = 47171):
+        positioner = cls(IPaddress, port)
+        velocities = await asyncio.gather(*(positioner.get_velocity(axis) for axis in ('X', 'Y', 'Z')))
+        positioner.velocity = dict(zip(('X', 'Y', 'Z'), velocities))
+        return positioner
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        request_start = time.perf_counter()
+        try:
+            return await self.client.request(method, url, **kwargs)
+        finally:
+            self.http_calls += 1
+            self.http_time += time.perf_counter() - request_start
+
+    @staticmethod
+    def _validate_axis(axis):
+        if axis not in ['X', 'Y', 'Z']:
+            raise ValueError("Axis must be 'X', 'Y', or 'Z'")
+        return axis
+
+    async def get_status(self, axis: str = '') -> dict:
+        axis = self._validate_axis(axis)
+
+        response = await self._request("GET", f"{self.axis_url[axis]}/properties/status")
+        if response.status_code != 200:
+            raise ConnectionError(f"Positioner.get_status(): status of {axis} not available ({response.status_code}).")
+        status = response.json()['status']
+        self.position[axis] = round(status["theoreticalPosition"], 9)
+        return status
+
+    async def is_connected(self) -> bool:
+        response = await self._request("GET", f"{self.base_url}/motionController/properties/deviceConnected")
+        return response.json()["deviceConnected"]
+
+    async def get_position(self, axis: str = '') -> float:
+        axis = self._validate_axis(axis)
+
+        return round((await self.get_status(axis))["theoreticalPosition"], 9)
+
+    async def get_velocity(self, axis: str = '') -> float:
+        axis = self._validate_axis(axis)
+
+        response = await self._request("GET", f"{self.axis_url[axis]}/properties/velocity")
+        return response.json()["velocity"]
+
+    async def stop(self, axis: str = '') -> bool:
+        axis = self._validate_axis(axis)
+
+        response = await self._request("POST", f"{self.axis_url[axis]}/methods/stop()")
+        return response.status_code == 200
+
+    async def move_to_position(self, axis: str = '', position: int|float = None, blocking: bool = True) -> bool:
+        axis = self._validate_axis(axis)
+
+        if not isinstance(position, (int, float)):
+            raise ValueError("Position must be a numeric value")
+
+        if blocking:
+            travel_time = abs(round(position - await self.get_position(axis), 9)) / self.velocity[axis]
+        response = await self._request("POST", f"{self.axis_url[axis]}/methods/moveAbsolute(double:pos)", content=format(position, '.17f'), headers={"Content-Type": "text/plain"})
+        if blocking:
+            await asyncio.sleep(travel_time)
+        return response.status_code == 200
+
+    async def zero_position(self, axis: str = '') -> bool:
+        axis = self._validate_axis(axis)
+
+        response = await self._request("POST", f"{self.axis_url[axis]}/methods/zero()")
+        if response.status_code == 200:
+            self.position[axis] = 0
+            return True
+        return False
+
+    async def move_to_limit(self, axis: str = '', direction: str = 'positive') -> bool:
+        axis = self._validate_axis(axis)
+
+        if direction not in ['positive', 'negative']:
+            raise ValueError("Direction must be 'positive' or 'negative'")
+
+        method = "moveToPositiveLimit()" if direction == 'positive' else "moveToNegativeLimit()"
+        response = await self._request("POST", f"{self.axis_url[axis]}/methods/{method}")
+        return response.status_code == 200
+
+    async def set_velocity(self, axis: str = '', velocity: int|float = None) -> bool:
+        axis = self._validate_axis(axis)
+
+        if not isinstance(velocity, (int, float)) or velocity <= 0:
+            raise ValueError("Velocity must be a positive numeric value")
+
+        response = await self._request("PUT", f"{self.axis_url[axis]}/properties/velocity", json={"velocity": velocity})
+        if response.status_code == 200:
+            self.velocity[axis] = velocity
+            return True
+        return False
+
+    async def wait_end_motion(self, axis: str = '', polling_frequency = 100):
+
+        start=time.time()
+
+        while (await self.get_status(axis))["moving"]:
+            await asyncio.sleep(1/polling_frequency)
+
+        end=time.time()
+
+        return {round(end-start, 6)}
+
+    async def move_and_wait(
+        self,
+        axis: str = '',
+        position: int|float = None,
+        polling_frequency: int = 100,
+        timeout_margin: float = 1.0,
+    ) -> dict:
+        axis = self._validate_axis(axis)
+        report = await self.move_axes_and_wait({axis: position}, polling_frequency, timeout_margin)
+        report.update({"axis": axis, "target": report["targets"][axis], "position": report["positions"][axis]})
+        return report
+
+    async def move_axes_and_wait(
+        self,
+        targets: dict[str, int|float] = None,
+        polling_frequency: int = 100,
+        timeout_margin: float = 1.0,
+    ) -> dict:
+        # Same algorithm and report as the sync Positioner.move_axes_and_wait(), but the moveAbsolute requests and
+        # every round of status polls are sent concurrently.
+        if not targets:
+            raise ValueError("Positioner.move_axes_and_wait(): at least one axis target must be given.")
+
+        targets = {self._validate_axis(axis): position for axis, position in targets.items()}
+        for axis, position in targets.items():
+            if not isinstance(position, (int, float)):
+                raise ValueError(f"Position of {axis} must be a numeric value")
+
+        calls_start, http_time_start = self.http_calls, self.http_time
+        move_start = time.perf_counter()
+
+        # An axis whose start is unknown (status not available) has no expected travel time, the polls cover it
+        await asyncio.gather(*(self.get_status(axis) for axis in targets if axis not in self.position), return_exceptions=True)
+        travel_time = max((abs(round(position - self.position[axis], 9)) / self.velocity[axis] for axis, position in targets.items() if axis in self.position), default=0)
+
+        responses = await asyncio.gather(*(
+            self._request("POST", f"{self.axis_url[axis]}/methods/moveAbsolute(double:pos)", content=format(position, '.17f'), headers={"Content-Type": "text/plain"})
+            for axis, position in targets.items()
+        ))
+        # A refused moveAbsolute (e.g. a transient 503) is reported as a failed axis, for the caller's retry path
+        refused = [axis for axis, response in zip(targets, responses) if response.status_code != 200]
+
+        moving = set(targets) - set(refused)
+        if moving:
+            await asyncio.sleep(max(0, travel_time - (time.perf_counter() - move_start)))
+        settle_start = time.perf_counter()
+        deadline = move_start + travel_time + timeout_margin
+
+        polls = 0
+        while moving:
+            polled = list(moving)
+            statuses = await asyncio.gather(*(self.get_status(axis) for axis in polled), return_exceptions=True)
+            for status in statuses:
+                if isinstance(status, Exception) and not isinstance(status, ConnectionError):
+                    raise status
+            # transient failures (ConnectionError) keep the axis in the polled set, it fails at the deadline otherwise
+            moving = {axis for axis, status in zip(polled, statuses) if isinstance(status, ConnectionError) or status["moving"]}
+            polls += 1
+            if not moving or time.perf_counter() > deadline:
+                break
+            await asyncio.sleep(1/polling_frequency)
+
+        end = time.perf_counter()
+        failed = [axis for axis, position in targets.items() if axis in moving or axis in refused or self.position.get(axis) != round(position, 9)]
+        return {
+            "targets": {axis: round(position, 9) for axis, position in targets.items()},
+            "positions": {axis: self.position.get(axis) for axis in targets},
+            "reached": not failed,
+            "failed": failed,
+            "refused": refused,
+            "timed-out": bool(moving),
+            "travel-s": round(settle_start - move_start, 6),
+            "settle-s": round(end - settle_start, 6),
+            "polls": polls,
+            "http-calls": self.http_calls - calls_start,
+            "http-time-s": round(self.http_time - http_time_start, 6),
+        }
+
+    async def close(self):
+        await self.client.aclose()
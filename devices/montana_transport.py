@@ -0,0 +1,133 @@
+'''
+Trasporto HTTP condiviso per i driver Montana (CryoController, Positioner, InformazioniMontana).
+
+Una sola requests.Session per host/porta, con pool di connessioni keep-alive: le richieste di una scansione riusano
+la stessa connessione TCP invece di aprirne una nuova ogni volta. Ogni richiesta ha un timeout (per endpoint, con un
+default), le richieste idempotenti (GET/PUT) vengono ritentate un numero limitato di volte su errori di connessione o
+502/503/504, e per ogni endpoint si tengono conteggio, errori e latenza.
+
+Per ottenere il trasporto di un host/porta usare get_transport(), che restituisce sempre la stessa istanza.
+'''
+
+import time
+import requests
+from threading import Lock
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+DEFAULT_TIMEOUT = (2, 5)            # (connect, read) seconds
+
+# Endpoints slower than the default, matched on the end of the path.
+ENDPOINT_TIMEOUTS = {
+    "moveAbsolute(double:pos)": (2, 10),
+    "zero()": (2, 10),
+    "cooldown()": (2, 15),
+    "warmup()": (2, 15),
+    "pullVacuum()": (2, 15),
+    "vent()": (2, 15),
+}
+
+
+class MontanaTransport:
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        retries: int = 2,
+        backoff: float = 0.1,
+        pool_size: int = 4,
+        timeout: tuple = DEFAULT_TIMEOUT,
+        endpoint_timeouts: dict = None,
+    ):
+        if not host or type(host) is not str:
+            raise ValueError("MontanaTransport.__init__(): host must be provided")
+
+        self.base_url = f"http://{host}:{port}/v1"
+        self.timeout = timeout
+        self.endpoint_timeouts = dict(ENDPOINT_TIMEOUTS if endpoint_timeouts is None else endpoint_timeouts)
+        self.endpoint_stats = {}            # "METHOD /path" -> {"calls", "errors", "total-s", "max-s"}
+        self._stats_lock = Lock()
+
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "PUT"}),      # POST methods (moves, cooldown...) are never repeated
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+
+    def _endpoint(self, url: str) -> str:
+        return url[len(self.base_url):] if url.startswith(self.base_url) else url
+
+    def _timeout_for(self, endpoint: str):
+        for suffix, timeout in self.endpoint_timeouts.items():
+            if endpoint.endswith(suffix):
+                return timeout
+        return self.timeout
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        # Same interface as requests.request(); `url` may be absolute or a path relative to base_url.
+        if not url.startswith("http"):
+            url = f"{self.base_url}{url}"
+        endpoint = self._endpoint(url)
+        kwargs.setdefault("timeout", self._timeout_for(endpoint))
+
+        request_start = time.perf_counter()
+        failed = True
+        try:
+            response = self.session.request(method, url, **kwargs)
+            failed = response.status_code >= 400
+            return response
+        finally:
+            elapsed = time.perf_counter() - request_start
+            with self._stats_lock:
+                stats = self.endpoint_stats.setdefault(f"{method.upper()} {endpoint}", {"calls": 0, "errors": 0, "total-s": 0, "max-s": 0})
+                stats["calls"] += 1
+                stats["errors"] += failed
+                stats["total-s"] += elapsed
+                stats["max-s"] = max(stats["max-s"], elapsed)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> requests.Response:
+        return self.request("PUT", url, **kwargs)
+
+    def stats(self) -> dict:
+        # Per endpoint counters with the mean latency, slowest endpoints first.
+        with self._stats_lock:
+            report = {
+                endpoint: {**stats, "total-s": round(stats["total-s"], 6), "max-s": round(stats["max-s"], 6),
+                           "mean-s": round(stats["total-s"] / stats["calls"], 6)}
+                for endpoint, stats in self.endpoint_stats.items()
+            }
+        return dict(sorted(report.items(), key=lambda item: -item[1]["total-s"]))
+
+    def reset_stats(self):
+        with self._stats_lock:
+            self.endpoint_stats.clear()
+
+    def close(self):
+        self.session.close()
+
+
+_transports = {}
+_transports_lock = Lock()
+
+
+def get_transport(host: str, port: int, **kwargs) -> MontanaTransport:
+    # Shared instance per host/port, so every driver talking to the same server uses the same connection pool.
+    # kwargs only apply when the transport is created.
+    with _transports_lock:
+        if (host, port) not in _transports:
+            _transports[(host, port)] = MontanaTransport(host, port, **kwargs)
+        return _transports[(host, port)]
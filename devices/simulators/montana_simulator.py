@@ -0,0 +1,350 @@
+import re
+import sys
+import json
+import time
+import random
+import socket
+import numpy as np
+from threading import Thread, Lock
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+'''
+Simulatore locale del criostato Montana CryoAdvance-50 e del nanoposizionatore Rook.
+
+Due server HTTP (controller sulla 47101, posizionatore sulla 47171) con gli endpoint usati da CryoController,
+Positioner (sincroni e asincroni) e InformazioniMontana:
+
+    - controller: proprietà (systemState, systemGoal, pressioni, temperature, cryocooler...), PUT delle proprietà
+      scrivibili, metodi cooldown() / warmup() / pullVacuum() / vent() / abortGoal()
+    - posizionatore: status (moving, theoreticalPosition) e velocity di ogni asse, PUT velocity, moveAbsolute(double:pos),
+      zero(), stop(), moveToPositiveLimit() / moveToNegativeLimit(), deviceConnected, canAbortGoal.
+
+Un movimento dura distanza / velocità (più un tempo di assestamento): durante il movimento lo status riporta
+moving = true e la posizione interpolata, alla fine esattamente la posizione richiesta. Ogni risposta è ritardata di
+una latenza con jitter; si può anche far fallire una frazione delle richieste (503) per provare ritentativi e recuperi.
+Le connessioni sono HTTP/1.1 keep-alive, come quelle del trasporto condiviso.
+
+    with MontanaSimulator(controller_port=47101, positioner_port=47171) as montana:
+        positioner = Positioner("127.0.0.1")
+        positioner.move_and_wait("X", 1e-5)
+        montana.axes["X"].position_at(time.time())
+
+Da riga di comando: python -m devices.simulators.montana_simulator [porta controller] [porta posizionatore]
+'''
+
+CONTROLLER_PORT = 47101
+POSITIONER_PORT = 47171
+
+AXIS_NAMES = {"axis1": "Y", "axis2": "X", "axis3": "Z"}        # same mapping as Positioner.axis_url
+
+CONTROLLER_PROPERTIES = {
+    "/controller/properties/systemState": "Ready",
+    "/controller/properties/systemGoal": "None",
+    "/controller/properties/canAbortGoal": False,
+    "/controller/properties/pullVacuumTargetPressure": 0.0001,
+    "/controller/properties/platformTargetTemperature": 3.2,
+    "/controller/properties/platformTemperature": 3.2,
+    "/vacuumSystem/vacuumGauges/sampleChamberPressure/properties/pressureSample": 2.1e-6,
+    "/cooler/cryocooler/properties/cryocoolerRunning": True,
+    "/cooler/cryocooler/properties/deviceConnected": True,
+    "/cooler/cryocooler/properties/compressorHours": 1234.5,
+    "/cooler/cryocooler/properties/cryocoolerSpeed": 60,
+    "/cooler/cryocooler/properties/compressorSpeed": 60,
+    "/cooler/cryocooler/properties/targetCompressorSpeed": 60,
+    "/cooler/cryocooler/properties/targetCryocoolerSpeed": 60,
+    "/cooler/cryocooler/properties/returnPressure": 0.7,
+    "/cooler/cryocooler/properties/supplyPressure": 1.9,
+    "/cooler/cryocooler/properties/alarms": [],
+    "/cooler/cryocooler/properties/operationState": "Running",
+}
+WRITABLE_PROPERTIES = ("platformTargetTemperature", "pullVacuumTargetPressure")
+
+# Controller methods: goal they start and system state once reached
+CONTROLLER_METHODS = {
+    "cooldown()": ("Cooldown", "Ready"),
+    "warmup()": ("Warmup", "Warm"),
+    "pullVacuum()": ("PullVacuum", "Vacuum"),
+    "vent()": ("Vent", "Vented"),
+}
+
+
+class SimulatedAxis:
+    # Constant velocity motion. The last `history` moves are kept as segments (start time, start, target, velocity) in
+    # the physical frame, so position_at() also answers for past times and for arrays of times (e.g. the time bins of a
+    # fly scan). zero() only moves the reported frame: physical = reported + offset.
+    def __init__(self, velocity: float = 1e-3, limits: tuple = (-6e-3, 6e-3), settle_s: float = 0.0, history: int = 64):
+        self.velocity = velocity            # m/s
+        self.limits = limits                # travel range, reported frame
+        self.settle_s = settle_s            # still "moving" this long after reaching the target
+        self.offset = 0.0
+        self.segments = [(0.0, 0.0, 0.0, velocity)]
+        self.history = history
+        self.t_end = 0.0
+        self.moves = 0
+
+    @property
+    def target(self) -> float:
+        return self.segments[-1][2] - self.offset
+
+    @staticmethod
+    def _along(segment: tuple, t):
+        t_start, start, target, velocity = segment
+        travel = abs(target - start) / velocity
+        if travel == 0:
+            return target + 0 * np.asarray(t, dtype=float) if isinstance(t, np.ndarray) else target
+        fraction = np.clip((t - t_start) / travel, 0, 1)
+        # Exactly the target once arrived, as the status payload of the real controller
+        return np.where(fraction >= 1, target, start + (target - start) * fraction) if isinstance(t, np.ndarray) else \
+            (target if fraction >= 1 else start + (target - start) * float(fraction))
+
+    def physical_at(self, t):
+        if not isinstance(t, np.ndarray):
+            for segment in reversed(self.segments):
+                if segment[0] <= t:
+                    return self._along(segment, t)
+            return self.segments[0][1]
+
+        starts = np.array([segment[0] for segment in self.segments])
+        which = np.clip(np.searchsorted(starts, t, side="right") - 1, 0, None)
+        position = np.empty(t.shape)
+        for i in np.unique(which):
+            position[which == i] = self._along(self.segments[i], t[which == i])
+        return position
+
+    def position_at(self, t):
+        return self.physical_at(t) - self.offset
+
+    def moving(self, t: float) -> bool:
+        return t < self.t_end
+
+    def _segment(self, t: float, target: float):
+        start = self.physical_at(t)
+        self.segments.append((t, start, target, self.velocity))
+        del self.segments[:-self.history]
+        return start
+
+    def move_to(self, target: float, t: float) -> bool:
+        if not self.limits[0] <= target <= self.limits[1]:
+            return False
+        start = self._segment(t, target + self.offset)
+        self.t_end = t + abs(target + self.offset - start) / self.velocity + self.settle_s
+        self.moves += 1
+        return True
+
+    def stop(self, t: float):
+        self._segment(t, self.physical_at(t))
+        self.t_end = t
+
+    def zero(self, t: float):
+        self.stop(t)
+        self.offset = self.physical_at(t)
+
+
+class MontanaSimulator:
+    def __init__(
+        self,
+        address: str = "127.0.0.1",
+        controller_port: int = CONTROLLER_PORT,
+        positioner_port: int = POSITIONER_PORT,
+        velocity: float = 1e-3,
+        settle_s: float = 0.005,
+        latency_s: float = 0.002,
+        jitter_s: float = 0.001,
+        error_rate: float = 0.0,
+        goal_duration_s: float = 2.0,
+        seed: int = None,
+        verbose: bool = False,
+    ):
+        self.address = address
+        self.ports = {"controller": controller_port, "positioner": positioner_port}
+        self.axes = {axis: SimulatedAxis(velocity, settle_s=settle_s) for axis in AXIS_NAMES.values()}
+        self.latency_s = latency_s          # added to every answer, with a uniform jitter of +/- jitter_s
+        self.jitter_s = jitter_s
+        self.error_rate = error_rate        # fraction of the requests answered 503
+        self.goal_duration_s = goal_duration_s
+        self.verbose = verbose
+        self.random = random.Random(seed)
+
+        self.properties = dict(CONTROLLER_PROPERTIES)
+        self.goal = None                    # (goal, final state, end time) of the running controller method
+        self.requests = {}                  # "METHOD /path" -> count
+        self._lock = Lock()
+        self._servers = []
+
+    ############################################ server ############################################
+
+    def start(self):
+        for name, port in self.ports.items():
+            server = ThreadingHTTPServer((self.address, port), _handler(self, name))
+            server.daemon_threads = True
+            Thread(target=server.serve_forever, daemon=True).start()
+            self._servers.append(server)
+
+    def stop(self):
+        for server in self._servers:
+            server.shutdown()
+            server.server_close()
+        self._servers.clear()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def delay(self) -> float:
+        with self._lock:
+            return max(0.0, self.latency_s + (self.random.uniform(-self.jitter_s, self.jitter_s) if self.jitter_s else 0))
+
+    def fail(self) -> bool:
+        with self._lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    ############################################ endpoints ############################################
+
+    def handle(self, server: str, method: str, path: str, body: bytes) -> tuple[int, object]:
+        # Returns (HTTP status, JSON payload).
+        path = path.split("?", 1)[0]
+        if not path.startswith("/v1/"):
+            return 404, {"error": f"unknown endpoint {path}"}
+        path = path[len("/v1"):]
+        now = time.time()
+
+        with self._lock:
+            self.requests[f"{method} {path}"] = self.requests.get(f"{method} {path}", 0) + 1
+            if server == "controller":
+                return self._controller(method, path, body, now)
+            return self._positioner(method, path, body, now)
+
+    def _controller(self, method: str, path: str, body: bytes, now: float) -> tuple[int, object]:
+        if self.goal and now >= self.goal[2]:
+            self.properties["/controller/properties/systemState"] = self.goal[1]
+            self.properties["/controller/properties/systemGoal"] = "None"
+            self.properties["/controller/properties/canAbortGoal"] = False
+            self.goal = None
+
+        name = path.rsplit("/", 1)[-1]
+        if method == "GET" and path in self.properties:
+            return 200, {name: self.properties[path]}
+        if method == "PUT" and path in self.properties and name in WRITABLE_PROPERTIES:
+            value = _json(body).get(name)
+            if not isinstance(value, (int, float)):
+                return 400, {"error": f"{name} must be a number"}
+            self.properties[path] = value
+            return 200, {}
+        if method == "POST" and path.startswith("/controller/methods/"):
+            if name == "abortGoal()":
+                self.goal = None
+                self.properties["/controller/properties/systemGoal"] = "None"
+                self.properties["/controller/properties/canAbortGoal"] = False
+                return 200, {}
+            if name in CONTROLLER_METHODS:
+                goal, state = CONTROLLER_METHODS[name]
+                self.goal = (goal, state, now + self.goal_duration_s)
+                self.properties["/controller/properties/systemGoal"] = goal
+                self.properties["/controller/properties/canAbortGoal"] = True
+                return 200, {}
+        return 404, {"error": f"unknown endpoint {method} {path}"}
+
+    def _positioner(self, method: str, path: str, body: bytes, now: float) -> tuple[int, object]:
+        if method == "GET" and path == "/motionController/properties/deviceConnected":
+            return 200, {"deviceConnected": True}
+        if method == "GET" and path == "/controller/properties/canAbortGoal":
+            return 200, {"canAbortGoal": any(axis.moving(now) for axis in self.axes.values())}
+
+        match = re.match(r"^/stacks/stack1/axes/(axis\d)/(properties|methods)/(.+)$", path)
+        if not match or match.group(1) not in AXIS_NAMES:
+            return 404, {"error": f"unknown endpoint {method} {path}"}
+        axis = self.axes[AXIS_NAMES[match.group(1)]]
+        kind, name = match.group(2), match.group(3)
+
+        if kind == "properties" and name == "status" and method == "GET":
+            position = axis.position_at(now)
+            return 200, {"status": {
+                "theoreticalPosition": position,
+                "moving": axis.moving(now),
+                "positionReached": not axis.moving(now) and position == axis.target,
+                "atPositiveLimit": position >= axis.limits[1],
+                "atNegativeLimit": position <= axis.limits[0],
+            }}
+        if kind == "properties" and name == "velocity":
+            if method == "GET":
+                return 200, {"velocity": axis.velocity}
+            if method == "PUT":
+                value = _json(body).get("velocity")
+                if not isinstance(value, (int, float)) or value <= 0:
+                    return 400, {"error": "velocity must be a positive number"}
+                axis.velocity = value
+                return 200, {}
+        if kind == "methods" and method == "POST":
+            if name == "moveAbsolute(double:pos)":
+                try:
+                    target = float(body.decode().strip())
+                except ValueError:
+                    return 400, {"error": "position must be a number"}
+                return (200, {}) if axis.move_to(target, now) else (400, {"error": f"{target} outside of the travel range"})
+            if name == "stop()":
+                axis.stop(now)
+                return 200, {}
+            if name == "zero()":
+                axis.zero(now)
+                return 200, {}
+            if name in ("moveToPositiveLimit()", "moveToNegativeLimit()"):
+                axis.move_to(axis.limits[1] if "Positive" in name else axis.limits[0], now)
+                return 200, {}
+        return 404, {"error": f"unknown endpoint {method} {path}"}
+
+
+def _json(body: bytes) -> dict:
+    try:
+        payload = json.loads(body or b"{}")
+        return payload if isinstance(payload, dict) else {}
+    except ValueError:
+        return {}
+
+
+def _handler(simulator: MontanaSimulator, server: str):
+    class MontanaRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"           # keep-alive, like the pooled sessions of the drivers
+
+        def setup(self):
+            super().setup()
+            # Headers and body are written separately: without this, Nagle + delayed ACK add ~40 ms per answer
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+        def _serve(self):
+            body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+            time.sleep(simulator.delay())
+            if simulator.fail():
+                status, payload = 503, {"error": "simulated failure"}
+            else:
+                status, payload = simulator.handle(server, self.command, self.path, body)
+
+            answer = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(answer)))
+            self.end_headers()
+            self.wfile.write(answer)
+
+        do_GET = do_POST = do_PUT = _serve
+
+        def log_message(self, format, *args):
+            if simulator.verbose:
+                super().log_message(format, *args)
+
+    return MontanaRequestHandler
+
+
+if __name__ == "__main__":
+    controller_port = int(sys.argv[1]) if len(sys.argv) > 1 else CONTROLLER_PORT
+    positioner_port = int(sys.argv[2]) if len(sys.argv) > 2 else POSITIONER_PORT
+    simulator = MontanaSimulator(controller_port=controller_port, positioner_port=positioner_port, verbose=True)
+    simulator.start()
+    print(f"Montana simulator listening on {simulator.address}:{controller_port} / {positioner_port} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
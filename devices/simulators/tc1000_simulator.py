@@ -0,0 +1,460 @@
+import re
+import sys
+import time
+import zmq
+import numpy as np
+from dataclasses import dataclass
+from threading import Thread, Lock, Event
+from utils.common import SCPI_PORT
+from utils.consts import HIST_BCOU_RANGE, HIST_BWID_RANGE
+
+'''
+Simulatore locale del Time Controller IDQ TC1000.
+
+Un server zmq REP che risponde al sottoinsieme SCPI usato da TimeController, TCCounter, TCToL e utils/acquisitions,
+così che acquisizioni e scansioni si possano eseguire e cronometrare senza lo strumento:
+
+    - INPUx/STARt: THREshold, ENABle, COUNter? con COUNter:INTEgration / MODE (CYCLe, ACCUm) / RESEt
+    - DELAn:VALUe, DEVIce:CONFiguration:LOAD, DEVIce:RESolution:BWIDth?
+    - HISTn: BWIDth, BCOUnt, FLUSh, DATA?, REFerence:LINK, STOP:LINK
+    - RECord: TRIGger:ARM:MODE, ENABle, NUMber, DURation, PLAY, STOP, STAGe? (PLAYING per la durata reale del record)
+    - qualunque altra impostazione di nodi noti (TSCOn:WINDow..., RAWn:SEND...) viene memorizzata e riletta.
+
+Forme brevi e lunghe dei nodi, maiuscole/minuscole e concatenazione con ";" (relativa al nodo precedente) e ";:"
+(dalla radice) come sullo strumento, con una riga di risposta per comando.
+
+I conteggi sono poissoniani. Un istogramma il cui REF è collegato al generatore REC (counts over time) riceve in ogni
+bin i conteggi del suo intervallo di tempo, altrimenti è un istogramma ToL con la forma data dal modello di segnale,
+spostata dai ritardi (DELAn) dell'input di STOP. Il modello di segnale è intercambiabile: basta un oggetto con i metodi
+rate() e tol_histogram() di SignalModel, per esempio accoppiato alla posizione di un posizionatore simulato.
+
+    simulator = TC1000Simulator(signal=PeakSignal(rates={"STAR": 1e6, "INPU1": 5e4}))
+    simulator.start()
+    tc = TimeController("127.0.0.1")
+    ...
+    simulator.stop()
+
+Da riga di comando: python -m devices.simulators.tc1000_simulator [porta]
+'''
+
+# Node long forms, the short form is made of the upper case letters (SCPI convention)
+NODES = (
+    "RECord", "STAGe", "TRIGger", "ARM", "MODE", "ENABle", "STOP", "PLAY", "NUMber", "DURation",
+    "HISTogram", "BWIDth", "BCOUnt", "FLUSh", "DATA", "REFerence", "LINK",
+    "INPUt", "STARt", "COUNter", "INTEgration", "RESEt", "THREshold", "DELAy", "VALUe",
+    "DEVIce", "RESolution", "CONFiguration", "LOAD", "STATus",
+    "TSCO", "FIRst", "SECond", "OPIN", "OPOUt", "WINDow", "BEGIn", "END",
+    "RAW", "SEND", "ERRors", "CLEar",
+)
+_NODES = tuple(("".join(c for c in node if c.isupper()), node.upper()) for node in NODES)
+_NODE = re.compile(r"^([A-Za-z]+)(\d*)$")
+
+INPUT_BLOCKS = ("STAR", "INPU1", "INPU2", "INPU3", "INPU4")
+INPUT_DELAYS = {"INPU1": "DELA1", "INPU2": "DELA2", "INPU3": "DELA3", "INPU4": "DELA4"}
+# In the HISTO configuration TSCO5..8 only forward the inputs (see utils/acquisitions/counts_over_time.py)
+HISTO_TSCO_INPUTS = {"TSCO5": "INPU1", "TSCO6": "INPU2", "TSCO7": "INPU3", "TSCO8": "INPU4"}
+
+RESOLUTION_BWID = 1                 # ps, answer to DEVI:RES:BWID?
+UNITS = {"THRE": "V", "VALU": "TB"}
+NUMERIC = ("THRE", "VALU", "BWID", "BCOU", "DUR", "INTE", "DELA")         # last node of the numeric settings
+RANGES = {"HIST:BWID": HIST_BWID_RANGE, "HIST:BCOU": HIST_BCOU_RANGE}
+
+DEFAULT_SETTINGS = {
+    **{f"{block}:THRE": "-0.5" for block in INPUT_BLOCKS},
+    **{f"{block}:ENAB": "ON" for block in INPUT_BLOCKS},
+    **{f"{block}:COUN:MODE": "CYCL" for block in INPUT_BLOCKS},
+    **{f"{block}:COUN:INTE": "1000" for block in INPUT_BLOCKS},
+    **{f"DELA{i}:VALU": "0" for i in range(1, 9)},
+    **{f"HIST{i}:BWID": "100" for i in range(1, 5)},
+    **{f"HIST{i}:BCOU": "1000" for i in range(1, 5)},
+    **{f"HIST{i}:REF:LINK": "STAR" for i in range(1, 5)},
+    **{f"HIST{i}:STOP:LINK": f"INPU{i}" for i in range(1, 5)},
+    "REC:TRIG:ARM:MODE": "MANU",
+    "REC:ENAB": "ON",
+    "REC:NUM": "1",
+    "REC:DUR": "1000000000000",
+    "TSCO1:FIR:LINK": "NONE",
+}
+
+
+def canonical(node: str) -> str:
+    # Short form of one header node, index kept: "HISTogram1" / "hist1" -> "HIST1". KeyError if unknown.
+    match = _NODE.match(node.strip())
+    if match:
+        name, index = match.group(1).upper(), match.group(2)
+        for short, long in _NODES:
+            if name.startswith(short) and long.startswith(name):
+                return short + index
+    raise KeyError(node)
+
+
+@dataclass(frozen=True)
+class Peak:
+    position_ps: float                  # arrival time after the START, before the input delays
+    sigma_ps: float = 50                # gaussian jitter (detector + electronics)
+    tail_ps: float = 0                  # exponential decay (e.g. lifetime), 0 for a gaussian peak
+    weight: float = 1                   # relative area when several peaks are configured
+
+
+class SignalModel:
+    # Interface of the signal seen by the simulator. `t` is the wall time (time.time(), may be an array).
+
+    def rate(self, block: str, t) -> float:
+        # Event rate (counts/s) on a block: "STAR", "INPU1".., or "TSCOn" for coincidences.
+        return 0.0
+
+    def tol_histogram(self, block: str, edges_ps: np.ndarray, shift_ps: float, t: float) -> np.ndarray:
+        # Fraction of the STOP events of `block` that fall in each bin of the ToL histogram (edges in ps relative to
+        # the START), once the arrival times are moved by `shift_ps` (the input delay).
+        return np.zeros(len(edges_ps) - 1)
+
+
+class PeakSignal(SignalModel):
+    # Constant rates and, on the ToL histograms, a sum of gaussian / exponentially modified gaussian peaks over a flat
+    # background, repeated every `period_ps` (the laser period on the START: stops are timed from the last start).
+    def __init__(
+        self,
+        rates: dict = None,
+        peaks: list = None,
+        background: float = 0.05,
+        period_ps: float = 1e6,
+        samples: int = 200000,
+        seed: int = None,
+    ):
+        self.rates = {"STAR": 1e6, "INPU1": 2e4} if rates is None else dict(rates)
+        self.peaks = [Peak(2e5, 2000, 20000)] if peaks is None else list(peaks)
+        self.background = background
+        self.period_ps = period_ps
+
+        # The peak shape is sampled once; histograms are then one np.histogram of the shifted samples
+        rng = np.random.default_rng(seed)
+        weights = np.array([peak.weight for peak in self.peaks], dtype=float)
+        which = rng.choice(len(self.peaks), size=samples, p=weights / weights.sum())
+        position = np.array([peak.position_ps for peak in self.peaks])[which]
+        sigma = np.array([peak.sigma_ps for peak in self.peaks])[which]
+        tail = np.array([peak.tail_ps for peak in self.peaks])[which]
+        self._samples = position + rng.normal(0, 1, samples) * sigma + rng.exponential(1, samples) * tail
+        self._cache = (None, None)
+
+    def rate(self, block: str, t) -> float:
+        return self.rates.get(block, 0.0)
+
+    def tol_histogram(self, block: str, edges_ps: np.ndarray, shift_ps: float, t: float) -> np.ndarray:
+        # Same shape on every block: histograms of different inputs with the same binning share the cached entry
+        key = (edges_ps[0], edges_ps[-1], len(edges_ps), shift_ps)
+        if self._cache[0] == key:
+            return self._cache[1]
+
+        arrivals = self._samples + shift_ps
+        if self.period_ps:
+            arrivals = arrivals % self.period_ps
+        peak = np.histogram(arrivals, bins=edges_ps)[0] / len(arrivals)
+
+        widths = np.diff(edges_ps)
+        if self.period_ps:
+            # Bins past the period never see a stop: the next start has already arrived
+            inside = np.clip(np.minimum(edges_ps[1:], self.period_ps) - np.maximum(edges_ps[:-1], 0), 0, None)
+            flat = inside / self.period_ps
+        else:
+            flat = widths / max(edges_ps[-1] - edges_ps[0], 1)
+
+        probabilities = (1 - self.background) * peak + self.background * flat
+        self._cache = (key, probabilities)
+        return probabilities
+
+
+class _Histogram:
+    def __init__(self):
+        self.counts = None
+        self.updated = 0.0              # wall time up to which the counts are accumulated
+
+
+class _Counter:
+    def __init__(self):
+        self.value = 0
+        self.updated = time.time()
+
+
+class TC1000Simulator(Thread):
+    def __init__(
+        self,
+        address: str = "127.0.0.1",
+        port: int = SCPI_PORT,
+        signal: SignalModel = None,
+        seed: int = None,
+        latency_s: float = 0.0,
+        jitter_s: float = 0.0,
+        arm_delay_s: float = 0.001,
+        verbose: bool = False,
+    ):
+        Thread.__init__(self, daemon=True)
+        self.endpoint = f"tcp://{address}:{port}"
+        self.signal = signal if signal is not None else PeakSignal(seed=seed)
+        self.rng = np.random.default_rng(seed)
+        self.latency_s = latency_s          # added to every answer, with a uniform jitter of +/- jitter_s
+        self.jitter_s = jitter_s
+        self.arm_delay_s = arm_delay_s      # between REC:PLAY and the start of the record
+        self.verbose = verbose
+
+        self.settings = dict(DEFAULT_SETTINGS)      # short form -> value as sent by the client
+        self.configuration = "HISTO"
+        self.histograms = {i: _Histogram() for i in range(1, 5)}
+        self.counters = {}
+        self.rec_start = None
+        self.rec_end = None
+
+        self.messages = 0
+        self.commands = 0
+        self.running = False
+        self._lock = Lock()
+        self._ready = None
+
+        for i in self.histograms:
+            self._flush(i, time.time())
+
+    ############################################ server ############################################
+
+    def start(self):
+        # Returns once the socket is bound, so clients can connect right away.
+        self._ready = Event()
+        super().start()
+        self._ready.wait(5)
+        if not self.running:
+            raise ConnectionError(f"TC1000Simulator.start(): could not bind {self.endpoint}.")
+
+    def run(self):
+        socket = zmq.Context.instance().socket(zmq.REP)
+        socket.setsockopt(zmq.LINGER, 0)
+        try:
+            socket.bind(self.endpoint)
+        except zmq.ZMQError as e:
+            print(f"TC1000Simulator: {e}", file=sys.stderr)
+            self._ready.set()
+            socket.close()
+            return
+
+        self.running = True
+        self._ready.set()
+        poller = zmq.Poller()
+        poller.register(socket, zmq.POLLIN)
+        try:
+            while self.running:
+                if not poller.poll(timeout=100):
+                    continue
+                message = socket.recv_string()
+                answer = self.handle(message)
+                delay = self.latency_s + (self.rng.uniform(-self.jitter_s, self.jitter_s) if self.jitter_s else 0)
+                if delay > 0:
+                    time.sleep(delay)
+                socket.send_string(answer)
+        finally:
+            socket.close()
+
+    def stop(self):
+        self.running = False
+        if self.is_alive():
+            self.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    ############################################ SCPI ############################################
+
+    def handle(self, message: str) -> str:
+        # One message, possibly ";" / ";:" chained: one answer line per command.
+        with self._lock:
+            self.messages += 1
+            answers = []
+            path = []
+            for part in message.strip().split(";"):
+                part = part.strip()
+                if not part:
+                    continue
+                header, _, argument = part.partition(" ")
+                absolute = header.startswith(":")
+                try:
+                    nodes = [canonical(node) for node in header.strip(":").rstrip("?").split(":")]
+                except KeyError as e:
+                    answers.append(f"Error: undefined header {e}")
+                    continue
+                nodes = nodes if absolute or not path else path + nodes
+                path = nodes[:-1]
+                self.commands += 1
+                answers.append(self._execute(nodes, header.endswith("?"), argument.strip()))
+
+            if self.verbose:
+                print(f"[TC1000Simulator] {message} -> {answers}")
+            return "\n".join(answers)
+
+    def _execute(self, nodes: list, query: bool, argument: str) -> str:
+        now = time.time()
+        self._advance(now)
+        setting = ":".join(nodes)
+        generic = re.sub(r"\d+", "", setting)
+        index = int(re.search(r"\d+", setting).group()) if re.search(r"\d+", nodes[0]) else None
+
+        if generic == "REC:PLAY":
+            return self._play(now)
+        if generic == "REC:STOP":
+            if self._playing(now):
+                self.rec_start, self.rec_end = min(self.rec_start, now), now
+            return ""
+        if generic == "REC:STAG":
+            return "PLAYING" if self._playing(now) else "STOPPED"
+        if generic == "HIST:FLUS":
+            return self._flush(index, now) if index in self.histograms else "Error: invalid histogram"
+        if generic == "HIST:DATA":
+            if index not in self.histograms:
+                return "Error: invalid histogram"
+            return "[" + ",".join(map(str, self.histograms[index].counts.tolist())) + "]"
+        if generic.endswith(":COUN") and query:
+            return str(self._count(nodes[0], now))
+        if generic.endswith(":COUN:RESE"):
+            self.counters[nodes[0]] = _Counter()
+            return "Counter value set to 0"
+        if generic == "DEVI:RES:BWID" and query:
+            return str(RESOLUTION_BWID)
+        if generic == "DEVI:CONF:LOAD":
+            self.configuration = argument.upper()
+            return ""
+        if generic == "RAW:ERR" and query:
+            return "0"
+        if generic == "RAW:ERR:CLE":
+            return ""
+
+        if query:
+            if setting not in self.settings:
+                return f"Error: undefined header {setting}"
+            value = self.settings[setting]
+            return f"{value}{UNITS.get(nodes[-1], '')}"
+
+        if not argument and nodes[-1] == "ENAB":
+            argument = "ON"
+        if not argument:
+            return f"Error: missing parameter for {setting}"
+        error = self._validate(generic, argument)
+        if error:
+            return f"Error: {error}"
+
+        self.settings[setting] = argument
+        if generic in ("HIST:BWID", "HIST:BCOU", "HIST:REF:LINK", "HIST:STOP:LINK"):
+            self._flush(index, now)
+        return f"Value set to {argument}"
+
+    def _validate(self, generic: str, argument: str) -> str:
+        if generic.split(":")[-1] in NUMERIC:
+            try:
+                value = float(argument)
+            except ValueError:
+                return f"{argument} is not a number"
+            if generic in RANGES and int(value) not in RANGES[generic]:
+                return f"{argument} out of range"
+        if generic.endswith("LINK") and argument.upper() not in ("REC", "NONE"):
+            try:
+                canonical(argument)
+            except KeyError:
+                return f"unknown block {argument}"
+        return ""
+
+    ############################################ simulation ############################################
+
+    def _number(self, setting: str) -> float:
+        return float(self.settings.get(setting, 0))
+
+    def _playing(self, now: float) -> bool:
+        return self.rec_end is not None and now < self.rec_end
+
+    def _play(self, now: float) -> str:
+        if self.settings["REC:ENAB"].upper() not in ("ON", "1"):
+            return ""
+        duration = self._number("REC:DUR") * 1e-12
+        number = self.settings["REC:NUM"].upper()
+        records = float("inf") if number.startswith("INF") else float(number)
+        self.rec_start = now + self.arm_delay_s
+        self.rec_end = self.rec_start + duration * records
+        return ""
+
+    def _flush(self, index: int, now: float) -> str:
+        histogram = self.histograms[index]
+        histogram.counts = np.zeros(int(self._number(f"HIST{index}:BCOU")), dtype=np.int64)
+        histogram.updated = now
+        return ""
+
+    def _block(self, link: str) -> str:
+        block = canonical(link)
+        if self.configuration == "HISTO":
+            return HISTO_TSCO_INPUTS.get(block, block)
+        return block
+
+    def _rate(self, block: str, t):
+        if block in INPUT_BLOCKS and self.settings[f"{block}:ENAB"].upper() not in ("ON", "1"):
+            return np.zeros_like(t, dtype=float) if isinstance(t, np.ndarray) else 0.0
+        rate = self.signal.rate(block, t)
+        return np.broadcast_to(rate, np.shape(t)).astype(float) if isinstance(t, np.ndarray) else float(rate)
+
+    def _counts_over_time(self, index: int) -> bool:
+        ref = self.settings[f"HIST{index}:REF:LINK"].upper()
+        return ref.startswith("TSCO") and self.settings.get(f"{canonical(ref)}:FIR:LINK", "").upper() == "REC"
+
+    def _advance(self, now: float):
+        # Accumulates the histograms over the part of the record elapsed since their last update.
+        if self.rec_start is None:
+            return
+        end = min(now, self.rec_end)
+        for index, histogram in self.histograms.items():
+            begin = max(histogram.updated, self.rec_start)
+            histogram.updated = max(histogram.updated, end)
+            if end <= begin:
+                continue
+            block = self._block(self.settings[f"HIST{index}:STOP:LINK"])
+            bwid_s = self._number(f"HIST{index}:BWID") * 1e-12
+            bins = len(histogram.counts)
+
+            if self._counts_over_time(index):
+                # Bin k counts the events of [rec_start + k*bwid, rec_start + (k+1)*bwid)
+                first = int((begin - self.rec_start) // bwid_s)
+                last = min(int((end - self.rec_start) // bwid_s) + 1, bins)
+                if first >= last:
+                    continue
+                edges = self.rec_start + np.arange(first, last + 1) * bwid_s
+                overlap = np.clip(np.minimum(edges[1:], end) - np.maximum(edges[:-1], begin), 0, None)
+                histogram.counts[first:last] += self.rng.poisson(self._rate(block, (edges[1:] + edges[:-1]) / 2) * overlap)
+            else:
+                edges_ps = np.arange(bins + 1) * bwid_s * 1e12
+                shift_ps = self._number(f"{INPUT_DELAYS[block]}:VALU") if block in INPUT_DELAYS else 0.0
+                middle = (begin + end) / 2
+                rate = self._rate(block, middle)
+                if rate <= 0:
+                    continue
+                probabilities = self.signal.tol_histogram(block, edges_ps, shift_ps, middle)
+                histogram.counts += self.rng.poisson(rate * (end - begin) * probabilities)
+
+    def _count(self, block: str, now: float) -> int:
+        # CYCLe: counts of the last integration period; ACCUm: counts since the last COUN:RESEt.
+        mode = self.settings.get(f"{block}:COUN:MODE", "CYCL").upper()
+        if mode.startswith("ACCU"):
+            counter = self.counters.setdefault(block, _Counter())
+            elapsed = now - counter.updated
+            if elapsed > 0:
+                counter.value += int(self.rng.poisson(self._rate(block, now - elapsed / 2) * elapsed))
+                counter.updated = now
+            return counter.value
+
+        integration_s = float(self.settings.get(f"{block}:COUN:INTE", 1000)) * 1e-3
+        return int(self.rng.poisson(self._rate(block, now - integration_s / 2) * integration_s))
+
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else SCPI_PORT
+    simulator = TC1000Simulator(port=port, verbose=True)
+    simulator.start()
+    print(f"TC1000 simulator listening on {simulator.endpoint} (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        simulator.stop()
@@ -0,0 +1,175 @@
+import time
+import numpy as np
+from dataclasses import dataclass, field
+from devices.simulators.tc1000_simulator import TC1000Simulator, SignalModel, PeakSignal, Peak
+from devices.simulators.montana_simulator import MontanaSimulator, SimulatedAxis, CONTROLLER_PORT, POSITIONER_PORT
+from devices.idq_tc1000_device import TimeController
+from devices.montana_cryoadvance_controls import Positioner
+from utils.common import SCPI_PORT
+
+'''
+Laboratorio virtuale: TC1000 e Montana simulati, accoppiati.
+
+Il campione è una mappa sintetica del rivelatore (DetectorMap) nel sistema di riferimento del posizionatore: un'area
+attiva rettangolare con bordi smussati e dei difetti (zone circolari con efficienza ridotta e/o picco ToL spostato).
+Il modello di segnale del TC1000 (LabSignal) legge la posizione degli assi del posizionatore simulato all'istante di
+ogni evento, quindi il count rate dell'input e la forma ToL dipendono da dove si trova il posizionatore, anche durante
+il movimento (fly scan). La stessa mappa dà la verità di riferimento (ground_truth) su cui confrontare le scansioni.
+
+    with VirtualLab() as lab:
+        timecontroller = lab.time_controller()
+        positioner = lab.positioner()
+        ...
+        truth = lab.ground_truth(scan_settings)
+
+Da riga di comando (porte di default, per usare scans/example_scan_script.py con gli indirizzi 127.0.0.1):
+    python -m devices.simulators.virtual_lab
+Scansioni non interattive e confronto con la verità di riferimento: scans/virtual_lab_benchmark.py
+'''
+
+
+@dataclass(frozen=True)
+class Defect:
+    center: tuple                       # metres, along DetectorMap.axes
+    radius: float                       # metres
+    efficiency: float = 0.0             # detection efficiency inside the defect (0: dead spot)
+    peak_shift_ps: float = 0.0          # ToL peak shift inside the defect
+
+
+@dataclass
+class DetectorMap:
+    axes: tuple = ("Y", "Z")                        # positioner axes of the map plane, missing axes are ignored
+    active_min: tuple = (5e-5, 5e-5)                # active area corners, metres
+    active_max: tuple = (2.5e-4, 2.5e-4)
+    edge_width: float = 5e-6                        # width of the efficiency roll-off at the edges, metres
+    defects: list = field(default_factory=lambda: [
+        Defect((1.0e-4, 1.2e-4), 2.5e-5, 0.1),
+        Defect((2.0e-4, 2.0e-4), 2.0e-5, 0.8, 20000),
+    ])
+
+    def _coordinates(self, position: dict) -> list:
+        return [np.asarray(position.get(axis, 0.0), dtype=float) for axis in self.axes]
+
+    def efficiency(self, position: dict):
+        # Detection efficiency (0-1) at a position {axis: metres or array of metres}.
+        efficiency = 1.0
+        for coordinate, low, high in zip(self._coordinates(position), self.active_min, self.active_max):
+            width = max(self.edge_width, 1e-12)
+            efficiency = efficiency / (1 + np.exp(-(coordinate - low) / width)) / (1 + np.exp((coordinate - high) / width))
+        for defect, inside in zip(self.defects, self._inside_defects(position)):
+            efficiency = np.where(inside, efficiency * defect.efficiency, efficiency)
+        return efficiency
+
+    def peak_shift(self, position: dict):
+        shift = 0.0
+        for defect, inside in zip(self.defects, self._inside_defects(position)):
+            shift = np.where(inside, shift + defect.peak_shift_ps, shift)
+        return shift
+
+    def _inside_defects(self, position: dict) -> list:
+        coordinates = self._coordinates(position)
+        return [
+            sum((coordinate - center) ** 2 for coordinate, center in zip(coordinates, defect.center)) <= defect.radius ** 2
+            for defect in self.defects
+        ]
+
+
+class LabSignal(SignalModel):
+    # TC1000 signal model driven by the simulated positioner: the STOP input rate is dark + peak * efficiency at the
+    # position of the axes at time t, the ToL shape is `tol` shifted by the map's peak shift at that position.
+    def __init__(
+        self,
+        detector: DetectorMap,
+        axes: dict[str, SimulatedAxis],
+        peak_rate: float = 5e4,
+        dark_rate: float = 200,
+        laser_rate: float = 1e6,
+        input_block: str = "INPU1",
+        tol: PeakSignal = None,
+    ):
+        self.detector = detector
+        self.axes = axes
+        self.peak_rate = peak_rate
+        self.dark_rate = dark_rate
+        self.laser_rate = laser_rate
+        self.input_block = input_block
+        self.tol = tol if tol is not None else PeakSignal(rates={}, peaks=[Peak(2e5, 2000, 20000)], background=0.02)
+
+    def position(self, t) -> dict:
+        return {axis: self.axes[axis].physical_at(t) for axis in self.detector.axes if axis in self.axes}
+
+    def rate(self, block: str, t):
+        if block == "STAR":
+            return self.laser_rate
+        if block == self.input_block:
+            return self.dark_rate + self.peak_rate * self.detector.efficiency(self.position(t))
+        return 0.0
+
+    def tol_histogram(self, block: str, edges_ps: np.ndarray, shift_ps: float, t: float) -> np.ndarray:
+        # Shifts are rounded to the bin width so that the shape cache of PeakSignal is reused while the position holds
+        shift = float(self.detector.peak_shift(self.position(t)))
+        bwid = edges_ps[1] - edges_ps[0] if len(edges_ps) > 1 else 1
+        return self.tol.tol_histogram(block, edges_ps, shift_ps + round(shift / bwid) * bwid, t)
+
+
+class VirtualLab:
+    def __init__(
+        self,
+        detector: DetectorMap = None,
+        address: str = "127.0.0.1",
+        scpi_port: int = SCPI_PORT,
+        controller_port: int = CONTROLLER_PORT,
+        positioner_port: int = POSITIONER_PORT,
+        peak_rate: float = 5e4,
+        dark_rate: float = 200,
+        seed: int = None,
+        montana_options: dict = None,
+        tc_options: dict = None,
+    ):
+        self.detector = detector if detector is not None else DetectorMap()
+        self.address = address
+        self.scpi_port = scpi_port
+        self.positioner_port = positioner_port
+        self.montana = MontanaSimulator(address, controller_port, positioner_port, seed=seed, **(montana_options or {}))
+        self.signal = LabSignal(self.detector, self.montana.axes, peak_rate, dark_rate)
+        self.tc = TC1000Simulator(address, scpi_port, signal=self.signal, seed=seed, **(tc_options or {}))
+
+    def start(self):
+        self.montana.start()
+        self.tc.start()
+
+    def stop(self):
+        self.tc.stop()
+        self.montana.stop()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    def time_controller(self, verbose: bool = False) -> TimeController:
+        return TimeController(self.address, verbose, port=self.scpi_port)
+
+    def positioner(self) -> Positioner:
+        return Positioner(self.address, port=self.positioner_port)
+
+    def ground_truth(self, scan_settings) -> np.ndarray:
+        # Expected STOP count rate (counts/s) on every pixel of the ScanParameters grid, shaped like
+        # ScanResults.data_dims. Pixel positions are index * step size from the zeroed origin, plus the zero offsets.
+        axes = [axis for axis, size in scan_settings.resolution.items() if size > 0]
+        grids = np.meshgrid(*[np.arange(scan_settings.resolution[axis]) * scan_settings.step_size[axis] for axis in axes], indexing="ij")
+        position = {axis: self.montana.axes[axis].offset for axis in self.detector.axes if axis in self.montana.axes}
+        position.update({axis: grid + self.montana.axes[axis].offset for axis, grid in zip(axes, grids)})
+        return self.signal.dark_rate + self.signal.peak_rate * np.broadcast_to(self.detector.efficiency(position), grids[0].shape)
+
+
+if __name__ == "__main__":
+    with VirtualLab() as lab:
+        print(f"Virtual lab: TC1000 on {lab.tc.endpoint}, Montana on {lab.address}:{CONTROLLER_PORT}/{POSITIONER_PORT} (Ctrl+C to stop)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,27 @@
+import sys
+import timeit
+from ast import literal_eval
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from utils.acquisitions.histograms import parse_histogram
+
+# Micro-benchmark: HIST{n}:DATA? payload decoded with the old literal_eval/eval path and with parse_histogram().
+# Payloads are synthetic, shaped like the TC1000 answer: "[c0, c1, ...]".
+
+rng = np.random.default_rng(0)
+REPEATS = 20
+
+print(f"{'bcount':>8} {'literal_eval':>14} {'eval':>14} {'parse_histogram':>16} {'speed-up':>9}")
+for bcount in (1000, 4096, 16384, 65536):
+    counts = rng.poisson(rng.uniform(0, 5000, bcount))
+    payload = "[" + ", ".join(str(c) for c in counts) + "]"
+
+    assert np.array_equal(parse_histogram(payload), literal_eval(payload))
+
+    t_literal = min(timeit.repeat(lambda: literal_eval(payload), number=1, repeat=REPEATS))
+    t_eval = min(timeit.repeat(lambda: eval(payload), number=1, repeat=REPEATS))
+    t_numpy = min(timeit.repeat(lambda: parse_histogram(payload), number=1, repeat=REPEATS))
+
+    print(f"{bcount:>8} {t_literal*1e3:>11.3f} ms {t_eval*1e3:>11.3f} ms {t_numpy*1e3:>13.3f} ms {t_literal/t_numpy:>8.1f}x")
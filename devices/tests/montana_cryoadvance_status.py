@@ -1,11 +1,14 @@
 
 import requests # type: ignore
 import json
+from devices.montana_transport import get_transport
 
 class InformazioniMontana:
-    def __init__(self, IPaddress: str) -> str:
-        self.controller_url = f"http://{IPaddress}:47101/v1"
-        self.positioner_url = f"http://{IPaddress}:47171/v1"
+    def __init__(self, IPaddress: str, controller_port: int = 47101, positioner_port: int = 47171) -> str:
+        self.controller_url = f"http://{IPaddress}:{controller_port}/v1"
+        self.positioner_url = f"http://{IPaddress}:{positioner_port}/v1"
+        self.controller_transport = get_transport(IPaddress, controller_port)
+        self.positioner_transport = get_transport(IPaddress, positioner_port)
 
     def informazioni_pompa_raffreddatrice(self, format: bool = False) -> dict:
         """
@@ -44,7 +47,7 @@ class InformazioniMontana:
 
         for key, path in endpoints.items():
             try:
-                response = requests.get(f"{self.controller_url}{path}", timeout=5)
+                response = self.controller_transport.get(f"{self.controller_url}{path}", timeout=5)
                 response.raise_for_status()
                 result[key] = response.json()
             except requests.RequestException as e:
@@ -93,7 +96,7 @@ class InformazioniMontana:
         
         for key, path in endpoints.items():
             try:
-                response = requests.get(f"{self.controller_url}{path}", timeout=5)
+                response = self.controller_transport.get(f"{self.controller_url}{path}", timeout=5)
                 response.raise_for_status()
                 result[key] = response.json()
             except requests.RequestException as e:
@@ -128,7 +131,7 @@ class InformazioniMontana:
         
         for key, path in endpoints.items():
             try:
-                response = requests.get(f"{self.positioner_url}{path}", timeout=5)
+                response = self.positioner_transport.get(f"{self.positioner_url}{path}", timeout=5)
                 response.raise_for_status()
                 result[key] = response.json()
             except requests.RequestException as e:
@@ -0,0 +1,51 @@
+import sys
+import time
+import asyncio
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from devices.simulators.montana_simulator import MontanaSimulator
+from devices.montana_cryoadvance_controls import CryoController, Positioner
+from devices.montana_cryoadvance_controls_async import Positioner as AsyncPositioner
+from devices.tests.montana_cryoadvance_status import InformazioniMontana
+
+# Motion engine timing against the local Montana simulator (no cryostat needed): single axis and group moves with the
+# sync and the asyncio driver, with the HTTP calls and latency each one costs.
+
+CONTROLLER_PORT, POSITIONER_PORT = 47201, 47271
+STEPS = [{"X": 1e-5 * i, "Y": 2e-5 * (i % 3)} for i in range(1, 11)]
+
+
+def summary(name, reports, elapsed):
+    calls = sum(report["http-calls"] for report in reports)
+    http = sum(report["http-time-s"] for report in reports)
+    settle = sum(report["settle-s"] for report in reports)
+    failed = sum(not report["reached"] for report in reports)
+    print(f"{name:<28} {elapsed:7.3f} s  settle {settle:6.3f} s  http calls {calls:4d} ({http:6.3f} s)  failed {failed}")
+
+
+with MontanaSimulator(controller_port=CONTROLLER_PORT, positioner_port=POSITIONER_PORT, latency_s=0.003, jitter_s=0.002, seed=0) as montana:
+    cryo = CryoController("127.0.0.1", port=CONTROLLER_PORT)
+    print(f"cryostat: {cryo.get_status()} {cryo.get_pressure()} mbar, target {cryo.get_target_temperature()} K")
+    informazioni = InformazioniMontana("127.0.0.1", CONTROLLER_PORT, POSITIONER_PORT)
+    print(f"positioner: {informazioni.informazioni_posizionatore()['status - axisX']}")
+
+    positioner = Positioner("127.0.0.1", port=POSITIONER_PORT)
+
+    start = time.perf_counter()
+    reports = [positioner.move_and_wait(axis, position) for step in STEPS for axis, position in step.items()]
+    summary("sync, one axis at a time", reports, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    reports = [positioner.move_axes_and_wait({axis: -position for axis, position in step.items()}) for step in STEPS]
+    summary("sync, group moves", reports, time.perf_counter() - start)
+
+    async def async_moves():
+        async with await AsyncPositioner.create("127.0.0.1", port=POSITIONER_PORT) as async_positioner:
+            return [await async_positioner.move_axes_and_wait(step) for step in STEPS]
+
+    start = time.perf_counter()
+    reports = asyncio.run(async_moves())
+    summary("async, group moves", reports, time.perf_counter() - start)
+
+    print(f"moves per axis: { {axis: simulated.moves for axis, simulated in montana.axes.items()} }")
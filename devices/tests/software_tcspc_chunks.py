@@ -0,0 +1,56 @@
+import sys
+import tempfile
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from utils.acquisitions.tcspc import Binning, SoftwareTCSPC, histogram_timestamp_files, match_start_stop
+
+# Check: SoftwareTCSPC fed in chunks, with either channel lagging, gives the histogram of the one-shot matching.
+# Synthetic sorted timestamps (ps); stop rates from 10x below to 10x above the start rate.
+
+rng = np.random.default_rng(0)
+BINNING = Binning(1000, 100000)
+
+
+def feed(tcspc, starts, stops, start_refs=None, stop_refs=None, max_chunk=500):
+    # Random chunk sizes, random channel order: one channel can run far ahead of the other.
+    i = j = 0
+    while i < len(starts) or j < len(stops):
+        if j >= len(stops) or (i < len(starts) and rng.random() < 0.5):
+            k = int(rng.integers(1, max_chunk))
+            tcspc.add_starts(starts[i:i + k], None if start_refs is None else start_refs[i:i + k])
+            i += k
+        else:
+            k = int(rng.integers(1, max_chunk))
+            tcspc.add_stops(stops[j:j + k], None if stop_refs is None else stop_refs[j:j + k])
+            j += k
+    tcspc.flush()
+
+
+print(f"{'starts':>8} {'stops':>8} {'refs':>5} {'one-shot':>9} {'chunked':>9}")
+for nb_starts, nb_stops, nb_refs in ((3000, 3000, 0), (5000, 50000, 0), (50000, 5000, 0), (5000, 50000, 4), (50000, 5000, 4)):
+    start_refs = np.sort(rng.integers(0, nb_refs, nb_starts)).astype(np.uint64) if nb_refs else None
+    stop_refs = np.sort(rng.integers(0, nb_refs, nb_stops)).astype(np.uint64) if nb_refs else None
+    starts = np.sort(rng.integers(0, 10 ** 9, nb_starts))
+    stops = np.sort(rng.integers(0, 10 ** 9, nb_stops))
+    if nb_refs:
+        starts = np.concatenate([np.sort(starts[start_refs == ref]) for ref in range(nb_refs)])
+        stops = np.concatenate([np.sort(stops[stop_refs == ref]) for ref in range(nb_refs)])
+
+    expected = BINNING.histogram(match_start_stop(starts, stops, start_refs, stop_refs))
+    tcspc = SoftwareTCSPC({"tol": BINNING}, with_ref_index=bool(nb_refs))
+    feed(tcspc, starts, stops, start_refs, stop_refs)
+    print(f"{nb_starts:>8} {nb_stops:>8} {nb_refs:>5} {expected.sum():>9} {tcspc.histograms['tol'].sum():>9}")
+    assert np.array_equal(tcspc.histograms["tol"], expected)
+
+# Same through histogram_timestamp_files() on "bin" files, with small chunks
+with tempfile.TemporaryDirectory() as directory:
+    starts = np.sort(rng.integers(0, 10 ** 9, 5000)).astype("<u8")
+    stops = np.sort(rng.integers(0, 10 ** 9, 50000)).astype("<u8")
+    starts.tofile(f"{directory}/timestamps_C0.bin")
+    stops.tofile(f"{directory}/timestamps_C1.bin")
+    tcspc = histogram_timestamp_files(f"{directory}/timestamps_C0.bin", f"{directory}/timestamps_C1.bin", {"tol": BINNING}, chunk_size=1000)
+    expected = BINNING.histogram(match_start_stop(starts, stops))
+    print(f"files, chunk_size=1000: one-shot {expected.sum()}, chunked {tcspc.histograms['tol'].sum()}")
+    assert np.array_equal(tcspc.histograms["tol"], expected)
@@ -0,0 +1,41 @@
+import sys
+import time
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+from utils.common import connect, zmq_exec
+from utils.acquisitions import acquire_histograms
+from devices.simulators.tc1000_simulator import TC1000Simulator, PeakSignal, Peak
+import devices.idq_tc1000_device as idq_tc1000_device
+
+# Offline timing of the TC1000 acquisition path against the local simulator (no instrument needed).
+# Round trip of a single query, TimeController start-up, TCToL arm/record/readout and a 2 channel acquire_histograms.
+
+PORT = 5599
+signal = PeakSignal(rates={"STAR": 1e6, "INPU1": 5e4, "INPU2": 2e3}, peaks=[Peak(2e5, 2000, 20000), Peak(4e5, 500, 0, 0.3)], seed=0)
+
+with TC1000Simulator(port=PORT, signal=signal, seed=0, latency_s=0.0005, jitter_s=0.0002):
+    tc = connect("127.0.0.1", port=PORT)
+    start = time.perf_counter()
+    for _ in range(200):
+        zmq_exec(tc, "REC:STAGe?")
+    print(f"round trip: {(time.perf_counter() - start) / 200 * 1e3:.3f} ms")
+
+    start = time.perf_counter()
+    timecontroller = idq_tc1000_device.TimeController("127.0.0.1", port=PORT)
+    print(f"TimeController(): {(time.perf_counter() - start) * 1e3:.1f} ms")
+
+    timecontroller.setup_inputs({"start": -0.3, 1: -0.1})
+    timecontroller.delay(1, 1400000)
+    tol = timecontroller.get_tol(1)
+    counter = timecontroller.get_counter(1)
+    for acquisition_time in (0.5, 1, 2):
+        count_data, tol_data = tol.acquire_with_count(counter, acquisition_time, None, None)
+        timings = ", ".join(f"{phase} {seconds:.3f} s" for phase, seconds in tol.last_timings.items())
+        print(f"acquire_with_count({acquisition_time} s): {timings}")
+
+    start = time.perf_counter()
+    histograms = acquire_histograms(tc, 1, 1000, 1000, [1, 2])
+    print(f"acquire_histograms(1 s, 2 channels): {time.perf_counter() - start:.3f} s, "
+          f"counts {[int(np.sum(counts)) for counts in histograms.values()]}")
@@ -0,0 +1,273 @@
+import sys
+import json
+import numpy as np
+from typing import Callable
+from devices.idq_tc1000_counter import CountData
+from devices.idq_tc1000_tol import ToLData
+from scans.scan_data_structures import ScanParameters, ScanResults
+from scans.scan_trajectory import nearest_neighbour_tour
+
+'''
+Scansione adattiva a quadtree.
+
+Una prima passata grossolana misura una cella ogni `coarse_cell` pixel della griglia fine di ScanParameters.resolution.
+Poi, ad ogni passata, vengono suddivise (2 parti per asse: quadtree in 2D, albero binario in 1D) solo le celle il cui
+count rate o la cui forma ToL differiscono da una cella confinante oltre una soglia. Si continua finché le celle da
+suddividere hanno dimensione 1 pixel.
+
+Ogni cella è misurata nel suo pixel centrale, a meno che un pixel al suo interno non sia già stato misurato (ad esempio
+il centro della cella madre): in quel caso la misura viene riutilizzata, quindi nessun pixel viene misurato due volte.
+Una cella senza confinanti (griglia contenuta in una sola cella grossolana) viene suddivisa comunque, così che le figlie
+possano essere confrontate tra loro. Le celle sono salvate in QuadtreeScanResults, che può essere convertito in
+un ScanResults alla risoluzione fine (ogni pixel punta ai dati della foglia che lo contiene) per il visualizzatore.
+'''
+
+
+class QuadtreeScanResults:
+    def __init__(self, resolution: dict = {"X": 0, "Y": 0, "Z": 0}):
+
+        if resolution != {"X": 0, "Y": 0, "Z": 0}:
+            self.resolution = resolution
+        else:
+            raise ValueError("QuadtreeScanResults.__init__(): wrong resolution argument passed.")
+
+        self.active_axes = tuple(axis for axis, size in self.resolution.items() if size > 0)
+        self.data_dims = tuple(size for size in self.resolution.values() if size > 0)
+        self.cells = {}             # (origin, size) -> list of data objects, only leaves (cells that were not subdivided)
+        self.cell_points = {}       # leaf -> pixel its data was measured at
+        self.points = []            # data list of every measured pixel
+        self.point_index = np.full(self.data_dims, -1, dtype=int)      # pixel -> index in points, -1 if not measured
+        self.filename = None
+
+    @staticmethod
+    def cell_center(cell: tuple) -> tuple:
+        origin, size = cell
+        return tuple(o + (s - 1) // 2 for o, s in zip(origin, size))
+
+    def input_data(self, cell: tuple, value: CountData|ToLData):
+        self.cells.setdefault(cell, []).append(value)
+
+    def input_point(self, cell: tuple, pixel: tuple, values: list):
+        # Data measured at `pixel`, kept in the per-pixel cache so that any cell containing the pixel can reuse it.
+        data = list(values)
+        self.point_index[pixel] = len(self.points)
+        self.points.append(data)
+        self.cells[cell] = data
+        self.cell_points[cell] = pixel
+
+    def measured_point(self, cell: tuple) -> tuple|None:
+        # Already measured pixel inside the cell, the closest to its centre; None if there is none.
+        origin, size = cell
+        region = self.point_index[tuple(slice(o, o + s) for o, s in zip(origin, size))]
+        hits = np.argwhere(region >= 0)
+        if not len(hits):
+            return None
+        center = np.array(self.cell_center(cell)) - np.array(origin)
+        best = hits[np.argmin(np.abs(hits - center).sum(axis=1))]
+        return tuple(int(o + i) for o, i in zip(origin, best))
+
+    def reuse_point(self, cell: tuple) -> bool:
+        pixel = self.measured_point(cell)
+        if pixel is None:
+            return False
+        self.cells[cell] = self.points[self.point_index[pixel]]
+        self.cell_points[cell] = pixel
+        return True
+
+    def get_data(self, cell: tuple, data_type = None) -> list:
+        if data_type not in [CountData, ToLData] and data_type != None:
+            raise TypeError("QuadtreeScanResults.get_data(): Provided wrong datatype for extraction.")
+
+        if data_type == None:
+            return self.cells.get(cell, [])
+        for item in self.cells.get(cell, []):
+            if type(item) == data_type:
+                return item
+
+    def subdivide(self, cell: tuple) -> list[tuple]:
+        # Replaces a leaf with its children. Children containing an already measured pixel (the parent's one at least)
+        # reuse its data from the per-pixel cache.
+        origin, size = cell
+        halves = []
+        for o, s in zip(origin, size):
+            if s > 1:
+                halves.append(((o, (s + 1) // 2), (o + (s + 1) // 2, s // 2)))
+            else:
+                halves.append(((o, s),))
+
+        self.cells.pop(cell, None)
+        self.cell_points.pop(cell, None)
+        children = []
+        for parts in np.ndindex(tuple(len(h) for h in halves)):
+            child = (
+                tuple(halves[axis][part][0] for axis, part in enumerate(parts)),
+                tuple(halves[axis][part][1] for axis, part in enumerate(parts)),
+            )
+            self.reuse_point(child)
+            children.append(child)
+        return children
+
+    def to_scan_results(self) -> ScanResults:
+        # Dense view at the finest resolution: every pixel shares the data list of the leaf covering it.
+        results = ScanResults(self.resolution)
+        for (origin, size), data in self.cells.items():
+            for idx in np.ndindex(size):
+                results.data_matrix[tuple(o + i for o, i in zip(origin, idx))] = data
+        return results
+
+    def save(self, path: str) -> bool:
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                serialized_data = []
+                for (origin, size), obj_list in self.cells.items():
+                    data_dict = {}
+                    for obj in obj_list:
+                        data_dict.update(obj.out())
+
+                    serialized_data.append({
+                        "origin": dict(zip(self.active_axes, origin)),
+                        "size": dict(zip(self.active_axes, size)),
+                        "values": data_dict,
+                    })
+
+                json.dump({
+                    "resolution": self.resolution,
+                    "cells": serialized_data
+                }, f, indent=2)
+
+            self.filename = path
+            return True
+        except Exception as e:
+            print(f"Error saving QuadtreeScanResults to {path}: {e}", file=sys.stderr)
+            return False
+
+    @staticmethod
+    def load(path: str):
+        if not path:
+            raise ValueError("QuadtreeScanResults.load(): path must be given to load from file.")
+
+        with open(path, "r", encoding="utf-8") as f:
+            json_data = json.load(f)
+
+        obj = QuadtreeScanResults(json_data["resolution"])
+        for cell_dict in json_data["cells"]:
+            cell = (
+                tuple(cell_dict["origin"][axis] for axis in obj.active_axes),
+                tuple(cell_dict["size"][axis] for axis in obj.active_axes),
+            )
+            obj.cells[cell] = []
+            for item in [CountData.input(cell_dict["values"]), ToLData.input(cell_dict["values"])]:
+                if item:
+                    obj.input_data(cell, item)
+
+        return obj
+
+
+def load_results(path: str) -> ScanResults:
+    # Loads either a regular or an adaptive results file as a ScanResults the visualizer can render.
+    with open(path, "r", encoding="utf-8") as f:
+        adaptive = "cells" in json.load(f)
+    if adaptive:
+        return QuadtreeScanResults.load(path).to_scan_results()
+    return ScanResults.load(path)
+
+
+def tol_shape_distance(a: ToLData, b: ToLData) -> float:
+    # Total variation distance between the two normalised histograms: 0 same shape, 1 no overlap.
+    y_a = np.asarray(a.y_data, dtype=float)
+    y_b = np.asarray(b.y_data, dtype=float)
+    if len(y_a) != len(y_b) or y_a.sum() == 0 or y_b.sum() == 0:
+        return 0 if y_a.sum() == y_b.sum() else 1
+    return 0.5 * float(np.abs(y_a / y_a.sum() - y_b / y_b.sum()).sum())
+
+
+class AdaptiveScan:
+    def __init__(
+        self,
+        scan_settings: ScanParameters,
+        coarse_cell: int = None,
+        count_threshold: float = None,
+        tol_threshold: float = None,
+    ):
+        self.scan_settings = scan_settings
+        self.coarse_cell = coarse_cell or scan_settings.adaptive_coarse_cell
+        self.count_threshold = count_threshold if count_threshold is not None else scan_settings.adaptive_count_threshold
+        self.tol_threshold = tol_threshold if tol_threshold is not None else scan_settings.adaptive_tol_threshold
+
+        if self.coarse_cell < 1:
+            raise ValueError("AdaptiveScan.__init__(): coarse cell size must be at least 1 pixel.")
+
+        self.results = QuadtreeScanResults(scan_settings.resolution)
+        self.step_size = np.array([scan_settings.step_size[axis] for axis in self.results.active_axes])
+        self.points_measured = 0
+
+    def _coarse_cells(self) -> list[tuple]:
+        cells = []
+        starts = [range(0, size, self.coarse_cell) for size in self.results.data_dims]
+        for origin in np.ndindex(tuple(len(s) for s in starts)):
+            origin = tuple(starts[axis][i] for axis, i in enumerate(origin))
+            size = tuple(min(self.coarse_cell, dim - o) for o, dim in zip(origin, self.results.data_dims))
+            cells.append((origin, size))
+        return cells
+
+    def _differs(self, cell_a: tuple, cell_b: tuple) -> bool:
+        count_a = self.results.get_data(cell_a, CountData)
+        count_b = self.results.get_data(cell_b, CountData)
+        if count_a and count_b:
+            f_a, f_b = count_a.frequency(), count_b.frequency()
+            if abs(f_a - f_b) > self.count_threshold * max(f_a, f_b, 1e-12):
+                return True
+
+        tol_a = self.results.get_data(cell_a, ToLData)
+        tol_b = self.results.get_data(cell_b, ToLData)
+        if tol_a and tol_b and tol_shape_distance(tol_a, tol_b) > self.tol_threshold:
+            return True
+
+        return False
+
+    def _cells_to_refine(self) -> list[tuple]:
+        # Face neighbours: touching along one axis and overlapping along all the others. A cell without neighbours
+        # can not be compared: it is subdivided so that its children give its own contrast.
+        cells = list(self.results.cells)
+        lo = np.array([origin for origin, _ in cells])
+        hi = lo + np.array([size for _, size in cells])
+        refine = set()
+
+        for i, cell in enumerate(cells):
+            overlap = (lo < hi[i]) & (hi > lo[i])
+            touching = (hi == lo[i]) | (lo == hi[i])
+            neighbour = ((touching & ~overlap).sum(axis=1) == 1) & (overlap.sum(axis=1) == len(self.results.active_axes) - 1)
+            if not neighbour.any():
+                refine.add(cell)
+            for j in np.flatnonzero(neighbour):
+                if j > i and self._differs(cell, cells[j]):
+                    refine.add(cell)
+                    refine.add(cells[j])
+
+        return [cell for cell in refine if max(cell[1]) > 1]
+
+    def _measure_cells(self, cells: list[tuple], measure_point: Callable[[dict], list]):
+        # Only cells without an already measured pixel are measured, at their centre, in nearest neighbour order.
+        to_measure = [cell for cell in cells if not self.results.cells.get(cell) and not self.results.reuse_point(cell)]
+        centers = np.array([self.results.cell_center(cell) for cell in to_measure])
+        if not to_measure:
+            return
+
+        for i in nearest_neighbour_tour(centers * self.step_size):
+            pixel = tuple(int(c) for c in centers[i])
+            self.results.input_point(to_measure[i], pixel, measure_point(dict(zip(self.results.active_axes, pixel))))
+            self.points_measured += 1
+
+    def run(self, measure_point: Callable[[dict], list]) -> QuadtreeScanResults:
+        # measure_point(index_vector) must move the positioner to the grid index and return the measured data objects.
+        cells = self._coarse_cells()
+        level = 0
+        while cells:
+            print(f"Adaptive scan level {level}: {len(cells)} cells")
+            self._measure_cells(cells, measure_point)
+            cells = [child for cell in self._cells_to_refine() for child in self.results.subdivide(cell)]
+            level += 1
+
+        total = int(np.prod(self.results.data_dims))
+        print(f"Adaptive scan measured {self.points_measured}/{total} points ({round(100 * self.points_measured / total, 1)}%).")
+        return self.results
@@ -0,0 +1,122 @@
+import time
+import asyncio
+from devices.idq_tc1000_counter import TCCounter
+from devices.idq_tc1000_tol import TCToL
+from devices.montana_cryoadvance_controls_async import CryoController, Positioner
+from scans.scan_data_structures import ScanParameters, ScanResults
+from scans.scan_trajectory import ScanTrajectory
+from scans.scan_journal import ScanJournal
+from scans.scan_timing import ScanTimer
+
+'''
+Loop di scansione step su asyncio.
+
+Stessa sequenza di example_scan_script.py (traiettoria, movimento di gruppo, conteggi + ToL dalla stessa finestra REC,
+giornale), ma su un unico event loop con i driver Montana asincroni:
+    - il movimento usa Positioner.move_axes_and_wait() asincrono (richieste degli assi in parallelo)
+    - l'acquisizione del TC1000, bloccante, gira in un thread (asyncio.to_thread), quindi non ferma l'event loop
+    - un task separato legge la telemetria del criostato (stato, pressione) ogni `telemetry_interval` secondi,
+      in parallelo sia al polling del posizionatore che alla lettura del TC1000.
+'''
+
+
+async def cryostat_telemetry(cryo: CryoController, telemetry: list, interval: float = 10):
+    # Appends a sample every `interval` seconds until cancelled. Errors are recorded, they never stop the scan.
+    while True:
+        try:
+            state, pressure = await asyncio.gather(cryo.get_status(), cryo.get_pressure())
+            telemetry.append({"time": time.time(), "state": state, "pressure": pressure})
+        except Exception as e:
+            telemetry.append({"time": time.time(), "error": str(e)})
+        await asyncio.sleep(interval)
+
+
+async def async_scan_motion(targets: dict, scan_settings: ScanParameters, positioner: Positioner, timer: ScanTimer = None) -> dict:
+    # Group move with retries on the failed axes only, like scan_motion() in the example script.
+    for try_count in range(1, scan_settings.max_positioner_retries + 1):
+        report = await positioner.move_axes_and_wait(targets, scan_settings.polling_frequency)
+        if timer:
+            timer.add("motion", report["travel-s"])
+            timer.add("settle", report["settle-s"])
+        if report["reached"]:
+            return report
+        targets = {axis: targets[axis] for axis in report["failed"]}
+
+    raise RuntimeError(f"async_scan_motion(): positioner could not reach {targets} in {scan_settings.max_positioner_retries} tries.")
+
+
+async def async_step_scan(
+    positioner: Positioner,
+    cryo: CryoController | None,
+    scan_settings: ScanParameters,
+    scan_results: ScanResults,
+    tol: TCToL,
+    counter: TCCounter,
+    trajectory: ScanTrajectory = None,
+    measured: set = None,
+    journal: ScanJournal = None,
+    timer: ScanTimer = None,
+    telemetry_interval: float = 10,
+) -> list:
+    # Walks the trajectory measuring every point not in `measured`. Returns the cryostat telemetry samples.
+    trajectory = trajectory or scan_settings.initialize_trajectory()
+    measured = measured or set()
+    telemetry = []
+    telemetry_task = asyncio.create_task(cryostat_telemetry(cryo, telemetry, telemetry_interval)) if cryo else None
+
+    try:
+        resync_position = bool(measured)
+        for step in range(len(trajectory)):
+            index_vector = trajectory.index_vector(step)
+            if tuple(index_vector.values()) in measured:
+                resync_position = True
+                continue
+
+            if timer:
+                timer.start_point()
+
+            if resync_position:
+                targets = trajectory.position_vector(step)
+                resync_position = False
+            else:
+                targets = {instruction["axis"]: instruction["position"] for instruction in trajectory.motion_instructions(step)}
+
+            if targets:
+                await async_scan_motion(targets, scan_settings, positioner, timer)
+                await asyncio.sleep(scan_settings.sleep_time)
+
+            data_objs = await asyncio.to_thread(
+                tol.acquire_with_count,
+                counter,
+                scan_settings.tol_acquisition_time,
+                scan_settings.tol_target_counts,
+                scan_settings.tol_target_uncertainty,
+            )
+            for data_obj in data_objs:
+                scan_results.input_data(index_vector, data_obj)
+
+            if timer:
+                timer.add_many(tol.last_timings)
+            if journal:
+                journal.record(index_vector, data_objs)
+
+            if timer:
+                timer.end_point()
+                print(f"Point {index_vector} ({step + 1}/{len(trajectory)}), {timer.progress()}")
+
+        await async_scan_motion({axis: 0 for axis in trajectory.active_axes}, scan_settings, positioner)
+    finally:
+        if telemetry_task:
+            telemetry_task.cancel()
+            await asyncio.gather(telemetry_task, return_exceptions=True)
+
+    return telemetry
+
+
+def run_async_step_scan(montana_ip: str, *args, **kwargs) -> list:
+    # Blocking entry point: creates the async Montana drivers on a new event loop, runs async_step_scan() and closes them.
+    async def main():
+        async with CryoController(montana_ip) as cryo, await Positioner.create(montana_ip) as positioner:
+            return await async_step_scan(positioner, cryo, *args, **kwargs)
+
+    return asyncio.run(main())
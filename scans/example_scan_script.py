@@ -1,8 +1,14 @@
 from devices.idq_tc1000_device import *
 from devices.montana_cryoadvance_controls import *
 from scans.scan_data_structures import *
+from scans.fly_scan import fly_scan, fly_scan_duration
+from scans.adaptive_scan import AdaptiveScan
+from scans.scan_journal import ScanJournal
+from scans.scan_timing import ScanTimer
+from scans.async_scan import run_async_step_scan
 import time
 import signal
+import json
 import sys
 import os
 
@@ -73,6 +79,9 @@ scan_set.tol_delay = 1400000
 scan_set.sleep_time = 0
 scan_started = False
 settings_not_applied=True
+journal_filepath = None
+resume_scan = False
+use_async_driver = False
 input1_threshold = -0.1
 start_threshold = -0.3
 
@@ -91,6 +100,14 @@ while settings_not_applied:
         else:
             results_filepath = results_path_input.strip()
     
+    # Scan Journal Path: every measured point is appended here, so an interrupted step scan can be resumed.
+    journal_default = journal_filepath or (f"{results_filepath}.journal" if results_filepath else None)
+    journal_input = input(f"Enter the filepath of the scan journal, an existing journal resumes its scan (current: {journal_default}): ")
+    journal_filepath = journal_input.strip() or journal_default
+    resume_scan = bool(journal_filepath) and os.path.isfile(journal_filepath) and os.path.getsize(journal_filepath) > 0
+    if resume_scan:
+        print(f"Journal found: a step scan resumes from the first unmeasured point of {journal_filepath}.")
+
     # Scan Parameters Path
     params_path_input = input(f"Enter the full filepath of where the scan-settings file should be saved:")
     if params_path_input.strip():
@@ -131,6 +148,46 @@ while settings_not_applied:
         if axis not in axis_list:
             scan_set.resolution[axis] = 0
 
+    # Scan mode
+    mode_input = input(f"Enter scan mode, step, fly (counts only) or adaptive (current: {scan_set.scan_mode}): ")
+    if mode_input.strip():
+        if mode_input.strip().lower() not in ["step", "fly", "adaptive"]:
+            print(f"Unknown scan mode: {mode_input}")
+            continue
+        scan_set.scan_mode = mode_input.strip().lower()
+
+    if scan_set.scan_mode == "fly":
+        velocity_input = input(f"Enter fly velocity of the fast axis {axis_list[0]} in m/s (current: {scan_set.step_velocity}): ")
+        if velocity_input.strip():
+            scan_set.step_velocity = float(velocity_input)
+        if not scan_set.step_velocity:
+            print("Fly scans need a velocity.")
+            continue
+
+    if scan_set.scan_mode == "step":
+        async_input = input(f"Run the step scan on the asyncio drivers, with cryostat telemetry in parallel? y/n (current: {'y' if use_async_driver else 'n'}): ")
+        if async_input.strip():
+            use_async_driver = async_input.strip().lower() in ['y', 'yes', 'si']
+
+    if scan_set.scan_mode == "adaptive":
+        coarse_input = input(f"Enter coarse cell size in pixels for the adaptive first pass (current: {scan_set.adaptive_coarse_cell}): ")
+        if coarse_input.strip():
+            scan_set.adaptive_coarse_cell = int(coarse_input)
+        threshold_input = input(f"Enter relative count rate difference that triggers refinement (current: {scan_set.adaptive_count_threshold}): ")
+        if threshold_input.strip():
+            scan_set.adaptive_count_threshold = float(threshold_input)
+        threshold_input = input(f"Enter ToL shape distance (0-1) that triggers refinement (current: {scan_set.adaptive_tol_threshold}): ")
+        if threshold_input.strip():
+            scan_set.adaptive_tol_threshold = float(threshold_input)
+
+    # Scan order
+    order_input = input(f"Enter scan order {tuple(SCAN_ORDERINGS)} (current: {scan_set.scan_order}): ")
+    if order_input.strip():
+        if order_input.strip().lower() not in SCAN_ORDERINGS:
+            print(f"Unknown scan order: {order_input}")
+            continue
+        scan_set.scan_order = order_input.strip().lower()
+
     # Counter integration time
     cit_input = input(f"Enter counter integration time in ms (current: {scan_set.counter_integration_time}): ")
     if cit_input.strip():
@@ -141,6 +198,14 @@ while settings_not_applied:
     if acq_time_input.strip():
         scan_set.tol_acquisition_time = int(acq_time_input)
 
+    target_input = input(f"Enter target total counts to stop ToL acquisitions early, 0 to disable (current: {scan_set.tol_target_counts}): ")
+    if target_input.strip():
+        scan_set.tol_target_counts = int(target_input) or None
+
+    target_input = input(f"Enter target relative uncertainty on the ToL peak to stop early, 0 to disable (current: {scan_set.tol_target_uncertainty}): ")
+    if target_input.strip():
+        scan_set.tol_target_uncertainty = float(target_input) or None
+
     bcount_input = input(f"Enter time-of-life bin count (current: {scan_set.tol_bcount}): ")
     if bcount_input.strip():
         scan_set.tol_bcount = int(bcount_input)
@@ -178,8 +243,14 @@ while settings_not_applied:
     for axis in axis_list:
         print(f"  Step size {axis}: {scan_set.step_size} m")
         print(f"  Resolution {axis}: {scan_set.resolution}")
+    print(f"  Scan mode: {scan_set.scan_mode}" + (f" at {scan_set.step_velocity} m/s" if scan_set.scan_mode == "fly" else "") + (" (asyncio drivers)" if scan_set.scan_mode == "step" and use_async_driver else ""))
+    if scan_set.scan_mode == "adaptive":
+        print(f"  Adaptive coarse cell: {scan_set.adaptive_coarse_cell} px, thresholds: {scan_set.adaptive_count_threshold} (count rate) {scan_set.adaptive_tol_threshold} (ToL shape)")
+    print(f"  Scan order: {scan_set.scan_order}")
     print(f"  Counter integration time: {scan_set.counter_integration_time} ms")
     print(f"  Acquisition time tolerance: {scan_set.tol_acquisition_time} s")
+    if scan_set.tol_target_counts or scan_set.tol_target_uncertainty:
+        print(f"  ToL early termination: {scan_set.tol_target_counts} counts / {scan_set.tol_target_uncertainty} peak uncertainty")
     print(f"  Beam count tolerance: {scan_set.tol_bcount}")
     print(f"  Beam width tolerance: {scan_set.tol_bwidth}")
     print(f"  Delay tolerance: {scan_set.tol_delay} ms")
@@ -201,13 +272,11 @@ while settings_not_applied:
 
 
 # Applying some settings here.
-while not timecontroller.threshold(1, input1_threshold) or not timecontroller.threshold("start", start_threshold):
+# Thresholds and enables of both inputs in one round trip.
+while not timecontroller.setup_inputs({"start": start_threshold, 1: input1_threshold}):
     print("Could not set voltage threshold. Retrying")
     time.sleep(0.5)
 
-for i in ["start", 1]:
-    timecontroller.enable_input(i)
-
 print(f'Threshold on Start: {timecontroller.threshold("start")}\nThreshold on Input 1: {timecontroller.threshold(1)}\n')
 
 input1_counter.set_integration_time(scan_set.counter_integration_time)
@@ -220,27 +289,52 @@ if timecontroller.delay(1, scan_set.tol_delay):
 
 
 
-scan_sequencer = scan_set.initialize_step_sequencer()       # Initializes the sequencer, which is the object calculating the next movement of the positioner.
+scan_trajectory = scan_set.initialize_trajectory()          # Precalculates the whole scan: index, position and per-axis move of every point, in the chosen order.
 
 scan_res = scan_set.initialize_results()                    # Initializes the results, the object in chrge of storing data and saving/loading it to/from file.
+measured_points = set()
+
+# Only a step scan resumes from its journal: the fly and adaptive scans start from a zeroed stage with empty results.
+resume_scan = resume_scan and scan_set.scan_mode == "step"
+if resume_scan:
+    journal_resolution = ScanJournal.read_header(journal_filepath)["resolution"]
+    if journal_resolution != scan_set.resolution:
+        print(f"The journal {journal_filepath} belongs to a scan with resolution {journal_resolution}, not {scan_set.resolution}.\n Choose another journal path. Aborting.")
+        exit()
+    scan_res, measured_points = ScanJournal.replay(journal_filepath)
+    print(f"Resuming scan: {len(measured_points)}/{len(scan_trajectory)} points already in the journal.")
+
+scan_journal = ScanJournal(journal_filepath, scan_set.resolution) if journal_filepath and scan_set.scan_mode == "step" else None
+scan_timer = ScanTimer(len(scan_trajectory) - len(measured_points))   # per-phase wall time of every point, live ETA
+motion_http = {"calls": 0, "time": 0}                                 # HTTP requests spent by scan_motion()
+
+raster_travel = ScanTrajectory(scan_set.resolution, scan_set.step_size, "raster").total_travel()
+print(f"Total positioner travel: {round(scan_trajectory.total_travel()*1e3, 3)} mm ({scan_set.scan_order}), saving {round((raster_travel - scan_trajectory.total_travel())*1e3, 3)} mm over raster order.")
+for axis, travel in scan_trajectory.travel_per_axis().items():
+    print(f"  {axis} axis travel: {round(travel*1e3, 3)} mm")
 
 
 ## defining some functions for the main routine later:
 
 ############################## SCAN ROUTINE DEFINITION ###############################
 
-def scan_motion(position_instruction: dict[str, float], scan_settings: ScanParameters, positioner: Positioner):
+def scan_motion(position_instructions: list[dict], scan_settings: ScanParameters, positioner: Positioner):
 
 
-    actual_position=positioner.get_position(position_instruction["axis"])
-    
+    # All the axes of the step are commanded together and waited for as a group: one moveAbsolute per axis plus one
+    # stream of status polls per try, final positions come from the last status payloads. Only failed axes are retried.
+    targets = {instruction["axis"]: instruction["position"] for instruction in position_instructions}
     try_count=1
-    while position_instruction["position"] != actual_position:
-        positioner.move_to_position(position_instruction["axis"], position_instruction["position"])
-
-        positioner.wait_end_motion(position_instruction["axis"], scan_settings.polling_frequency)
-        #time.sleep(0.25) # safety sleep
-        actual_position=positioner.get_position(position_instruction["axis"])
+    while targets:
+        report = positioner.move_axes_and_wait(targets, scan_settings.polling_frequency)
+        scan_timer.add("motion", report["travel-s"])
+        scan_timer.add("settle", report["settle-s"])
+        motion_http["calls"] += report["http-calls"]
+        motion_http["time"] += report["http-time-s"]
+
+        if report["reached"]:
+            break
+        targets = {axis: targets[axis] for axis in report["failed"]}
 
         if try_count == scan_settings.max_positioner_retries:
             print(f"Took positioner {scan_settings.max_positioner_retries} times to get it right.\n Limit exceeded. Aborting.")
@@ -258,13 +352,33 @@ def measure_frequency(step_index_vector: dict, scan_results: ScanResults, counte
 
 ############################### ToL MEASUREMENT FUNCTION ###############################
 def measure_tol(step_index_vector: dict, scan_results: ScanResults, acquisition_time: int, tol: TCToL):
-    data_obj = tol.acquire(acquisition_time)                                # Hangs for X seconds.
+    data_obj = tol.acquire_until(                                           # Hangs for X seconds at most, less if the targets are reached.
+        acquisition_time,
+        target_counts=scan_set.tol_target_counts,
+        target_relative_uncertainty=scan_set.tol_target_uncertainty,
+    )
     scan_results.input_data(step_index_vector, data_obj)                    # Inputs the diagram and proceeds
 
+############################### COUNTER + ToL MEASUREMENT FUNCTION #####################
+def measure_count_and_tol(step_index_vector: dict, scan_results: ScanResults, acquisition_time: int, tol: TCToL, counter: TCCounter) -> list:
+    # Count rate and ToL from the same REC window: no separate counter dwell on every pixel.
+    data_objs = tol.acquire_with_count(
+        counter,
+        acquisition_time,
+        target_counts=scan_set.tol_target_counts,
+        target_relative_uncertainty=scan_set.tol_target_uncertainty,
+    )
+    scan_timer.add_many(tol.last_timings)
+    for data_obj in data_objs:
+        scan_results.input_data(step_index_vector, data_obj)
+    return list(data_objs)
+
 ############################### EXIT function, for when things go wrong ################
 
 def exit(signum, frame):
     print(f"Received signal {signum} to stop.")
+    if scan_journal:
+        scan_journal.close()
     if scan_started:
         for axis in axis_list:
             print(f"Stopping positioner {axis}")
@@ -285,16 +399,21 @@ signal.signal(signal.SIGTERM, exit)  # kill <pid>
 
 ################################################ SCAN SECTION ####################################################
 
-print(f"Tempo presvisto per scansione: {round(time_calculator(scan_set, count=True)/60, 1)} minuti.")
+if scan_set.scan_mode == "fly":
+    print(f"Tempo presvisto per scansione: {round(fly_scan_duration(scan_set)/60, 1)} minuti.")
+else:
+    print(f"Tempo presvisto per scansione: {round(time_calculator(scan_set, tol=True)/60, 1)} minuti.")       # counts come from the ToL window
 print("Tutto pronto. Premi invio...")
 input()
 
 
 scan_started = True
 start_time = time.time()
+scan_timer.start()
 
 ## ZEROING ALL POSITIONER AXES 
-for axis in axis_list:
+# Not when resuming: the journal positions refer to the zero of the interrupted scan.
+for axis in axis_list if not resume_scan else []:
     while not positioner.zero_position(axis):
         positioner.zero_position(axis)
         time.sleep(0.25)
@@ -303,49 +422,102 @@ for axis in axis_list:
     time.sleep(0.25)
 
 
-# here i initialise the index vector first so the first zeroeth step is registered correctly.
-# this will be then ovveridden by the next_step_in_Sequence method by
-# the sequencer each new iteration.
+################################################### MAIN LOOP LOGIC ####################################################
+# The trajectory already holds every index and move of the scan, so the loop just walks it: first move (the first point
+# of every ordering is the zeroed origin, so nothing moves there), then measure.
+# In fly mode the fast axis never stops: rows are flown at constant velocity and only counts are recorded.
+
+if scan_set.scan_mode == "fly":
+    # Fly rows are always serpentine, the trajectory order only applies to step scans.
+    fly_scan(timecontroller.connection, positioner, scan_set, scan_res, counter="1", state=timecontroller.state)
+
+elif scan_set.scan_mode == "adaptive":
+    # The adaptive scan decides the points itself (nearest neighbour order within each refinement pass).
+    adaptive_position = {axis: 0 for axis in scan_res.active_axes}
+
+    def measure_adaptive_point(index_vector: dict) -> list:
+        motion_instructions = []
+        for axis, index in index_vector.items():
+            position = round(index * scan_set.step_size[axis], 9)
+            if position != adaptive_position[axis]:
+                motion_instructions.append({"axis": axis, "position": position})
+        if motion_instructions:
+            print(f"Moving Positioner to: {motion_instructions}")
+            scan_motion(motion_instructions, scan_set, positioner)
+            adaptive_position.update({instruction["axis"]: instruction["position"] for instruction in motion_instructions})
+        time.sleep(scan_set.sleep_time)
+
+        print(f"Current Position Index: {index_vector}")
+        return list(input1_tol.acquire_with_count(input1_counter, scan_set.tol_acquisition_time, scan_set.tol_target_counts, scan_set.tol_target_uncertainty))
+
+    scan_res = AdaptiveScan(scan_set).run(measure_adaptive_point)        # QuadtreeScanResults, saved as cells
+elif use_async_driver:
+    # Same step scan on one event loop: group moves, TC1000 readout in a thread and cryostat telemetry overlap.
+    cryostat_telemetry = run_async_step_scan(
+        montana_ip, scan_set, scan_res, input1_tol, input1_counter,
+        trajectory=scan_trajectory, measured=measured_points, journal=scan_journal, timer=scan_timer,
+    )
+    with open(f"{results_filepath}.telemetry.json", "w", encoding="utf-8") as f:
+        json.dump(cryostat_telemetry, f, indent=2)
+
+else:
+    resync_position = resume_scan          # after skipped points every axis is moved, not just the ones that changed
+
+    for step in range(len(scan_trajectory)):
+        index_vector = scan_trajectory.index_vector(step)
+        if tuple(index_vector.values()) in measured_points:
+            resync_position = True
+            continue
 
-index_vector = {axis: 0 for axis in axis_list}
+        scan_timer.start_point()
 
-################################################### MAIN LOOP LOGIC ####################################################
-while True:
-    
-    print(f"Current Position Index: {index_vector}")
+        if resync_position:
+            motion_instructions = [{"axis": axis, "position": position} for axis, position in scan_trajectory.position_vector(step).items()]
+            resync_position = False
+        else:
+            motion_instructions = scan_trajectory.motion_instructions(step)
 
-    # Measurement stage:
-    print("Measuring photon incidence freq:")
-    measure_frequency(index_vector, scan_res, input1_counter)
-    print(f"Measuring photon ToL for {scan_set.tol_acquisition_time} seconds:")
-    measure_tol(index_vector, scan_res, scan_set.tol_acquisition_time, input1_tol)
-    
-    next = scan_sequencer.next_step_in_sequence()
-    
-    if next == None:
-        break
-    else:
-        index_vector = next[0]
-        motion_instructions = next[1]
+        # Motion stage: the scan motion receives an instruction list from the trajectory. It moves the positioners to the correct positions and updates it's 
+        # internal records.
 
-    # Motion stage: the scan motion receives an instruction list from the sequencer. It moves the positioners to the correct positions and updates it's 
-    # internal records.
+        if motion_instructions:
+            print(f"Moving Positioner to: {motion_instructions}")
+            scan_motion(motion_instructions, scan_set, positioner)
+            time.sleep(scan_set.sleep_time)   # Another optional sleep margin, although not necessary.
 
-    for instruction in motion_instructions:
-        print(f"Moving Positioner to: {instruction}")
-        
-        scan_motion(instruction, scan_set, positioner)
+        print(f"Current Position Index: {index_vector} ({step + 1}/{len(scan_trajectory)})")
 
-    time.sleep(scan_set.sleep_time)   # Another optional sleep margin, although not necessary.
+        # Measurement stage:
+        print(f"Measuring photon incidence freq and ToL for {scan_set.tol_acquisition_time} seconds:")
+        point_data = measure_count_and_tol(index_vector, scan_res, scan_set.tol_acquisition_time, input1_tol, input1_counter)
+        if scan_journal:
+            with scan_timer.phase("persistence"):
+                scan_journal.record(index_vector, point_data)
+
+        scan_timer.end_point()
+        print(f"Progress: {scan_timer.progress()}")
 
 end_time=time.time()
 print(f"Time Elapsed for Scan: {end_time-start_time} S")
+
+# Back to the origin with every axis moving at once.
+if not (scan_set.scan_mode == "step" and use_async_driver):     # the async loop already went back
+    print("Returning positioner to origin.")
+    scan_motion([{"axis": axis, "position": 0} for axis in axis_list], scan_set, positioner)
 ##############################################################################################################################
 
 
+if scan_journal:
+    scan_journal.close()
 scan_res.save(results_filepath)
 scan_set.save(parameters_filepath)
 
+if scan_set.scan_mode == "step":
+    print(scan_timer.format_report())
+    if motion_http["calls"]:
+        print(f"Motion: {motion_http['calls']} HTTP requests, {round(motion_http['time'], 3)} s waiting for replies ({round(1e3*motion_http['time']/motion_http['calls'], 2)} ms each).")
+    scan_timer.save(f"{results_filepath}.timing.json")        # breakdown saved next to the results
+
 print("Premi invio per uscire...")
 input()
 exit()
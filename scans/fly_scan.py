@@ -0,0 +1,189 @@
+import math
+import time
+import numpy as np
+import requests
+from devices.idq_tc1000_counter import CountData
+from devices.montana_cryoadvance_controls import Positioner
+from scans.scan_data_structures import ScanParameters, ScanResults
+from scans.scan_trajectory import ScanTrajectory
+from utils.acquisitions.counts_over_time import (
+    setup_input_counts_over_time_acquisition,
+    acquire_counts_over_time,
+)
+
+'''
+Fly scan: invece di fermarsi su ogni punto, l'asse veloce si muove a velocità costante lungo l'intera riga mentre il TC1000
+registra un istogramma counts-over-time (bin temporali dal PLAY del RECord). Nota la velocità comandata, il centro di ogni
+bin temporale corrisponde a una posizione sulla riga; i bin vengono poi sommati sui pixel della griglia di ScanResults.
+
+Le righe sono percorse a serpentina, così tra una riga e l'altra si muovono solo gli assi lenti.
+Solo conteggi: in modalità fly non si acquisiscono ToL.
+'''
+
+
+def move_axes(positioner: Positioner, targets: dict, polling_frequency: int = 100, max_retries: int = 10) -> dict:
+    # Group move retried on the failed axes only, like scan_motion() in the example script. Raises ConnectionError
+    # when an axis still has not reached its target after max_retries tries.
+    for try_count in range(1, max_retries + 1):
+        report = positioner.move_axes_and_wait(targets, polling_frequency)
+        if report["reached"]:
+            return report
+        targets = {axis: targets[axis] for axis in report["failed"]}
+    raise ConnectionError(f"move_axes(): {targets} not reached after {max_retries} tries.")
+
+
+def fly_line(
+    tc,
+    positioner: Positioner,
+    hist_to_counter_map: dict,
+    counter: str,
+    axis: str,
+    start: float,
+    end: float,
+    velocity: float,
+    bin_time: int,
+    polling_frequency: int = 100,
+    settle_margin: float = 0.5,
+    state = None,
+    max_retries: int = 10,
+):
+    # Moves `axis` from start to end at constant velocity while recording counts over time.
+    # Returns the position of every time bin centre (m), its counts and the bin duration (s), or None if the stage did
+    # not fly to the end of the line (move refused or stopped short): the counts can not be mapped onto the line.
+
+    move_axes(positioner, {axis: start}, polling_frequency, max_retries)
+
+    bin_time_s = bin_time * 1e-12
+    line_duration = abs(end - start) / velocity
+    nb_bins = math.ceil((line_duration + settle_margin) / bin_time_s)
+
+    motion_start = {}
+
+    def start_motion():
+        # Called right after REC:PLAY: the delay between the record start and the motion start shifts the time axis.
+        play_time = time.time()
+        try:
+            motion_start["accepted"] = positioner.move_to_position(axis, end, blocking=False)
+        except requests.RequestException:
+            motion_start["accepted"] = False
+        motion_start["delay"] = (time.time() - play_time) / 2          # the move is accepted roughly half way through the request
+
+    counts = acquire_counts_over_time(tc, bin_time, nb_bins, hist_to_counter_map, on_play=start_motion, state=state)[counter]
+    if not motion_start["accepted"]:
+        return None
+    try:
+        positioner.wait_end_motion(axis, polling_frequency)
+    except (ConnectionError, requests.RequestException):
+        return None
+    if positioner.position.get(axis) != round(end, 9):
+        return None
+
+    counts = np.asarray(counts)
+    bin_centres = (np.arange(len(counts)) + 0.5) * bin_time_s - motion_start["delay"]
+    travelled = np.clip(bin_centres, 0, line_duration) * velocity
+    positions = start + math.copysign(1, end - start) * travelled
+
+    moving = (bin_centres >= 0) & (bin_centres <= line_duration)        # bins recorded before/after the motion are dropped
+    return positions[moving], counts[moving], bin_time_s
+
+
+def bin_line_to_pixels(positions: np.ndarray, counts: np.ndarray, bin_time_s: float, step_size: float, resolution: int):
+    # Sums the time bins falling in each pixel [k*step - step/2, k*step + step/2). Returns counts and dwell time per pixel.
+    pixel = np.floor(positions / step_size + 0.5).astype(int)
+    inside = (pixel >= 0) & (pixel < resolution)
+
+    pixel_counts = np.bincount(pixel[inside], weights=counts[inside], minlength=resolution)
+    pixel_dwell = np.bincount(pixel[inside], minlength=resolution) * bin_time_s
+    return pixel_counts.astype(int), pixel_dwell
+
+
+def fly_scan(
+    tc,
+    positioner: Positioner,
+    scan_settings: ScanParameters,
+    scan_results: ScanResults,
+    counter: str = "1",
+    bins_per_pixel: int = 10,
+    state = None,
+):
+    # Fly scan over the whole ScanParameters grid. The first active axis is the fast (flying) one, the others are
+    # stepped between rows. Every pixel gets a CountData whose integration time is the time spent flying over it.
+    # Pass the TimeController's TCState as `state` so that its mirror follows the histogram changes.
+
+    axes = scan_results.active_axes
+    fast_axis = axes[0]
+    slow_axes = axes[1:]
+    step = scan_settings.step_size[fast_axis]
+    resolution = scan_settings.resolution[fast_axis]
+    velocity = scan_settings.step_velocity
+
+    if not velocity:
+        raise ValueError("fly_scan(): ScanParameters.step_velocity must be set to the fly velocity (m/s).")
+
+    bin_time = round(step / velocity / bins_per_pixel * 1e12)            # ps
+    hist_to_counter_map, bin_time = setup_input_counts_over_time_acquisition(tc, bin_time, [counter], state)
+
+    # Rows are the grid of the slow axes, walked in serpentine order. A 1D scan is a single row.
+    if slow_axes:
+        rows = ScanTrajectory(
+            {axis: scan_settings.resolution[axis] for axis in slow_axes},
+            {axis: scan_settings.step_size[axis] for axis in slow_axes},
+            "serpentine",
+        )
+        row_indices = [rows.index_vector(i) for i in range(len(rows))]
+        row_motions = [rows.motion_instructions(i) for i in range(len(rows))]
+    else:
+        row_indices, row_motions = [{}], [[]]
+
+    line_ends = (-step / 2, (resolution - 1) * step + step / 2)
+
+    # The fly velocity only holds for the rows: the previous one is restored afterwards, also on errors
+    previous_velocity = positioner.velocity[fast_axis]
+    if not positioner.set_velocity(fast_axis, velocity):
+        raise ConnectionError(f"fly_scan(): could not set {fast_axis} velocity to {velocity} m/s.")
+
+    try:
+        for row, (row_index, row_motion) in enumerate(zip(row_indices, row_motions)):
+            if row_motion:
+                targets = {instruction["axis"]: instruction["position"] for instruction in row_motion}
+                move_axes(positioner, targets, scan_settings.polling_frequency, scan_settings.max_positioner_retries)
+
+            start, end = line_ends if row % 2 == 0 else line_ends[::-1]
+            print(f"Flying {fast_axis} over row {row_index} ({row + 1}/{len(row_indices)})")
+
+            # A line the stage did not fly is recorded again from its start
+            for try_count in range(1, scan_settings.max_positioner_retries + 1):
+                line = fly_line(
+                    tc, positioner, hist_to_counter_map, counter, fast_axis, start, end, velocity, bin_time,
+                    scan_settings.polling_frequency, state=state, max_retries=scan_settings.max_positioner_retries,
+                )
+                if line is not None:
+                    break
+                print(f"fly_scan(): {fast_axis} did not fly over row {row_index}, recording it again ({try_count}).")
+            else:
+                raise ConnectionError(f"fly_scan(): {fast_axis} did not fly over row {row_index} after {try_count} tries.")
+
+            positions, counts, bin_time_s = line
+            pixel_counts, pixel_dwell = bin_line_to_pixels(positions, counts, bin_time_s, step, resolution)
+
+            for k in range(resolution):
+                if pixel_dwell[k] == 0:
+                    print(f"fly_scan(): no time bin fell on pixel {k} of row {row_index}, lower the velocity.")
+                    continue
+                index_vector = {fast_axis: k, **row_index}
+                index_vector = {axis: index_vector[axis] for axis in axes}         # ScanResults indexes by active axes order
+                scan_results.input_data(index_vector, CountData(int(pixel_counts[k]), float(pixel_dwell[k])))
+    finally:
+        if not positioner.set_velocity(fast_axis, previous_velocity):
+            print(f"fly_scan(): could not restore {fast_axis} velocity to {previous_velocity} m/s.")
+
+    return scan_results
+
+
+def fly_scan_duration(scan_settings: ScanParameters, row_overhead: float = 1.5) -> float:
+    # Rough duration estimate (s): every row is flown once, plus arming/settling overhead per row.
+    axes = [axis for axis, size in scan_settings.resolution.items() if size > 0]
+    fast_axis = axes[0]
+    line_duration = scan_settings.resolution[fast_axis] * scan_settings.step_size[fast_axis] / scan_settings.step_velocity
+    rows = math.prod(scan_settings.resolution[axis] for axis in axes[1:])
+    return rows * (line_duration + row_overhead)
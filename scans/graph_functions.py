@@ -90,6 +90,9 @@ def show_tol_graph_2D(
         if 0 <= row < rows and 0 <= col < cols:
             count_obj =  results.get_data(index, CountData)
             tol_obj = results.get_data(index, ToLData)
+            if tol_obj is None:                 # e.g. fly scans, which only record counts
+                print(f"No ToL recorded at {index}.")
+                return
             _fig,_ax = plt.subplots()
 
             ax1 = plt.axes([0.05, 0.9, 0.13, 0.075])  # left, bottom, width, height
@@ -3,6 +3,7 @@ import matplotlib.colors as mcolors
 import numpy as np
 from scans.graph_functions import *
 from scans.scan_data_structures import *
+from scans.adaptive_scan import load_results
 from matplotlib.ticker import FuncFormatter
 from functools import partial
 from datetime import datetime
@@ -44,6 +45,9 @@ def interactive_1D_graph(results, settings):
             if 0 <= col < results.resolution[axis]:
                 obj = results.get_data((col,), ToLData)
                 count_obj = results.get_data((col,), CountData)
+                if obj is None:                 # e.g. fly scans, which only record counts
+                    print(f"No ToL recorded at {col}.")
+                    return
                 _fig,_ax = plt.subplots()
                 annot = _ax.annotate(
                     "", xy=(0,0), xytext=(15,15), textcoords="offset points",
@@ -167,7 +171,7 @@ if __name__ == "__main__":
         break
 
         
-    results = ScanResults.load(results_filepath)
+    results = load_results(results_filepath)          # adaptive scans are expanded to their finest resolution
     settings = ScanParameters.load(parameters_filepath)
     if len(results.data_dims) == 1:
         interactive_1D_graph(results,settings)
@@ -5,84 +5,78 @@ import matplotlib.pyplot as plt
 from matplotlib.ticker import MultipleLocator
 from devices.idq_tc1000_counter import * 
 from devices.idq_tc1000_tol import *
+from scans.scan_trajectory import ScanTrajectory, SCAN_ORDERINGS
+
+SCAN_ORDERS = tuple(SCAN_ORDERINGS)
 
 class StepSequencer():
+    # Step-by-step interface over a precalculated ScanTrajectory, kept for the scripts that walk the scan one step at a time.
     def __init__(self,
         resolution=None,
         step_size=None,
+        order: str = "raster",
         ):
         if not resolution and not step_size:
             raise ValueError("StepSequencer.__init__(): resolution or step size empty or wrong format.")
+        if order not in SCAN_ORDERINGS:
+            raise ValueError(f"StepSequencer.__init__(): \"{order}\" is not a valid scan order {tuple(SCAN_ORDERINGS)}.")
         
         self.resolution = resolution
         self.step_size = step_size
-        self.step_matrix = {}
-        self.step_counter = {}
-        self.active_axes = ()
-        self.position = {}
-        self._initialize_step_matrix()
+        self.order = order
+        self.step_number = 0
+        self.trajectory = ScanTrajectory(self.resolution, self.step_size, self.order)
+        self.active_axes = self.trajectory.active_axes
+        self.step_counter = {axis: 0 for axis in self.active_axes}
+        self.position = {axis: 0 for axis in self.active_axes}
 
     
     def zero_counter(self):
         for axis in self.step_counter.keys():
             self.step_counter[axis] = 0
-
-    def _initialize_step_matrix(self):
-        
-        step_dims = tuple(size for size in self.resolution.values() if size > 0)
-        self.active_axes = tuple(axis for axis, size in self.resolution.items() if size > 0)
-        
-        if not step_dims:
-            raise ValueError("StepSequencer._initialize_step_matrix(): At least one resolution must be nonzero")
-        
-        for axis in self.active_axes:
-            if self.step_size[axis] == 0:
-                raise ValueError("StepSequencer._initialize_step_matrix(): Step sizes for active axes must be different from 0")
-                
-        for axis in self.active_axes:
-            self.position.update({axis: 0})
-            self.step_matrix.update({axis: []})
-            self.step_counter.update({axis: 0})
-            for i in range(0, self.resolution[axis]):
-                self.step_matrix[axis].append(round(i * self.step_size[axis], 9))           # Result of this will be a step matrix like so: {"Y": [steps], "Z": [steps]} if X resolution was left 0.
+        self.step_number = 0
 
     def next_step_in_sequence(self) -> tuple[dict, list[dict]]|None:
         
-        def diff_positions(old: dict, new: dict) -> list:
-            changes = []
-            for key, new_value in new.items():
-                old_value = old.get(key)
-                if old_value != new_value:
-                    changes.append({"axis": key, "position": new_value})
-            return changes
-        
-        old_position_vector = self.position
-
-        # Next Step Index calculation        
-        if self.step_counter != {axis: self.resolution[axis] - 1 for axis in self.active_axes}:
-            for axis, value in self.step_counter.items():       ## Algorithm iterations: 4 works correctly now, finally
-                if value < self.resolution[axis] - 1:
-                    self.step_counter[axis] += 1
-                    break
-                else:
-                    self.step_counter[axis] = 0
-
-            # Now convert indexes to positions via the step size matrix 
-            new_position_vector = {axis: round(self.step_counter[axis] * self.step_size[axis], 9) for axis in self.active_axes}
-            self.position = new_position_vector
-            index_vector = self.step_counter
-            motion_instructions = diff_positions(old_position_vector, new_position_vector)
-
-            # Finally return the index vector and the instructions for motion.
-            return index_vector, motion_instructions                # return signature iterations: at least 10 now.. my god. this should work, since the 
-                                                                    # index vector is used by data input functions to put data in the right matrix slots
-                                                                    # and instructions are interpreted by the positioner motion function.
-        
-        
-        else:           # once scan is over, the sequences flips it's flag and outside functions can tell the sequence is over, to stop looping.
-            self.step_counter = {axis: 0 for axis in self.active_axes}
-            self.position = self.step_counter
+        self.step_number += 1
+
+        if self.step_number >= len(self.trajectory):        # once scan is over, the sequences flips it's flag and outside functions can tell the sequence is over, to stop looping.
+            self.zero_counter()
+            self.position = {axis: 0 for axis in self.active_axes}
+            return None
+
+        # Indexes, positions and moves are all precalculated by the trajectory, here they are just looked up.
+        self.step_counter = self.trajectory.index_vector(self.step_number)
+        self.position = self.trajectory.position_vector(self.step_number)
+        index_vector = self.step_counter
+        motion_instructions = self.trajectory.motion_instructions(self.step_number)
+
+        # Finally return the index vector and the instructions for motion.
+        return index_vector, motion_instructions                # return signature iterations: at least 10 now.. my god. this should work, since the 
+                                                                # index vector is used by data input functions to put data in the right matrix slots
+                                                                # and instructions are interpreted by the positioner motion function.
+
+    def fast_forward(self, measured: set) -> tuple[dict, list[dict]]|None:
+        # Resume support: jumps to the first index not in `measured` (set of index tuples, e.g. from a scan journal).
+        # Returns the index vector and the instructions to move every axis there from anywhere, None if all is measured.
+        step = self.trajectory.first_unmeasured(measured)
+        if step is None:
             return None
+
+        self.step_number = step
+        self.step_counter = self.trajectory.index_vector(step)
+        self.position = self.trajectory.position_vector(step)
+        return self.step_counter, [{"axis": axis, "position": position} for axis, position in self.position.items()]
+
+    def travel_distance(self) -> float:
+        # Total distance (metres) the positioner covers over the whole scan in this sequencer's order. Axes are moved
+        # one after the other by scan_motion, so the distances of every axis add up.
+        return self.trajectory.total_travel()
+
+    def travel_saving(self) -> float:
+        # Distance (metres) saved with respect to the plain raster order of the same grid.
+        raster = ScanTrajectory(self.resolution, self.step_size, "raster")
+        return round(raster.total_travel() - self.travel_distance(), 9)
         
 
 
@@ -101,7 +95,14 @@ class ScanParameters:
         max_positioner_retries = None,
         tol_bcount = None,
         tol_bwidth = None,
-        tol_delay = None
+        tol_delay = None,
+        scan_order = None,
+        scan_mode = None,
+        adaptive_coarse_cell = None,
+        adaptive_count_threshold = None,
+        adaptive_tol_threshold = None,
+        tol_target_counts = None,
+        tol_target_uncertainty = None
     ):
         # defaults
         self.resolution = {"X": 0, "Y": 0, "Z": 0}
@@ -117,6 +118,14 @@ class ScanParameters:
         self.tol_bcount = 100
         self.tol_bwidth = 100
         self.tol_delay = 0  # in picoseconds.
+        self.scan_order = "raster"      # see SCAN_ORDERS
+        self.scan_mode = "step"         # "step": stop, settle and measure on every point. "fly": counts only, fast axis at step_velocity (m/s)
+                                        # "adaptive": quadtree refinement, see scans/adaptive_scan.py
+        self.adaptive_coarse_cell = 8           # pixels per side of the coarse pass cells
+        self.adaptive_count_threshold = 0.2     # relative count rate difference between neighbours that triggers refinement
+        self.adaptive_tol_threshold = 0.2       # ToL shape distance (0-1) between neighbours that triggers refinement
+        self.tol_target_counts = None           # stop ToL acquisitions early at this total count...
+        self.tol_target_uncertainty = None      # ...or at this relative uncertainty on the peak. tol_acquisition_time is then the maximum.
 
     
         if resolution is not None:
@@ -145,10 +154,27 @@ class ScanParameters:
             self.tol_bwidth = tol_bwidth
         if tol_delay is not None:
             self.tol_delay = tol_delay
+        if scan_order is not None:
+            self.scan_order = scan_order
+        if scan_mode is not None:
+            self.scan_mode = scan_mode
+        if adaptive_coarse_cell is not None:
+            self.adaptive_coarse_cell = adaptive_coarse_cell
+        if adaptive_count_threshold is not None:
+            self.adaptive_count_threshold = adaptive_count_threshold
+        if adaptive_tol_threshold is not None:
+            self.adaptive_tol_threshold = adaptive_tol_threshold
+        if tol_target_counts is not None:
+            self.tol_target_counts = tol_target_counts
+        if tol_target_uncertainty is not None:
+            self.tol_target_uncertainty = tol_target_uncertainty
         
 
     def initialize_step_sequencer(self):
-        return StepSequencer(self.resolution, self.step_size)
+        return StepSequencer(self.resolution, self.step_size, self.scan_order)
+
+    def initialize_trajectory(self):
+        return ScanTrajectory(self.resolution, self.step_size, self.scan_order)
     
     def initialize_results(self):
         return ScanResults(self.resolution)
@@ -199,6 +225,16 @@ class ScanResults:
         self.data_matrix[tuple_position].append(value)
 
 
+    def input_values(self, position: dict, values: dict) -> list:
+        # Rebuilds the data objects from their serialized out() values (results files, scan journals) and inputs them.
+        obj_list = []
+        for item in [CountData.input(values), ToLData.input(values)]:
+            if item:
+                obj_list.append(item)
+                self.input_data(position, item)
+        return obj_list
+
+
     def get_data(self, position: dict|tuple, data_type = None) -> list:  
         if type(position) == dict:
             tuple_position = tuple(value for value in position.values()) 
@@ -264,18 +300,7 @@ class ScanResults:
         obj = ScanResults(resolution)
         # Fill data_matrix with object lists
         for data_dict in json_data["data"]:
-            counter_obj = CountData.input(data_dict["values"])
-            tol_obj =  ToLData.input(data_dict["values"])
-
-            obj_list = []
-            if counter_obj:
-                obj_list.append(counter_obj)
-            if tol_obj:
-                obj_list.append(tol_obj)
-            
-            pos = data_dict["position"]
-            for item in obj_list:
-                obj.input_data(pos, item)
+            obj.input_values(data_dict["position"], data_dict["values"])
             
         return obj
 
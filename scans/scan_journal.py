@@ -0,0 +1,114 @@
+import os
+import sys
+import json
+import time
+import queue
+from threading import Thread
+from scans.scan_data_structures import ScanResults
+
+'''
+Giornale di scansione, append-only, una riga JSON per punto misurato:
+
+    {"journal": 1, "resolution": {...}, "created": ...}                 prima riga (header)
+    {"position": {"Y": 0, "Z": 0}, "values": {...out() dei dati...}}    una riga per punto
+
+Le righe vengono scritte da un thread dedicato (flush + fsync ad ogni punto), così il loop di scansione paga solo
+l'inserimento in una coda. Se la scansione si interrompe, ScanJournal.replay() ricostruisce ScanResults e l'insieme
+degli indici già misurati, da cui si riparte (StepSequencer.fast_forward / ScanTrajectory.first_unmeasured).
+Un'eventuale ultima riga troncata da un crash viene ignorata.
+'''
+
+JOURNAL_VERSION = 1
+
+
+class ScanJournal:
+    def __init__(self, path: str, resolution: dict = None):
+        if not path:
+            raise ValueError("ScanJournal.__init__(): path must be given.")
+
+        self.path = path
+        self.entries_written = 0
+        self.write_errors = 0
+        self._queue = queue.Queue()
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            header = self.read_header(path)
+            if resolution is not None and header["resolution"] != resolution:
+                raise ValueError(f"ScanJournal.__init__(): {path} belongs to a scan with resolution {header['resolution']}.")
+            with open(path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                truncated = f.read(1) != b"\n"
+            self._file = open(path, "a", encoding="utf-8")
+            if truncated:                   # a crash cut the last line, start the next entry on a line of its own
+                self._file.write("\n")
+        else:
+            if resolution is None:
+                raise ValueError("ScanJournal.__init__(): resolution must be given to start a new journal.")
+            self._file = open(path, "w", encoding="utf-8")
+            self._write_line({"journal": JOURNAL_VERSION, "resolution": resolution, "created": time.time()})
+
+        self._writer = Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _write_line(self, entry: dict):
+        self._file.write(json.dumps(entry) + "\n")
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _write_loop(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                break
+            try:
+                position, data_objs = entry
+                values = {}
+                for obj in data_objs:
+                    values.update(obj.out())
+                self._write_line({"position": position, "values": values})
+                self.entries_written += 1
+            except Exception as e:
+                self.write_errors += 1
+                print(f"ScanJournal: failed to write entry for {entry[0]} -> {e}", file=sys.stderr)
+
+    def record(self, position: dict, data_objs: list):
+        # Non blocking: the point is serialized and written by the writer thread.
+        self._queue.put((dict(position), list(data_objs)))
+
+    def close(self):
+        # Waits for the pending entries to be on disk.
+        if self._writer.is_alive():
+            self._queue.put(None)
+            self._writer.join()
+        self._file.close()
+
+    @staticmethod
+    def read_header(path: str) -> dict:
+        with open(path, "r", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+        if header.get("journal") != JOURNAL_VERSION:
+            raise ValueError(f"ScanJournal.read_header(): {path} is not a scan journal.")
+        return header
+
+    @staticmethod
+    def replay(path: str) -> tuple[ScanResults, set]:
+        # Rebuilds the ScanResults from the journal and returns it with the set of measured index tuples.
+        header = ScanJournal.read_header(path)
+        results = ScanResults(header["resolution"])
+        measured = set()
+
+        with open(path, "r", encoding="utf-8") as f:
+            f.readline()
+            for line_number, line in enumerate(f, 2):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"ScanJournal.replay(): skipping corrupted line {line_number} of {path}", file=sys.stderr)
+                    continue
+                position = {axis: entry["position"][axis] for axis in results.active_axes}
+                if tuple(position.values()) in measured:
+                    continue
+                results.input_values(position, entry["values"])
+                measured.add(tuple(position.values()))
+
+        return results, measured
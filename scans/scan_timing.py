@@ -0,0 +1,111 @@
+import sys
+import json
+import time
+from contextlib import contextmanager
+
+'''
+Strumentazione dei tempi di scansione.
+
+Il loop di scansione racchiude ogni fase di ogni punto in ScanTimer.phase("nome"), oppure aggiunge tempi già misurati
+dai driver (es. TCToL.last_timings) con ScanTimer.add(). Dai tempi osservati si ricava una ETA aggiornata ad ogni punto
+e, a fine scansione, un report per fase salvato accanto ai risultati.
+'''
+
+SCAN_PHASES = ("motion", "settle", "count", "tol-arm", "tol-record", "tol-readout", "persistence")
+
+
+class ScanTimer:
+    def __init__(self, total_points: int, phases: tuple = SCAN_PHASES):
+        self.total_points = total_points
+        self.phases = {phase: [] for phase in phases}
+        self.point_times = []
+        self.points_done = 0
+        self.scan_start = None
+        self._point_start = None
+        self._current = {}
+
+    def start(self):
+        self.scan_start = time.perf_counter()
+
+    def start_point(self):
+        if self.scan_start is None:
+            self.start()
+        self._point_start = time.perf_counter()
+        self._current = {}
+
+    def end_point(self):
+        # Closes the point: every phase gets a sample, 0 if it did not happen on this point.
+        for phase in self.phases:
+            self.phases[phase].append(self._current.get(phase, 0))
+        self.point_times.append(time.perf_counter() - self._point_start)
+        self.points_done += 1
+
+    def add(self, phase: str, seconds: float):
+        self.phases.setdefault(phase, [0] * self.points_done)
+        self._current[phase] = self._current.get(phase, 0) + seconds
+
+    def add_many(self, timings: dict):
+        for phase, seconds in timings.items():
+            self.add(phase, seconds)
+
+    @contextmanager
+    def phase(self, name: str):
+        phase_start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - phase_start)
+
+    def eta(self, window: int = 20) -> float|None:
+        # Remaining time (s) from the mean of the last `window` points, so it follows changes in the point time.
+        if not self.point_times:
+            return None
+        recent = self.point_times[-window:]
+        return (self.total_points - self.points_done) * sum(recent) / len(recent)
+
+    def progress(self) -> str:
+        eta = self.eta()
+        elapsed = time.perf_counter() - self.scan_start if self.scan_start else 0
+        if eta is None:
+            return f"{self.points_done}/{self.total_points} points"
+        return (
+            f"{self.points_done}/{self.total_points} points, "
+            f"elapsed {time.strftime('%H:%M:%S', time.gmtime(elapsed))}, ETA {time.strftime('%H:%M:%S', time.gmtime(eta))}"
+        )
+
+    def report(self) -> dict:
+        wall_time = time.perf_counter() - self.scan_start if self.scan_start else 0
+        phases = {}
+        for phase, samples in self.phases.items():
+            total = sum(samples)
+            phases[phase] = {
+                "total-s": round(total, 6),
+                "mean-s": round(total / len(samples), 6) if samples else 0,
+                "max-s": round(max(samples), 6) if samples else 0,
+                "share": round(total / wall_time, 4) if wall_time else 0,
+            }
+        accounted = sum(phase["total-s"] for phase in phases.values())
+        return {
+            "points": self.points_done,
+            "wall-time-s": round(wall_time, 6),
+            "mean-point-s": round(sum(self.point_times) / len(self.point_times), 6) if self.point_times else 0,
+            "unaccounted-s": round(wall_time - accounted, 6),
+            "phases": phases,
+        }
+
+    def format_report(self) -> str:
+        report = self.report()
+        lines = [f"Scan timing: {report['points']} points in {round(report['wall-time-s'], 1)} s ({round(report['mean-point-s'], 3)} s/point)"]
+        for phase, stats in sorted(report["phases"].items(), key=lambda item: -item[1]["total-s"]):
+            lines.append(f"  {phase:<12} {stats['total-s']:>12.3f} s  {100 * stats['share']:5.1f}%  mean {stats['mean-s']:.4f} s  max {stats['max-s']:.4f} s")
+        lines.append(f"  {'unaccounted':<12} {report['unaccounted-s']:>12.3f} s")
+        return "\n".join(lines)
+
+    def save(self, path: str) -> bool:
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump({"report": self.report(), "point-times-s": self.point_times, "phase-samples-s": self.phases}, f, indent=2)
+            return True
+        except Exception as e:
+            print(f"Error saving ScanTimer to {path}: {e}", file=sys.stderr)
+            return False
@@ -0,0 +1,171 @@
+import numpy as np
+from typing import Callable
+
+'''
+Traiettoria di scansione precalcolata.
+
+L'intera scansione viene calcolata prima di muovere l'hardware, sotto forma di array NumPy con una riga per punto:
+    indices     (N, D) int      indice del punto nella matrice dei risultati (stesso ordine di ScanResults.active_axes)
+    positions   (N, D) float    posizione fisica in metri
+    moves       (N, D) float    spostamento per asse rispetto al punto precedente (il primo parte dall'origine azzerata)
+
+L'ordine di visita è "pluggable": SCAN_ORDERINGS associa un nome a una funzione ordering(shape, step_size) che restituisce
+l'array (N, D) degli indici nell'ordine desiderato. Il primo asse attivo è quello veloce.
+'''
+
+
+def raster_order(shape: tuple, step_size: np.ndarray) -> np.ndarray:
+    # Odometer order: the first axis runs fastest and flies back to 0 at the end of each row.
+    grids = np.meshgrid(*[np.arange(n) for n in shape], indexing="ij")
+    return np.stack([grid.ravel(order="F") for grid in grids], axis=1)
+
+
+def serpentine_order(shape: tuple, step_size: np.ndarray) -> np.ndarray:
+    # Reflected odometer: every axis reverses its direction each time it carries over to the next one,
+    # so for 2D scans the fast axis is walked back and forth on alternate rows.
+    indices = raster_order(shape, step_size)
+    linear = np.arange(len(indices))
+    block = 1
+    for axis, size in enumerate(shape):
+        block *= size
+        carries = linear // block                   # number of times this axis has already wrapped
+        reversed_rows = carries % 2 == 1
+        indices[reversed_rows, axis] = size - 1 - indices[reversed_rows, axis]
+    return indices
+
+
+def hilbert_order(shape: tuple, step_size: np.ndarray) -> np.ndarray:
+    # Hilbert curve over the smallest power-of-two square containing the grid, cropped to the grid.
+    # Only defined for 2D scans; a 1D scan is just walked in raster order.
+    if len(shape) == 1:
+        return raster_order(shape, step_size)
+    if len(shape) != 2:
+        raise ValueError(f"hilbert_order(): Hilbert ordering is only available for 2D scans, got {len(shape)} axes.")
+
+    side = 1
+    while side < max(shape):
+        side *= 2
+
+    d = np.arange(side * side)
+    x = np.zeros_like(d)
+    y = np.zeros_like(d)
+    t = d.copy()
+    s = 1
+    while s < side:                                 # classic d -> (x, y) conversion, vectorized over d
+        rx = 1 & (t // 2)
+        ry = 1 & (t ^ rx)
+        flip = ry == 0
+        swap_x = np.where(flip & (rx == 1), s - 1 - x, x)
+        swap_y = np.where(flip & (rx == 1), s - 1 - y, y)
+        x = np.where(flip, swap_y, swap_x)
+        y = np.where(flip, swap_x, swap_y)
+        x = x + s * rx
+        y = y + s * ry
+        t = t // 4
+        s *= 2
+
+    inside = (x < shape[0]) & (y < shape[1])
+    return np.stack([x[inside], y[inside]], axis=1)
+
+
+def nearest_neighbour_tour(positions: np.ndarray, start: np.ndarray = None) -> np.ndarray:
+    # Greedy nearest neighbour tour over an arbitrary set of points (N, D), starting from the point closest to `start`
+    # (the origin by default). Distances are the sum of per-axis travels, since the positioner moves the axes one
+    # after the other. Returns the visiting order as indices into `positions`.
+    positions = np.asarray(positions, dtype=float)
+    if start is None:
+        start = np.zeros(positions.shape[1])
+    remaining = np.ones(len(positions), dtype=bool)
+    order = np.empty(len(positions), dtype=int)
+
+    current = int(np.argmin(np.abs(positions - start).sum(axis=1))) if len(positions) else 0
+    for i in range(len(positions)):
+        order[i] = current
+        remaining[current] = False
+        if i == len(positions) - 1:
+            break
+        distance = np.abs(positions - positions[current]).sum(axis=1)
+        distance[~remaining] = np.inf
+        current = int(np.argmin(distance))
+
+    return order
+
+
+def nearest_neighbour_order(shape: tuple, step_size: np.ndarray) -> np.ndarray:
+    # Greedy nearest neighbour tour of the whole grid, starting from the origin.
+    indices = raster_order(shape, step_size)
+    return indices[nearest_neighbour_tour(indices * step_size)]
+
+
+# Add an entry here to make a new ordering available to ScanTrajectory, StepSequencer and ScanParameters.scan_order.
+SCAN_ORDERINGS: dict[str, Callable[[tuple, np.ndarray], np.ndarray]] = {
+    "raster": raster_order,
+    "serpentine": serpentine_order,
+    "hilbert": hilbert_order,
+    "nearest-neighbour": nearest_neighbour_order,
+}
+
+
+class ScanTrajectory:
+    def __init__(self, resolution: dict = None, step_size: dict = None, order: str = "raster"):
+        if not resolution or not step_size:
+            raise ValueError("ScanTrajectory.__init__(): resolution or step size empty or wrong format.")
+        if order not in SCAN_ORDERINGS:
+            raise ValueError(f"ScanTrajectory.__init__(): \"{order}\" is not a valid scan order {tuple(SCAN_ORDERINGS)}.")
+
+        self.order = order
+        self.active_axes = tuple(axis for axis, size in resolution.items() if size > 0)
+        self.shape = tuple(resolution[axis] for axis in self.active_axes)
+
+        if not self.active_axes:
+            raise ValueError("ScanTrajectory.__init__(): At least one resolution must be nonzero")
+        if any(step_size[axis] == 0 for axis in self.active_axes):
+            raise ValueError("ScanTrajectory.__init__(): Step sizes for active axes must be different from 0")
+
+        self.step_size = np.array([step_size[axis] for axis in self.active_axes], dtype=float)
+
+        self.indices = np.asarray(SCAN_ORDERINGS[order](self.shape, self.step_size), dtype=int)
+        if len(self.indices) != np.prod(self.shape) or len(np.unique(self.indices, axis=0)) != len(self.indices):
+            raise ValueError(f"ScanTrajectory.__init__(): ordering \"{order}\" does not visit every grid point exactly once.")
+
+        self.positions = np.round(self.indices * self.step_size, 9)
+        self.moves = np.round(np.diff(self.positions, axis=0, prepend=np.zeros((1, len(self.active_axes)))), 9)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def index_vector(self, step: int) -> dict:
+        return {axis: int(index) for axis, index in zip(self.active_axes, self.indices[step])}
+
+    def position_vector(self, step: int) -> dict:
+        return {axis: float(position) for axis, position in zip(self.active_axes, self.positions[step])}
+
+    def motion_instructions(self, step: int) -> list[dict]:
+        # Same format consumed by scan_motion(): only the axes that actually move.
+        return [
+            {"axis": self.active_axes[axis], "position": float(self.positions[step, axis])}
+            for axis in np.flatnonzero(self.moves[step])
+        ]
+
+    def travel_per_axis(self) -> dict:
+        # Metres travelled by each axis over the whole scan, starting from the zeroed origin.
+        return {axis: round(float(travel), 9) for axis, travel in zip(self.active_axes, np.abs(self.moves).sum(axis=0))}
+
+    def total_travel(self) -> float:
+        return round(float(np.abs(self.moves).sum()), 9)
+
+    def step_of(self, index_vector: dict|tuple) -> int:
+        # Position in the trajectory of a given grid index.
+        if type(index_vector) == dict:
+            index_vector = tuple(index_vector[axis] for axis in self.active_axes)
+        matches = np.flatnonzero((self.indices == np.asarray(index_vector)).all(axis=1))
+        if not len(matches):
+            raise ValueError(f"ScanTrajectory.step_of(): {index_vector} is not part of the scan.")
+        return int(matches[0])
+
+    def first_unmeasured(self, measured: set) -> int|None:
+        # First step whose index tuple is not in `measured`, None if the whole scan is done.
+        for step, index in enumerate(self.indices):
+            if tuple(int(i) for i in index) not in measured:
+                return step
+        return None
@@ -0,0 +1,206 @@
+import sys
+import time
+from pathlib import Path
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+from devices.idq_tc1000_counter import TCCounter, CountData
+from devices.idq_tc1000_tol import TCToL
+from devices.montana_cryoadvance_controls import Positioner
+from devices.simulators.virtual_lab import VirtualLab
+from scans.scan_data_structures import ScanParameters, ScanResults
+from scans.scan_trajectory import ScanTrajectory, SCAN_ORDERINGS
+from scans.scan_timing import ScanTimer
+from scans.adaptive_scan import AdaptiveScan
+from scans.fly_scan import fly_scan
+
+'''
+Benchmark end-to-end delle scansioni sul laboratorio virtuale (devices/simulators/virtual_lab.py).
+
+Variante non interattiva di example_scan_script.py: stessi driver (TimeController, TCToL, TCCounter, Positioner),
+stessa sequenza per punto (movimento di gruppo, conteggi + ToL dalla stessa finestra REC), ma i parametri arrivano da
+ScanParameters invece che dai prompt. Per ogni ordinamento step, per la scansione adattiva e per il fly scan riporta
+tempo, punti misurati, percorso del posizionatore e l'errore della mappa dei count rate rispetto alla verità di
+riferimento della mappa del rivelatore.
+
+    python scans/virtual_lab_benchmark.py [risoluzione per asse] [tempo di acquisizione ToL in s]
+'''
+
+
+def move_to(positioner: Positioner, targets: dict, scan_settings: ScanParameters, timer: ScanTimer = None):
+    # Group move with retries on the failed axes only, like scan_motion() in the example script.
+    for try_count in range(1, scan_settings.max_positioner_retries + 1):
+        report = positioner.move_axes_and_wait(targets, scan_settings.polling_frequency)
+        if timer:
+            timer.add("motion", report["travel-s"])
+            timer.add("settle", report["settle-s"])
+        if report["reached"]:
+            return report
+        targets = {axis: targets[axis] for axis in report["failed"]}
+
+    raise RuntimeError(f"move_to(): positioner could not reach {targets} in {scan_settings.max_positioner_retries} tries.")
+
+
+def step_scan(
+    positioner: Positioner,
+    tol: TCToL,
+    counter: TCCounter,
+    scan_settings: ScanParameters,
+    timer: ScanTimer = None,
+    poll_interval: float = 0.02,
+) -> ScanResults:
+    scan_results = scan_settings.initialize_results()
+    trajectory = scan_settings.initialize_trajectory()
+
+    for step in range(len(trajectory)):
+        if timer:
+            timer.start_point()
+        targets = {instruction["axis"]: instruction["position"] for instruction in trajectory.motion_instructions(step)}
+        if targets:
+            move_to(positioner, targets, scan_settings, timer)
+            time.sleep(scan_settings.sleep_time)
+
+        data_objs = tol.acquire_with_count(
+            counter, scan_settings.tol_acquisition_time, scan_settings.tol_target_counts,
+            scan_settings.tol_target_uncertainty, poll_interval,
+        )
+        for data_obj in data_objs:
+            scan_results.input_data(trajectory.index_vector(step), data_obj)
+        if timer:
+            timer.add_many(tol.last_timings)
+            timer.end_point()
+
+    move_to(positioner, {axis: 0 for axis in trajectory.active_axes}, scan_settings)
+    return scan_results
+
+
+def adaptive_scan(
+    positioner: Positioner,
+    tol: TCToL,
+    counter: TCCounter,
+    scan_settings: ScanParameters,
+    poll_interval: float = 0.02,
+) -> tuple[ScanResults, int]:
+    position = {axis: 0 for axis, size in scan_settings.resolution.items() if size > 0}
+
+    def measure_point(index_vector: dict) -> list:
+        targets = {axis: round(index * scan_settings.step_size[axis], 9) for axis, index in index_vector.items()}
+        targets = {axis: target for axis, target in targets.items() if target != position[axis]}
+        if targets:
+            move_to(positioner, targets, scan_settings)
+            position.update(targets)
+            time.sleep(scan_settings.sleep_time)
+        return list(tol.acquire_with_count(
+            counter, scan_settings.tol_acquisition_time, scan_settings.tol_target_counts,
+            scan_settings.tol_target_uncertainty, poll_interval,
+        ))
+
+    adaptive = AdaptiveScan(scan_settings)
+    results = adaptive.run(measure_point)
+    move_to(positioner, {axis: 0 for axis in position}, scan_settings)
+    return results.to_scan_results(), adaptive.points_measured
+
+
+def count_rate_map(scan_results: ScanResults) -> np.ndarray:
+    # Count rate (counts/s) of every pixel, NaN where nothing was measured.
+    rates = np.full(scan_results.data_dims, np.nan)
+    for idx in np.ndindex(scan_results.data_dims):
+        count = scan_results.get_data(idx, CountData)
+        if count:
+            rates[idx] = count.frequency()
+    return rates
+
+
+def compare(scan_results: ScanResults, truth: np.ndarray) -> dict:
+    # Relative RMS error (per pixel, dominated by the dark pixels and the edges), RMS error normalised to the maximum
+    # rate, correlation of the count rate map, and how many pixels are classified on the right side of the active
+    # area (above/below half of the maximum rate) as in the ground truth.
+    measured = count_rate_map(scan_results)
+    valid = ~np.isnan(measured)
+    relative = (measured[valid] - truth[valid]) / truth[valid]
+    half = truth.max() / 2
+    return {
+        "coverage": float(valid.mean()),
+        "rel-rms-error": float(np.sqrt(np.mean(relative ** 2))) if valid.any() else float("nan"),
+        "nrms-error": float(np.sqrt(np.mean((measured[valid] - truth[valid]) ** 2)) / truth.max()) if valid.any() else float("nan"),
+        "correlation": float(np.corrcoef(measured[valid], truth[valid])[0, 1]) if valid.sum() > 1 else float("nan"),
+        "classification": float(np.mean((measured[valid] > half) == (truth[valid] > half))) if valid.any() else float("nan"),
+    }
+
+
+def benchmark(lab: VirtualLab, scan_settings: ScanParameters, orderings: list = None, adaptive: bool = True, fly_velocity: float = None) -> list[dict]:
+    timecontroller = lab.time_controller()
+    counter = timecontroller.get_counter(1)
+    tol = timecontroller.get_tol(1)
+    tol.set_histogram(scan_settings.tol_bwidth, scan_settings.tol_bcount)
+    timecontroller.setup_inputs({"start": -0.3, 1: -0.1})
+    timecontroller.delay(1, scan_settings.tol_delay)
+    positioner = lab.positioner()
+    for axis in positioner.axis_url:
+        positioner.zero_position(axis)
+    truth = lab.ground_truth(scan_settings)
+
+    rows = []
+    total_points = int(np.prod([size for size in scan_settings.resolution.values() if size > 0]))
+    if fly_velocity:
+        # fly_scan() restores the fast axis velocity: the step and adaptive scans that follow run at the usual one
+        scan_settings.step_velocity = fly_velocity
+        results = scan_settings.initialize_results()
+        start = time.perf_counter()
+        fly_scan(timecontroller.connection, positioner, scan_settings, results, counter="1", state=timecontroller.state)
+        move_to(positioner, {axis: 0 for axis in results.active_axes}, scan_settings)
+        rows.append({"mode": "fly", "time-s": time.perf_counter() - start, "motion-s": float("nan"), "points": total_points, "travel-mm": float("nan"), **compare(results, truth)})
+
+    for order in orderings or list(SCAN_ORDERINGS):
+        scan_settings.scan_order = order
+        timer = ScanTimer(total_points)
+        timer.start()
+        start = time.perf_counter()
+        results = step_scan(positioner, tol, counter, scan_settings, timer)
+        phases = timer.report()["phases"]
+        rows.append({
+            "mode": f"step {order}",
+            "time-s": time.perf_counter() - start,
+            "motion-s": phases["motion"]["total-s"] + phases["settle"]["total-s"],
+            "points": total_points,
+            "travel-mm": ScanTrajectory(scan_settings.resolution, scan_settings.step_size, order).total_travel() * 1e3,
+            **compare(results, truth),
+        })
+
+    if adaptive:
+        start = time.perf_counter()
+        results, points = adaptive_scan(positioner, tol, counter, scan_settings)
+        rows.append({"mode": "adaptive", "time-s": time.perf_counter() - start, "motion-s": float("nan"), "points": points, "travel-mm": float("nan"), **compare(results, truth)})
+
+    return rows
+
+
+def format_table(rows: list[dict]) -> str:
+    lines = [f"{'mode':<26} {'time s':>8} {'motion s':>9} {'points':>7} {'travel mm':>10} {'coverage':>9} {'rel rms':>8} {'nrms':>6} {'corr':>6} {'class.':>7}"]
+    for row in rows:
+        lines.append(
+            f"{row['mode']:<26} {row['time-s']:>8.1f} {row['motion-s']:>9.1f} {row['points']:>7d} {row['travel-mm']:>10.3f} {row['coverage']:>9.2f} "
+            f"{row['rel-rms-error']:>8.3f} {row['nrms-error']:>6.3f} {row['correlation']:>6.3f} {row['classification']:>7.3f}"
+        )
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    resolution = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    acquisition_time = float(sys.argv[2]) if len(sys.argv) > 2 else 0.05
+    step = 3e-4 / resolution            # the default detector map spans 300 um
+
+    scan_set = ScanParameters(
+        resolution={"X": 0, "Y": resolution, "Z": resolution},
+        step_size={"X": 0, "Y": step, "Z": step},
+        tol_acquisition_time=acquisition_time,
+        tol_bwidth=1000,
+        tol_bcount=1000,
+        tol_delay=1400000,
+        sleep_time=0,
+        adaptive_coarse_cell=4,
+    )
+
+    with VirtualLab(seed=0) as lab:
+        rows = benchmark(lab, scan_set, fly_velocity=step / 0.05)
+    print(format_table(rows))
@@ -6,11 +6,17 @@ from .timestamps import (
     close_timestamps_acquisition,
     close_active_acquisitions,
 )
-from .streams import StreamClient
+from .streams import StreamClient, decode_timestamps, TIMESTAMP_DTYPE, TIMESTAMP_REF_DTYPE
+from .ring_buffer import RingBuffer
+from .timestamp_files import TimestampFile
+from .software_coincidences import SoftwareCoincidences, count_coincidences, count_timestamp_files
+from .correlations import CrossCorrelation, correlate, correlate_timestamp_files
+from .tcspc import Binning, SoftwareTCSPC, match_start_stop, histogram_timestamp_files
 from .counts_over_time import (
     setup_input_counts_over_time_acquisition,
     setup_coincidence_counts_over_time_acquisition,
     acquire_counts_over_time,
+    CountsOverTimeStream,
     save_counts_over_time,
     COUNT_OVER_TIME_INPUTS,
     COUNT_OVER_TIME_COINCIDENCES,
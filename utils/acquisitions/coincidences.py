@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from utils.common import zmq_exec, trim_unit
+from utils.common import zmq_exec, zmq_exec_batch, trim_unit, ScpiBatch
 
 
 @dataclass(frozen=True)
@@ -36,49 +36,68 @@ COUNTERS_SETTINGS = {**INPUT_COUNTERS_SETTINGS, **COINCIDENCE_COUNTER_SETTINGS}
 
 
 
-def configure(tc, coincidence_window, counter_integration_time=None):
-    zmq_exec(tc, "DEVI:CONFI:LOAD COUNT")  # Apply coincidence counters configuration
-
-    def get_delay(idx: int):
-        return int(trim_unit(zmq_exec(tc, f"DELA{idx}:VALU?"), "TB"))
+def configure(tc, coincidence_window, counter_integration_time=None, state=None):
+    # Two round trips: the configuration load with the input delays read back, then every setting.
+    # With a TCState (devices/idq_tc1000_state.py) the mirror is reloaded after the configuration load, the delays
+    # come from it and the window delays are only sent where they changed.
+    if state is not None:
+        zmq_exec(tc, "DEVI:CONFI:LOAD COUNT")  # Apply coincidence counters configuration
+        state.load()
+        delay = {idx: int(state.get_number(f"DELA{idx}:VALU")) for idx in (2, 3, 4)}
+    else:
+        _, *delays = zmq_exec_batch(tc, [
+            "DEVI:CONFI:LOAD COUNT",  # Apply coincidence counters configuration
+            "DELA2:VALU?",
+            "DELA3:VALU?",
+            "DELA4:VALU?",
+        ])
+        delay = {idx: int(trim_unit(answer, "TB")) for idx, answer in zip((2, 3, 4), delays)}
 
     # Apply coincidence window ...
 
     # ... on additional input delays (used by coincidence blocks)
-    zmq_exec(tc, f"DELA6:VALU {get_delay(2) + coincidence_window*1}")  # INPU2 2nd delay
-    zmq_exec(tc, f"DELA7:VALU {get_delay(3) + coincidence_window*2}")  # INPU3 2nd delay
-    zmq_exec(tc, f"DELA8:VALU {get_delay(4) + coincidence_window*3}")  # INPU4 2nd delay
+    settings = {
+        "DELA6:VALU": delay[2] + coincidence_window*1,  # INPU2 2nd delay
+        "DELA7:VALU": delay[3] + coincidence_window*2,  # INPU3 2nd delay
+        "DELA8:VALU": delay[4] + coincidence_window*3,  # INPU4 2nd delay
+    }
 
+    # ... on coincidence blocks
     for counter in COUNTERS_SETTINGS.values():
-        
-        # ... on coincidence blocks
         if counter.begin_coef is not None:
-            window_begin_delay = int(coincidence_window * counter.begin_coef)
-            zmq_exec(tc, f"{counter.block}:WIND:BEGI:DELA {window_begin_delay}")
-
+            settings[f"{counter.block}:WIND:BEGI:DELA"] = int(coincidence_window * counter.begin_coef)
         if counter.end_coef is not None:
-            window_end_delay = int(coincidence_window * counter.end_coef)
-            zmq_exec(tc, f"{counter.block}:WIND:END:DELA {window_end_delay}")
+            settings[f"{counter.block}:WIND:END:DELA"] = int(coincidence_window * counter.end_coef)
 
-        # Configure counter...
+    # Configure counter...
+    counter_commands = []
+    for counter in COUNTERS_SETTINGS.values():
         if counter_integration_time:
             # ... intergration time if supplied
-            zmq_exec(
-                tc, f"{counter.block}:COUN:MODE CYCL;INTE {counter_integration_time};RESEt"
-            )
+            counter_commands.append(f"{counter.block}:COUN:MODE CYCL;INTE {counter_integration_time};RESEt")
         else:
             # ... in endless accumulation mode
-            zmq_exec(tc, f"{counter.block}:COUN:MODE ACCU;RESEt")
+            counter_commands.append(f"{counter.block}:COUN:MODE ACCU;RESEt")
+
+    if state is not None:
+        state.apply(settings, after=counter_commands)
+        return
+
+    with ScpiBatch(tc) as batch:
+        for setting, value in settings.items():
+            batch.set(setting, value)
+        for cmd in counter_commands:
+            batch.add(cmd)
 
 
 def read_counts(tc):
     # Ask for all counters in a single command
     commands = [f"{counter.block}:COUNter?" for counter in COUNTERS_SETTINGS.values()]
-    answer = zmq_exec(tc, ";:".join(commands))
+    answers = zmq_exec_batch(tc, commands)
 
     counters = {
         counter : int(counts)
-        for counter, counts in zip(COUNTERS_SETTINGS, answer.splitlines())
+        for counter, counts in zip(COUNTERS_SETTINGS, answers)
     }
 
     return counters
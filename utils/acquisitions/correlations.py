@@ -0,0 +1,193 @@
+import numpy as np
+from threading import Lock
+from .software_coincidences import _earlier
+from .timestamp_files import TimestampFile
+
+
+def _window_pairs(a: np.ndarray, b: np.ndarray, tau_min: int, tau_max: int) -> tuple:
+    # For every a, the slice [low, high) of b with tau_min <= b - a < tau_max (both sorted).
+    return np.searchsorted(b, a + tau_min, side="left"), np.searchsorted(b, a + tau_max, side="left")
+
+
+def correlate(a: np.ndarray, b: np.ndarray, tau_min: int, tau_max: int, bwidth: int, max_pairs: int = 1 << 22) -> np.ndarray:
+    """Histogram of b - a over every pair with tau_min <= b - a < tau_min + nb_bins * bwidth (ps, sorted timestamps).
+
+    Sorted merge: two searchsorted give the window of each a in b, the pairs are expanded with np.repeat in batches of
+    at most max_pairs, so memory does not depend on the number of pairs.
+    """
+    nb_bins = -(-(tau_max - tau_min) // bwidth)
+    tau_max = tau_min + nb_bins * bwidth
+    histogram = np.zeros(nb_bins, dtype=np.int64)
+    a = np.asarray(a, dtype=np.int64)
+    b = np.asarray(b, dtype=np.int64)
+    low, high = _window_pairs(a, b, tau_min, tau_max)
+    counts = high - low
+    total = np.cumsum(counts)
+
+    first = 0
+    while first < len(a):
+        # Largest batch of a whose pairs fit in max_pairs (at least one a)
+        done = total[first - 1] if first else 0
+        end = max(first + 1, int(np.searchsorted(total, done + max_pairs, side="right")))
+        batch_counts = counts[first:end]
+        nb_pairs = int(batch_counts.sum())
+        if nb_pairs:
+            starts = np.repeat(low[first:end] - (np.cumsum(batch_counts) - batch_counts), batch_counts)
+            partners = starts + np.arange(nb_pairs)
+            delays = b[partners] - np.repeat(a[first:end], batch_counts)
+            histogram += np.bincount((delays - tau_min) // bwidth, minlength=nb_bins)
+        first = end
+    return histogram
+
+
+class CrossCorrelation:
+    """Streaming second-order cross-correlation of two channels: histogram of t_b - t_a over [tau_min, tau_max).
+
+    Timestamps are fed in chunks per channel, in time order (StreamClients with attach(), or DLT files with
+    correlate_timestamp_files()), and only pairs of the same record are counted. An event of a is correlated once b
+    has been delivered past a + tau_max, then events that no pending or future event of a can reach are dropped: the
+    memory holds the two chunks in flight and the tau range, whatever the length of the acquisition.
+
+        correlation = CrossCorrelation(-100000, 100000, 100)
+        correlation.add_a(t1); correlation.add_b(t2); correlation.flush()
+        correlation.taus(), correlation.g2()
+    """
+
+    def __init__(self, tau_min: int, tau_max: int, bwidth: int, with_ref_index: bool = False, max_pairs: int = 1 << 22):
+        if tau_max <= tau_min or bwidth <= 0:
+            raise ValueError("CrossCorrelation.__init__(): need tau_min < tau_max and a positive bin width.")
+        self.bwidth = bwidth
+        self.nb_bins = -(-(tau_max - tau_min) // bwidth)
+        self.tau_min = tau_min
+        self.tau_max = tau_min + self.nb_bins * bwidth
+        self.with_ref_index = with_ref_index
+        self.max_pairs = max_pairs
+        self.histogram = np.zeros(self.nb_bins, dtype=np.int64)
+
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        self._a = empty                 # (timestamps, refs) of a not correlated yet
+        self._b = empty                 # (timestamps, refs) of b still in reach of a
+        self._last_a = None             # (ref, timestamp) of the last event delivered on each channel
+        self._last_b = None
+        self._b_closed = False
+        self._record_ends = {}
+        self._lock = Lock()
+
+        self.nb_a = 0
+        self.nb_b = 0
+
+    def _chunk(self, timestamps, refs) -> tuple:
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        refs = np.zeros(len(timestamps), dtype=np.int64) if refs is None else np.asarray(refs, dtype=np.int64)
+        last = np.r_[np.flatnonzero(np.diff(refs)), len(refs) - 1] if len(refs) else []
+        for ref, end in zip(refs[last], timestamps[last]):
+            self._record_ends[int(ref)] = max(self._record_ends.get(int(ref), 0), int(end))
+        return timestamps, refs
+
+    def add_a(self, timestamps, refs = None):
+        with self._lock:
+            timestamps, refs = self._chunk(timestamps, refs)
+            self.nb_a += len(timestamps)
+            if len(timestamps):
+                self._a = (np.concatenate((self._a[0], timestamps)), np.concatenate((self._a[1], refs)))
+                self._last_a = (int(refs[-1]), int(timestamps[-1]))
+                self._process()
+
+    def add_b(self, timestamps, refs = None):
+        with self._lock:
+            timestamps, refs = self._chunk(timestamps, refs)
+            self.nb_b += len(timestamps)
+            if len(timestamps):
+                self._b = (np.concatenate((self._b[0], timestamps)), np.concatenate((self._b[1], refs)))
+                self._last_b = (int(refs[-1]), int(timestamps[-1]))
+                self._process()
+
+    def flush(self):
+        # End of the data: what is left of a is correlated with what was received on b.
+        with self._lock:
+            self._b_closed = True
+            self._process()
+
+    def _process(self):
+        a, a_refs = self._a
+        b, b_refs = self._b
+        if self._b_closed:
+            ready = len(a)
+        elif self._last_b is None:
+            return
+        else:
+            ready = _earlier(a_refs, a, self._last_b[0], self._last_b[1] - self.tau_max + 1)
+
+        if ready:
+            if self.with_ref_index:
+                bounds = np.flatnonzero(np.diff(a_refs[:ready])) + 1
+                for first, end in zip(np.r_[0, bounds], np.r_[bounds, ready]):
+                    low, high = np.searchsorted(b_refs, [a_refs[first], a_refs[first] + 1])
+                    self._accumulate(a[first:end], b[low:high])
+            else:
+                self._accumulate(a[:ready], b)
+            a, a_refs = a[ready:], a_refs[ready:]
+            self._a = (a, a_refs)
+
+        # b events before the window of the first a still to come can go
+        oldest = (int(a_refs[0]), int(a[0])) if len(a) else self._last_a
+        if oldest is not None:
+            drop = _earlier(b_refs, b, oldest[0], oldest[1] + self.tau_min)
+            self._b = (b[drop:], b_refs[drop:])
+
+    def _accumulate(self, a: np.ndarray, b: np.ndarray):
+        self.histogram += correlate(a, b, self.tau_min, self.tau_max, self.bwidth, self.max_pairs)
+
+    def attach(self, client_a, client_b):
+        client_a.with_ref_index = client_b.with_ref_index = self.with_ref_index
+        client_a.timestamps_callback = self.add_a
+        client_b.timestamps_callback = self.add_b
+
+    def taus(self) -> np.ndarray:
+        # Left bin edges (ps)
+        return self.tau_min + np.arange(self.nb_bins) * self.bwidth
+
+    def acquisition_time_s(self) -> float:
+        # Timestamps are relative to the start of their record: the last one of each record bounds its duration.
+        return sum(self._record_ends.values()) * 1e-12
+
+    def g2(self, acquisition_time_s: float = None) -> np.ndarray:
+        # Normalised to uncorrelated channels: N_a * N_b * bwidth / T counts per bin.
+        acquisition_time_s = acquisition_time_s if acquisition_time_s is not None else self.acquisition_time_s()
+        accidentals = self.nb_a * self.nb_b * self.bwidth * 1e-12 / acquisition_time_s if acquisition_time_s else 0
+        if not accidentals:
+            raise ValueError("CrossCorrelation.g2(): no events or acquisition time unknown.")
+        return self.histogram / accidentals
+
+
+def correlate_timestamp_files(
+    a_filepath,
+    b_filepath,
+    tau_min: int,
+    tau_max: int,
+    bwidth: int,
+    with_ref_index: bool = False,
+    chunk_size: int = 1 << 22,
+) -> CrossCorrelation:
+    # Cross-correlation of two DLT "bin" files, memory-mapped and read in chunks of chunk_size timestamps. The next
+    # chunk always comes from the channel furthest behind, so the buffers hold about one chunk each.
+    correlation = CrossCorrelation(tau_min, tau_max, bwidth, with_ref_index)
+    chunks = {
+        "a": TimestampFile(a_filepath, with_ref_index).chunks(chunk_size),
+        "b": TimestampFile(b_filepath, with_ref_index).chunks(chunk_size),
+    }
+    add = {"a": correlation.add_a, "b": correlation.add_b}
+
+    last = {}               # channel -> (ref, timestamp) of the last chunk read
+    while chunks:
+        channel = min(chunks, key=lambda channel: last.get(channel, (-1, -1)))
+        chunk = next(chunks[channel], None)
+        if chunk is None:
+            del chunks[channel]
+            continue
+        timestamps, refs = chunk
+        add[channel](timestamps, refs)
+        last[channel] = (int(refs[-1]) if refs is not None else 0, int(timestamps[-1]))
+
+    correlation.flush()
+    return correlation
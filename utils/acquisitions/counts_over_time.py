@@ -1,10 +1,14 @@
-from typing import Any, Dict, List, Tuple
-from utils.common import zmq_exec, adjust_bin_width
+import time
+import numpy as np
+from threading import Thread
+from typing import Any, Callable, Dict, List, Tuple
+from utils.common import zmq_exec, adjust_bin_width, ScpiBatch
 from .coincidences import (
     configure as configure_coincidences,
     COINCIDENCE_COUNTER_SETTINGS
 )
-from .histograms import acquire_histograms, save_histograms
+from .histograms import acquire_histograms, save_histograms, parse_histogram
+from .ring_buffer import RingBuffer
 
 INPUT_TO_HIST_CHANNEL_BLOCK_MAP = {
     "start": "STAR",
@@ -29,60 +33,78 @@ def setup_counts_over_time_acquisition(
     tc,
     integration_time: int,
     counters: Any,
-    counter_to_hist_block_map: Dict[Any, str]
+    counter_to_hist_block_map: Dict[Any, str],
+    state = None,
 ) -> Tuple[Dict[int, Any], int]:
-
-    # Link RECord generator to its TSCO 
-    zmq_exec(tc, f"{REC_TSCO}:FIR:LINK REC")
-    # Set RECord TSCO to just forward the signal
-    zmq_exec(tc, f"{REC_TSCO}:OPIN ONLYFIR;OPOUt ONLYFIR;WIND:ENAB OFF")
+    # With a TCState the links go through its mirror (see acquire_histograms()).
 
     hist_to_counter_map = {
         hist_channel: counter
         for hist_channel, counter in enumerate(counters, 1)
     }
 
+    # Link RECord generator to its TSCO, histograms REF to that TSCO and histograms STOP to the channel blocks
+    links = {f"{REC_TSCO}:FIR:LINK": "REC"}
+    # Set the TSCOs to just forward the signal
+    forwards = [f"{REC_TSCO}:OPIN ONLYFIR;OPOUt ONLYFIR;WIND:ENAB OFF"]
     for hist_channel, counter in hist_to_counter_map.items():
-        # Link histogram REF to the REC TSCO configured above
-        zmq_exec(tc, f"HIST{hist_channel}:REF:LINK {REC_TSCO}")
         channel_block = counter_to_hist_block_map[counter]
-
+        links[f"HIST{hist_channel}:REF:LINK"] = REC_TSCO
+        links[f"HIST{hist_channel}:STOP:LINK"] = channel_block
         if channel_block.startswith("TSCO"):
-            zmq_exec(tc, f"{channel_block}:OPIN ONLYFIR;OPOUt ONLYFIR;WIND:ENAB OFF")
+            forwards.append(f"{channel_block}:OPIN ONLYFIR;OPOUt ONLYFIR;WIND:ENAB OFF")
 
-        # Link histogram STOP to the input channel TSCO
-        zmq_exec(tc, f"HIST{hist_channel}:STOP:LINK {channel_block}")
+    # Every link in one round trip
+    if state is not None:
+        state.apply(links, after=forwards)
+    else:
+        with ScpiBatch(tc) as batch:
+            for setting, block in links.items():
+                batch.add(f"{setting} {block}")
+            for cmd in forwards:
+                batch.add(cmd)
 
     actual_integration_time = adjust_bin_width(tc, integration_time)
 
     return hist_to_counter_map, actual_integration_time
 
 
-def setup_input_counts_over_time_acquisition(tc, integration_time: int, counters: Any):
+def setup_input_counts_over_time_acquisition(tc, integration_time: int, counters: Any, state = None):
     zmq_exec(tc, f"DEVIce:CONF:LOAD HISTO")
+    if state is not None:
+        state.load()            # the configuration load resets the links
 
     return setup_counts_over_time_acquisition(
         tc,
         integration_time,
         counters,
-        INPUT_TO_HIST_CHANNEL_BLOCK_MAP
+        INPUT_TO_HIST_CHANNEL_BLOCK_MAP,
+        state,
     )
 
-def setup_coincidence_counts_over_time_acquisition(tc, integration_time: int, counters: Any, window: int):
-    configure_coincidences(tc, window, 1000)
+def setup_coincidence_counts_over_time_acquisition(tc, integration_time: int, counters: Any, window: int, state = None):
+    configure_coincidences(tc, window, 1000, state=state)
 
     return setup_counts_over_time_acquisition(
         tc,
         integration_time,
         counters,
-        COINCIDENCE_TO_HIST_CHANNEL_BLOCK_MAP
+        COINCIDENCE_TO_HIST_CHANNEL_BLOCK_MAP,
+        state,
     )
 
-def acquire_counts_over_time(tc, integration_time: int, nb_acquisitions: int, hist_to_counter_map: Dict[int, Any]):
+def acquire_counts_over_time(
+    tc,
+    integration_time: int,
+    nb_acquisitions: int,
+    hist_to_counter_map: Dict[int, Any],
+    on_play: Callable[[], Any] = None,
+    state = None,
+):
     duration = integration_time * nb_acquisitions * 1e-12
 
     counts_over_time_histograms = acquire_histograms(
-        tc, duration, integration_time, nb_acquisitions, hist_to_counter_map
+        tc, duration, integration_time, nb_acquisitions, hist_to_counter_map, on_play=on_play, state=state
     )
 
     counts_over_time = {
@@ -93,6 +115,173 @@ def acquire_counts_over_time(tc, integration_time: int, nb_acquisitions: int, hi
     return counts_over_time
 
 
+class CountsOverTimeStream(Thread):
+    """Continuous counts over time: REC records of `nb_bins` bins re-armed back to back.
+
+    As soon as a record ends, one message fetches every histogram, flushes them and plays the next record, so the dead
+    time between records is one poll plus one round trip. The counts are parsed and appended while the next record is
+    already running: one RingBuffer of `capacity` samples per counter, plus `times` (bin centres, seconds from the
+    first PLAY, host clock). Consumers read() them or look at latest() from another thread.
+
+    Back-pressure shows up in two places: `buffers[counter].overruns` when the consumer does not read fast enough, and
+    `late_records` when the host handled a record (parsing, on_record callback) for longer than the next record lasted,
+    which turns into dead time. The histograms must have been linked with setup_*_counts_over_time_acquisition().
+
+        stream = CountsOverTimeStream(tc, bin_time, 100, hist_to_counter_map)
+        stream.start()
+        ...  stream.buffers["1"].read()
+        stream.join()           # stops an endless stream, waits for the last record of one with nb_records
+    """
+
+    def __init__(
+        self,
+        tc,
+        integration_time: int,
+        nb_bins: int,
+        hist_to_counter_map: Dict[int, Any],
+        capacity: int = 100000,
+        nb_records: int = None,
+        poll_interval: float = 0.001,
+        on_record: Callable[[Dict[Any, np.ndarray], float], Any] = None,
+        state = None,
+    ):
+        Thread.__init__(self)
+
+        if nb_bins < 1:
+            raise ValueError("CountsOverTimeStream.__init__(): nb_bins must be at least 1.")
+
+        self.tc = tc
+        self.integration_time = integration_time          # ps, as returned by setup_*_counts_over_time_acquisition()
+        self.nb_bins = nb_bins
+        self.hist_to_counter_map = hist_to_counter_map
+        self.nb_records = nb_records                      # None: until stop() or join()
+        self.poll_interval = poll_interval
+        self.on_record = on_record
+        self.state = state                                # TCState: the REC and histogram settings go through its mirror
+
+        self.buffers = {counter: RingBuffer(capacity) for counter in hist_to_counter_map.values()}
+        self.times = RingBuffer(capacity, np.float64)
+
+        self.running = False
+        self.error = None
+        self.records = 0
+        self.late_records = 0
+        self.polls = 0
+        self.dead_times = []
+
+    @property
+    def record_duration(self) -> float:
+        return self.integration_time * self.nb_bins * 1e-12
+
+    def is_running(self):
+        return self.running
+
+    def _rearm(self, fetch: bool) -> Tuple[List[str], float]:
+        # Fetch + flush + play in one round trip, returns the histograms and the estimated start of the new record
+        # (middle of the round trip, host clock).
+        with ScpiBatch(self.tc) as batch:
+            data = [batch.query(f"HIST{i}:DATA") for i in self.hist_to_counter_map] if fetch else []
+            for i in self.hist_to_counter_map:
+                batch.add(f"HIST{i}:FLUSh")
+            if self.running:
+                batch.add("REC:PLAY")
+            sent = time.perf_counter()
+        return [batch.results[index] for index in data], (sent + time.perf_counter()) / 2
+
+    def _wait_end_of_record(self, end: float):
+        # Sleeps until the expected end of the record, then polls the stage closely. Getting here after the end means
+        # that handling the previous record took longer than this one lasted.
+        now = time.perf_counter()
+        if now > end:
+            self.late_records += 1
+        time.sleep(max(0.0, end - now))
+        self.polls += 1
+        while zmq_exec(self.tc, "REC:STAGe?").upper() == "PLAYING":
+            time.sleep(self.poll_interval)
+            self.polls += 1
+
+    def run(self):
+        self.running = True
+        try:
+            settings = {
+                "REC:TRIG:ARM:MODE": "MANUal",
+                "REC:ENABle": "ON",
+                "REC:NUM": 1,
+                "REC:DURation": self.integration_time * self.nb_bins,
+            }
+            for i in self.hist_to_counter_map:
+                settings[f"HIST{i}:BCOUnt"] = self.nb_bins
+                settings[f"HIST{i}:BWID"] = self.integration_time
+
+            if self.state is not None:
+                self.state.apply(settings, before=["REC:STOP"])
+            else:
+                with ScpiBatch(self.tc) as batch:
+                    batch.add("REC:STOP")
+                    for setting, value in settings.items():
+                        batch.set(setting, value)
+
+            _, start = self._rearm(fetch=False)
+            origin = start
+            bin_centres = (np.arange(self.nb_bins) + 0.5) * self.integration_time * 1e-12
+
+            while self.nb_records is None or self.records < self.nb_records:
+                end = start + self.record_duration
+                self._wait_end_of_record(end)
+
+                if self.nb_records is not None and self.records + 1 >= self.nb_records:
+                    self.running = False
+                answers, next_start = self._rearm(fetch=True)
+                if self.running:
+                    self.dead_times.append(max(0.0, next_start - end))
+
+                counts = {
+                    self.hist_to_counter_map[i]: parse_histogram(answer)
+                    for i, answer in zip(self.hist_to_counter_map, answers)
+                }
+                for counter, histogram in counts.items():
+                    self.buffers[counter].append(histogram)
+                self.times.append(start - origin + bin_centres)
+                self.records += 1
+
+                if self.on_record is not None:
+                    self.on_record(counts, start - origin)
+                if not self.running:
+                    break
+                start = next_start
+        except Exception as e:
+            self.error = e
+            raise
+        finally:
+            if self.running:
+                self.running = False
+                zmq_exec(self.tc, "REC:STOP")
+
+    def stats(self) -> dict:
+        dead_times = np.array(self.dead_times) if self.dead_times else np.zeros(1)
+        live = self.records * self.record_duration
+        return {
+            "records": self.records,
+            "record-s": self.record_duration,
+            "dead-time-mean-s": float(dead_times.mean()),
+            "dead-time-max-s": float(dead_times.max()),
+            "duty-cycle": live / (live + float(np.sum(self.dead_times))) if live else 0.0,
+            "late-records": self.late_records,
+            "polls": self.polls,
+            "buffers": {counter: buffer.stats() for counter, buffer in self.buffers.items()},
+        }
+
+    def stop(self):
+        # The record being acquired is the last one: it is still fetched and appended.
+        self.running = False
+
+    def join(self, timeout: float = None):
+        # A bounded stream (nb_records) ends by itself, an endless one is stopped first.
+        if self.nb_records is None:
+            self.stop()
+        super().join(timeout)
+
+
 def save_counts_over_time(
     counts_over_time: Dict[Any, List[int]],
     actual_integration_time: int,
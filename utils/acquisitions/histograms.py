@@ -1,6 +1,29 @@
 import time
-from typing import Any, Dict, Iterable, List
-from utils.common import zmq_exec
+import warnings
+import numpy as np
+from typing import Any, Callable, Dict, Iterable
+from utils.common import zmq_exec, zmq_exec_batch, ScpiBatch
+
+
+def parse_histogram(payload: str, dtype = np.int64) -> np.ndarray:
+    # Decodes a HIST{n}:DATA? answer ("[12, 0, 3, ...]") straight into an integer array: the numbers are parsed in C
+    # by np.fromstring, no Python list and no eval. Raises ValueError on anything that is not a list of integers.
+    body = payload.strip()
+    if body.startswith("[") and body.endswith("]"):
+        body = body[1:-1]
+    if not body.strip():
+        return np.zeros(0, dtype=dtype)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)         # numpy only warns when it stops at a bad token
+        try:
+            histogram = np.fromstring(body, dtype=dtype, sep=",")
+        except (DeprecationWarning, ValueError) as e:
+            raise ValueError(f"parse_histogram(): not a histogram payload: {payload[:50]!r}") from e
+
+    if len(histogram) != body.count(",") + 1:
+        raise ValueError(f"parse_histogram(): not a histogram payload: {payload[:50]!r}")
+    return histogram
 
 
 def wait_end_of_acquisition(tc):
@@ -9,32 +32,57 @@ def wait_end_of_acquisition(tc):
         time.sleep(1)
 
 
-def acquire_histograms(tc, duration: int, bwid: int, bcount: int, hist_numbers: Iterable[int]) -> Dict[int, List[int]]:
-
-    ### Configure the acquisition timer
-
-    # Trigger RECord signal manually (PLAY command)
-    zmq_exec(tc, "REC:TRIG:ARM:MODE MANUal")
-    # Enable the RECord generator
-    zmq_exec(tc, "REC:ENABle ON")
-    # STOP any already ongoing acquisition
-    zmq_exec(tc, "REC:STOP")
-    # Record a single acquisition
-    zmq_exec(tc, "REC:NUM 1")
-    # Record for the request duration (in ps)
-    zmq_exec(tc, f"REC:DURation {duration * 1e12}")
-
-    for i in hist_numbers:
-        zmq_exec(tc, f"HIST{i}:BCOUnt {bcount}")  # Set histogram maximum bin count
-        zmq_exec(tc, f"HIST{i}:BWID {bwid}")  # Set histogram bin width
-        zmq_exec(tc, f"HIST{i}:FLUSh")  # Flush histogram
+def acquire_histograms(
+    tc,
+    duration: int,
+    bwid: int,
+    bcount: int,
+    hist_numbers: Iterable[int],
+    on_play: Callable[[], Any] = None,
+    state = None,
+) -> Dict[int, np.ndarray]:
+    # With a TCState (devices/idq_tc1000_state.py) the settings go through its mirror: only the changed ones are sent
+    # and the mirror stays in step with the device for the acquisitions that follow.
+
+    hist_numbers = list(hist_numbers)           # iterated for the setup and again for the readout
+
+    ### Configure the acquisition timer and the histograms, all in one round trip
+
+    if state is not None:
+        settings = {"REC:TRIG:ARM:MODE": "MANUal", "REC:ENABle": "ON", "REC:NUM": 1, "REC:DURation": duration * 1e12}
+        for i in hist_numbers:
+            settings[f"HIST{i}:BCOUnt"] = bcount
+            settings[f"HIST{i}:BWID"] = bwid
+        state.apply(settings, before=["REC:STOP"], after=[f"HIST{i}:FLUSh" for i in hist_numbers])
+    else:
+        with ScpiBatch(tc) as batch:
+            # Trigger RECord signal manually (PLAY command)
+            batch.set("REC:TRIG:ARM:MODE", "MANUal")
+            # Enable the RECord generator
+            batch.set("REC:ENABle", "ON")
+            # STOP any already ongoing acquisition
+            batch.add("REC:STOP")
+            # Record a single acquisition
+            batch.set("REC:NUM", 1)
+            # Record for the request duration (in ps)
+            batch.set("REC:DURation", duration * 1e12)
+
+            for i in hist_numbers:
+                batch.set(f"HIST{i}:BCOUnt", bcount)  # Set histogram maximum bin count
+                batch.set(f"HIST{i}:BWID", bwid)  # Set histogram bin width
+                batch.add(f"HIST{i}:FLUSh")  # Flush histogram
 
     zmq_exec(tc, "REC:PLAY")  # Start the acquisition
 
+    # Let the caller start something synchronised with the record (e.g. the positioner motion of a fly scan)
+    if on_play is not None:
+        on_play()
+
     wait_end_of_acquisition(tc)
 
-    # Get histogram data
-    histograms = {i: eval(zmq_exec(tc, f"HIST{i}:DATA?")) for i in hist_numbers}
+    # Get histogram data, every histogram in one round trip
+    answers = zmq_exec_batch(tc, [f"HIST{i}:DATA?" for i in hist_numbers])
+    histograms = {i: parse_histogram(answer) for i, answer in zip(hist_numbers, answers)}
 
     return histograms
 
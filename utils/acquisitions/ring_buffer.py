@@ -0,0 +1,85 @@
+import numpy as np
+from threading import Lock
+
+
+class RingBuffer:
+    """Fixed-size NumPy ring buffer, one producer and one consumer.
+
+    append() copies a whole array in at most two slices, never allocates. When the producer laps a consumer that is
+    not reading fast enough, the oldest unread samples are overwritten and counted in `overruns` (back-pressure).
+    read() returns the unread samples oldest first, latest(n) the n most recent ones whatever was read.
+    """
+
+    def __init__(self, capacity: int, dtype = np.int64):
+        if capacity < 1:
+            raise ValueError("RingBuffer.__init__(): capacity must be at least 1.")
+        self.capacity = capacity
+        self.data = np.zeros(capacity, dtype=dtype)
+        self.written = 0            # samples appended since creation
+        self.consumed = 0           # samples returned by read() or skipped because overwritten
+        self.overruns = 0           # samples overwritten before they were read
+        self.appends = 0
+        self.max_fill = 0           # highest number of unread samples seen, to size the buffer
+        self._lock = Lock()
+
+    def __len__(self) -> int:
+        return min(self.written, self.capacity)
+
+    def available(self) -> int:
+        with self._lock:
+            return self.written - self.consumed
+
+    def append(self, values) -> int:
+        # Appends an array (or a scalar), returns the number of unread samples it overwrote.
+        values = np.asarray(values, dtype=self.data.dtype).reshape(-1)     # strided views are copied in, not copied twice
+        with self._lock:
+            n = len(values)
+            if n > self.capacity:           # only the most recent `capacity` samples can be kept
+                values = values[-self.capacity:]
+            start = (self.written + n - len(values)) % self.capacity
+            first = min(len(values), self.capacity - start)
+            self.data[start:start + first] = values[:first]
+            self.data[:len(values) - first] = values[first:]
+            self.written += n
+            self.appends += 1
+
+            lost = max(0, self.written - self.consumed - self.capacity)
+            self.overruns += lost
+            self.consumed += lost
+            self.max_fill = max(self.max_fill, self.written - self.consumed)
+            return lost
+
+    def _slice(self, first: int, count: int) -> np.ndarray:
+        start = first % self.capacity
+        if start + count <= self.capacity:
+            return self.data[start:start + count].copy()
+        return np.concatenate((self.data[start:], self.data[:start + count - self.capacity]))
+
+    def read(self, n: int = None) -> np.ndarray:
+        # Unread samples, oldest first (at most n), marked as read.
+        with self._lock:
+            count = self.written - self.consumed if n is None else min(n, self.written - self.consumed)
+            values = self._slice(self.consumed, count)
+            self.consumed += count
+            return values
+
+    def latest(self, n: int = None) -> np.ndarray:
+        # The n most recent samples (all the stored ones by default), oldest first. Does not move the read position.
+        with self._lock:
+            count = len(self) if n is None else min(n, len(self))
+            return self._slice(self.written - count, count)
+
+    def clear(self):
+        with self._lock:
+            self.consumed = self.written
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "capacity": self.capacity,
+                "written": self.written,
+                "unread": self.written - self.consumed,
+                "overruns": self.overruns,
+                "appends": self.appends,
+                "max-fill": self.max_fill,
+            }
@@ -0,0 +1,181 @@
+import numpy as np
+from threading import Lock
+from typing import Any, Dict
+from .coincidences import COUNTERS_SETTINGS, COINCIDENCE_COUNTER_SETTINGS
+from .timestamp_files import TimestampFile
+
+# Inputs of every coincidence counter of the hardware map: "1/2/4" -> (1, 2, 4)
+COINCIDENCE_INPUTS = {name: tuple(int(i) for i in name.split("/")) for name in COINCIDENCE_COUNTER_SETTINGS}
+
+SINGLE_COUNTERS = {"start": "start", 1: "input 1", 2: "input 2", 3: "input 3", 4: "input 4"}
+
+
+def _earlier(refs: np.ndarray, times: np.ndarray, ref: int, time: int) -> int:
+    # Number of (refs, times) strictly before (ref, time), records first then timestamps (both sorted).
+    return int(np.count_nonzero((refs < ref) | ((refs == ref) & (times < time))))
+
+
+def has_partner(reference: np.ndarray, other: np.ndarray, half_window: int, reference_refs: np.ndarray = None, other_refs: np.ndarray = None) -> np.ndarray:
+    """For every reference timestamp, whether `other` has a timestamp within +/- half_window of it (same record).
+
+    Two searchsorted over the sorted partner channel, one pair per record with ref indexes.
+    """
+    if reference_refs is None or other_refs is None:
+        low = np.searchsorted(other, reference - half_window, side="left")
+        high = np.searchsorted(other, reference + half_window, side="right")
+        return high > low
+
+    found = np.zeros(len(reference), dtype=bool)
+    bounds = np.flatnonzero(np.diff(reference_refs)) + 1
+    for first, end in zip(np.r_[0, bounds], np.r_[bounds, len(reference)]):
+        ref = reference_refs[first]
+        low, high = np.searchsorted(other_refs, [ref, ref + 1])
+        found[first:end] = has_partner(reference[first:end], other[low:high], half_window)
+    return found
+
+
+class SoftwareCoincidences:
+    """Host-side stand-in for the TC1000 coincidence counters, over timestamps of inputs 1-4 (and START for its single).
+
+    A k-fold coincidence ("1/2", "1/2/4", ... as in COINCIDENCE_COUNTER_SETTINGS) is counted for every event of its
+    lowest input that has an event of each other input of the group within +/- window/2, the window the TSCO blocks
+    open around the first input with configure(). Any window, and only the groups of the given inputs are counted.
+
+    Timestamps are added in chunks per channel, in time order. An event of the lowest input is only decided once every
+    other input has reached its time + window/2, so the memory holds about one chunk per channel; close() a channel at
+    the end of its data, flush() at the end. `counts` has the shape of read_counts().
+    """
+
+    def __init__(self, window: int, inputs: tuple = (1, 2, 3, 4), with_ref_index: bool = False):
+        self.window = window
+        self.half_window = window // 2
+        self.inputs = tuple(sorted(inputs))
+        self.with_ref_index = with_ref_index
+        self.groups = {name: group for name, group in COINCIDENCE_INPUTS.items() if set(group) <= set(self.inputs)}
+
+        self.counts = dict.fromkeys(COUNTERS_SETTINGS, 0)
+        empty = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+        self._events = {channel: empty for channel in self.inputs}         # (timestamps, refs) not yet dropped
+        self._decided = dict.fromkeys(self.inputs, 0)                       # leading events already counted as reference
+        self._last = {}                                                     # channel -> (ref, timestamp) of its last event
+        self._closed = set()
+        self._lock = Lock()
+
+    def add(self, channel: Any, timestamps, refs = None):
+        # channel: "start" or an input number 1-4.
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        with self._lock:
+            if channel not in SINGLE_COUNTERS:
+                raise ValueError(f"SoftwareCoincidences.add(): unknown channel {channel}.")
+            self.counts[SINGLE_COUNTERS[channel]] += len(timestamps)
+            if channel not in self.inputs or not len(timestamps):
+                return
+
+            refs = np.zeros(len(timestamps), dtype=np.int64) if refs is None else np.asarray(refs, dtype=np.int64)
+            events, event_refs = self._events[channel]
+            self._events[channel] = (np.concatenate((events, timestamps)), np.concatenate((event_refs, refs)))
+            self._last[channel] = (int(refs[-1]), int(timestamps[-1]))
+            self._process()
+
+    def close(self, channel: Any):
+        # No more timestamps on this channel: it no longer holds back the others.
+        with self._lock:
+            self._closed.add(channel)
+            self._process()
+
+    def flush(self):
+        with self._lock:
+            self._closed.update(self.inputs)
+            self._process()
+
+    def frontier(self) -> tuple:
+        # (ref, timestamp) up to which every open input has delivered its events, None if one has not started yet.
+        open_inputs = [channel for channel in self.inputs if channel not in self._closed]
+        if any(channel not in self._last for channel in open_inputs):
+            return None
+        if not open_inputs:
+            return (np.iinfo(np.int64).max, np.iinfo(np.int64).max)
+        return min(self._last[channel] for channel in open_inputs)
+
+    def _process(self):
+        frontier = self.frontier()
+        if frontier is None:
+            return
+        ref, time = frontier
+
+        for channel in self.inputs:
+            events, event_refs = self._events[channel]
+            decided = self._decided[channel]
+            # Reference events whose whole window has been delivered on every input
+            ready = _earlier(event_refs, events, ref, time - self.half_window + 1)
+            if ready <= decided:
+                continue
+
+            reference, reference_refs = events[decided:ready], event_refs[decided:ready]
+            found = {}
+            for other in self.inputs[self.inputs.index(channel) + 1:]:
+                other_events, other_refs = self._events[other]
+                if self.with_ref_index:
+                    found[other] = has_partner(reference, other_events, self.half_window, reference_refs, other_refs)
+                else:
+                    found[other] = has_partner(reference, other_events, self.half_window)
+            for name, group in self.groups.items():
+                if group[0] == channel:
+                    self.counts[name] += int(np.count_nonzero(np.logical_and.reduce([found[other] for other in group[1:]])))
+            self._decided[channel] = ready
+
+        self._trim()
+
+    def _trim(self):
+        # An event is dropped once it has been decided as a reference and no undecided event of a lower input can
+        # still have it in its window.
+        oldest = None
+        for channel in self.inputs:
+            events, event_refs = self._events[channel]
+            decided = self._decided[channel]
+            drop = decided
+            if oldest is not None:
+                drop = min(drop, _earlier(event_refs, events, oldest[0], oldest[1] - self.half_window))
+            if drop:
+                self._events[channel] = (events[drop:], event_refs[drop:])
+                self._decided[channel] -= drop
+            if decided < len(events) and (oldest is None or (event_refs[decided], events[decided]) < oldest):
+                oldest = (int(event_refs[decided]), int(events[decided]))
+
+
+def count_coincidences(timestamps: Dict[Any, np.ndarray], window: int, refs: Dict[Any, np.ndarray] = None) -> Dict[str, int]:
+    # One shot: {channel: sorted timestamps} (channels "start", 1-4) -> read_counts() shaped dict.
+    inputs = tuple(channel for channel in timestamps if channel != "start")
+    coincidences = SoftwareCoincidences(window, inputs, with_ref_index=refs is not None)
+    for channel, channel_timestamps in timestamps.items():
+        coincidences.add(channel, channel_timestamps, None if refs is None else refs[channel])
+    coincidences.flush()
+    return coincidences.counts
+
+
+def count_timestamp_files(
+    filepaths: Dict[Any, str],
+    window: int,
+    with_ref_index: bool = False,
+    chunk_size: int = 1 << 22,
+) -> Dict[str, int]:
+    # Coincidence counts of DLT "bin" files ({channel: timestamps_C{n}.bin}), memory-mapped and read in chunks. The
+    # next chunk always comes from the input furthest behind, so every input holds about one chunk in memory.
+    inputs = tuple(channel for channel in filepaths if channel != "start")
+    coincidences = SoftwareCoincidences(window, inputs, with_ref_index)
+    chunks = {channel: TimestampFile(filepath, with_ref_index).chunks(chunk_size) for channel, filepath in filepaths.items()}
+
+    last = {}               # channel -> (ref, timestamp) of the last chunk read
+    while chunks:
+        channel = min(chunks, key=lambda channel: last.get(channel, (-1, -1)))
+        chunk = next(chunks[channel], None)
+        if chunk is None:
+            del chunks[channel]
+            coincidences.close(channel)
+            continue
+        timestamps, refs = chunk
+        coincidences.add(channel, timestamps, refs)
+        last[channel] = (int(refs[-1]) if refs is not None else 0, int(timestamps[-1]))
+
+    coincidences.flush()
+    return coincidences.counts
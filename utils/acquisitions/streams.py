@@ -1,17 +1,40 @@
 import zmq
+import numpy as np
 from threading import Thread
 from zmq.utils.monitor import recv_monitor_message
+from .ring_buffer import RingBuffer
+
+# Binary timestamps as sent by the DataLinkTarget (streams and "bin" files): little-endian uint64 in ps, relative to
+# the reference (the REC sub-acquisition). With --with-ref-index every timestamp is followed by its uint64 ref index.
+TIMESTAMP_DTYPE = np.dtype("<u8")
+TIMESTAMP_REF_DTYPE = np.dtype([("timestamp", "<u8"), ("ref_index", "<u8")])
+
+
+def decode_timestamps(buffer, with_ref_index: bool = False) -> tuple:
+    # Zero-copy view of a binary timestamps buffer: (timestamps, ref indexes or None). Trailing bytes that do not make
+    # a whole record are ignored.
+    dtype = TIMESTAMP_REF_DTYPE if with_ref_index else TIMESTAMP_DTYPE
+    buffer = memoryview(buffer).cast("B")
+    records = np.frombuffer(buffer, dtype=dtype, count=len(buffer) // dtype.itemsize)
+    if with_ref_index:
+        return records["timestamp"], records["ref_index"]
+    return records, None
 
 
 class StreamClient(Thread):
     """Simple timestamps stream client.
-    
+
     The message_callback callback function is called when timestamps are received.
-    
+
     Assing message_callback with a dedicate function to process timestamp on the fly.
+
+    With a `capacity`, messages are received as zmq frames (no copy) and decoded with np.frombuffer straight into
+    preallocated RingBuffers: `timestamps` and, with_ref_index, `ref_indexes`. timestamps_callback then gets the
+    decoded views (only valid during the call). message_callback is only given the raw bytes when it is assigned.
+    Counters: bytes, messages, timestamps, overruns (timestamps overwritten before they were read), truncated_bytes.
     """
 
-    def __init__(self, addr):
+    def __init__(self, addr, capacity: int = None, with_ref_index: bool = False):
         Thread.__init__(self)
 
         self.running = False
@@ -27,21 +50,67 @@ class StreamClient(Thread):
         self.poller.register(self.data_socket, zmq.POLLIN)
         self.poller.register(self.monitor_socket, zmq.POLLIN)
 
-        self.message_callback = lambda _: None
+        self.message_callback = None
+        self.timestamps_callback = None
+
+        # decoding layer
+        self.with_ref_index = with_ref_index
+        self.timestamps = RingBuffer(capacity, TIMESTAMP_DTYPE) if capacity else None
+        self.ref_indexes = RingBuffer(capacity, TIMESTAMP_DTYPE) if capacity and with_ref_index else None
+
+        self.bytes = 0
+        self.messages = 0
+        self.nb_timestamps = 0
+        self.truncated_bytes = 0
+
+    @property
+    def overruns(self) -> int:
+        return self.timestamps.overruns if self.timestamps is not None else 0
 
     def is_running(self):
         return self.running
 
+    def stats(self) -> dict:
+        return {
+            "bytes": self.bytes,
+            "messages": self.messages,
+            "timestamps": self.nb_timestamps,
+            "overruns": self.overruns,
+            "truncated-bytes": self.truncated_bytes,
+        }
+
+    def _decode(self, frame):
+        # np.frombuffer views on the frame's memory, copied once into the ring buffers
+        buffer = frame.buffer
+        timestamps, ref_indexes = decode_timestamps(buffer, self.with_ref_index)
+        record_size = TIMESTAMP_REF_DTYPE.itemsize if self.with_ref_index else TIMESTAMP_DTYPE.itemsize
+        self.truncated_bytes += len(buffer) - len(timestamps) * record_size
+        self.nb_timestamps += len(timestamps)
+
+        if self.timestamps is not None:
+            self.timestamps.append(timestamps)
+            if self.ref_indexes is not None:
+                self.ref_indexes.append(ref_indexes)
+
+        if self.timestamps_callback is not None:
+            self.timestamps_callback(timestamps, ref_indexes)
+
     def run(self):
         self.running = True
         while self.running:
             for socket, *_ in self.poller.poll(timeout=1000):
                 if socket == self.data_socket:
-                    binary_timestamps = socket.recv()
-                    if len(binary_timestamps) == 0:
+                    frame = socket.recv(copy=False)
+                    size = len(frame)
+                    if size == 0:
                         self.running = False
+                    else:
+                        self.bytes += size
+                        self.messages += 1
+                        self._decode(frame)
 
-                    self.message_callback(binary_timestamps)
+                    if self.message_callback is not None:
+                        self.message_callback(frame.bytes)
 
                 if socket == self.monitor_socket:
                     evt = recv_monitor_message(socket)
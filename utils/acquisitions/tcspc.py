@@ -0,0 +1,201 @@
+import numpy as np
+from dataclasses import dataclass
+from threading import Lock
+from typing import Any, Dict
+from .timestamp_files import TimestampFile
+
+
+@dataclass(frozen=True)
+class Binning:
+    bwidth: int                 # ps
+    bcount: int
+    offset: int = 0             # ps, start-stop delay of the left edge of the first bin
+
+    def x_data(self) -> np.ndarray:
+        # Left bin edges, like TCToL's X data
+        return self.offset + np.arange(self.bcount) * self.bwidth
+
+    def histogram(self, delays: np.ndarray) -> np.ndarray:
+        # Integer binning: one floor division and a bincount, delays outside [offset, offset + bcount * bwidth) dropped.
+        index = (delays - self.offset) // self.bwidth
+        index = index[(index >= 0) & (index < self.bcount)]
+        return np.bincount(index, minlength=self.bcount)
+
+
+def _before(refs: np.ndarray, times: np.ndarray, ref: int, time: int) -> np.ndarray:
+    # (refs, times) <= (ref, time), records first then timestamps
+    return (refs < ref) | ((refs == ref) & (times <= time))
+
+
+def match_start_stop(starts: np.ndarray, stops: np.ndarray, start_refs: np.ndarray = None, stop_refs: np.ndarray = None) -> np.ndarray:
+    """Start-stop delays (ps, int64) of the stops, each timed from the last start at or before it in the same record.
+
+    Both channels must be sorted (by record, then timestamp), as the DataLinkTarget writes them. Stops with no start
+    before them in their record are dropped. Vectorised: one searchsorted per record.
+    """
+    starts = np.asarray(starts, dtype=np.int64)
+    stops = np.asarray(stops, dtype=np.int64)
+    if start_refs is None or stop_refs is None:
+        last = np.searchsorted(starts, stops, side="right") - 1
+        valid = last >= 0
+        return stops[valid] - starts[last[valid]]
+
+    delays = []
+    stop_bounds = np.flatnonzero(np.diff(stop_refs)) + 1
+    for first, end in zip(np.r_[0, stop_bounds], np.r_[stop_bounds, len(stops)]):
+        ref = stop_refs[first]
+        low, high = np.searchsorted(start_refs, [ref, ref + 1])
+        delays.append(match_start_stop(starts[low:high], stops[first:end]))
+    return np.concatenate(delays) if delays else np.zeros(0, dtype=np.int64)
+
+
+class SoftwareTCSPC:
+    """Host-side ToL histograms from raw START and INPUTn timestamps.
+
+    Timestamps are fed in chunks per channel, in time order, from a StreamClient (attach()) or from saved DLT files
+    (histogram_timestamp_files()). Stops are matched as soon as the start channel has reached them, so the two streams
+    can arrive with any skew: only the start and stop timestamps the other channel has not caught up with are kept.
+    Every chunk fills all the binnings at once, so one recording can be rebinned at will:
+
+        tcspc = SoftwareTCSPC({"fine": Binning(10, 20000), "coarse": Binning(1000, 1000)})
+        tcspc.add_starts(starts); tcspc.add_stops(stops); tcspc.flush()
+        tol = tcspc.tol_data("fine")            # ToLData
+    """
+
+    def __init__(self, binnings: Dict[Any, Binning], with_ref_index: bool = False):
+        self.binnings = dict(binnings)
+        self.with_ref_index = with_ref_index
+        self.histograms = {name: np.zeros(binning.bcount, dtype=np.int64) for name, binning in self.binnings.items()}
+
+        self._starts = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64))     # (timestamps, refs)
+        self._stops = (np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.uint64))
+        self._last_stop = None              # (ref, timestamp) of the last stop received
+        self._record_ends = {}              # ref -> last timestamp seen, i.e. the record duration so far
+        self._lock = Lock()                 # the start and stop StreamClients call in from their own threads
+
+        self.nb_starts = 0
+        self.nb_stops = 0
+        self.nb_matched = 0
+
+    def _chunk(self, timestamps, refs) -> tuple:
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        refs = np.zeros(len(timestamps), dtype=np.uint64) if refs is None else np.asarray(refs, dtype=np.uint64)
+        if len(timestamps):
+            ends = {int(ref): int(end) for ref, end in zip(*self._last_per_record(timestamps, refs))}
+            for ref, end in ends.items():
+                self._record_ends[ref] = max(self._record_ends.get(ref, 0), end)
+        return timestamps, refs
+
+    @staticmethod
+    def _last_per_record(timestamps: np.ndarray, refs: np.ndarray) -> tuple:
+        last = np.r_[np.flatnonzero(np.diff(refs)), len(refs) - 1]
+        return refs[last], timestamps[last]
+
+    def add_starts(self, timestamps, refs = None):
+        with self._lock:
+            timestamps, refs = self._chunk(timestamps, refs)
+            self.nb_starts += len(timestamps)
+            self._starts = (np.concatenate((self._starts[0], timestamps)), np.concatenate((self._starts[1], refs)))
+            self._match()
+
+    def add_stops(self, timestamps, refs = None):
+        with self._lock:
+            timestamps, refs = self._chunk(timestamps, refs)
+            self.nb_stops += len(timestamps)
+            self._stops = (np.concatenate((self._stops[0], timestamps)), np.concatenate((self._stops[1], refs)))
+            if len(timestamps):
+                self._last_stop = (int(refs[-1]), int(timestamps[-1]))
+            self._match()
+
+    def _match(self, final: bool = False):
+        starts, start_refs = self._starts
+        stops, stop_refs = self._stops
+
+        # Stops up to the last start received are final, later ones wait for the next start chunk
+        if len(stops) and (len(starts) or final):
+            if final:
+                ready = len(stops)
+            else:
+                ready = int(np.count_nonzero(_before(stop_refs, stops, start_refs[-1], starts[-1])))
+            if ready:
+                refs = (start_refs, stop_refs[:ready]) if self.with_ref_index else (None, None)
+                self._accumulate(match_start_stop(starts, stops[:ready], *refs))
+                stops, stop_refs = stops[ready:], stop_refs[ready:]
+                self._stops = (stops, stop_refs)
+
+        # Stops to come are at or after the earliest pending one, else after the last stop received: the starts before
+        # the last one at or before it can not be matched any more. Before the first stop every start is kept.
+        if len(stops):
+            bound = (stop_refs[0], stops[0])
+        elif self._last_stop is not None:
+            bound = self._last_stop
+        else:
+            return
+        keep = max(0, int(np.count_nonzero(_before(start_refs, starts, *bound))) - 1)
+        self._starts = (starts[keep:], start_refs[keep:])
+
+    def _accumulate(self, delays: np.ndarray):
+        self.nb_matched += len(delays)
+        for name, binning in self.binnings.items():
+            self.histograms[name] += binning.histogram(delays)
+
+    def flush(self):
+        # End of the data: the stops still waiting are matched against the starts received so far.
+        with self._lock:
+            self._match(final=True)
+
+    def attach(self, start_client, stop_client):
+        # Feeds the engine from two StreamClients (START channel and INPUTn channel) decoding timestamps.
+        start_client.with_ref_index = stop_client.with_ref_index = self.with_ref_index
+        start_client.timestamps_callback = self.add_starts
+        stop_client.timestamps_callback = self.add_stops
+
+    def acquisition_time_s(self) -> float:
+        # Timestamps are relative to the start of their record: the last one of each record bounds its duration.
+        return sum(self._record_ends.values()) * 1e-12
+
+    def tol_data(self, name: Any = None, acquisition_time_s: float = None):
+        # ToLData of one binning (the only one by default), like TCToL.acquire() returns.
+        from devices.idq_tc1000_tol import ToLData         # devices imports utils.acquisitions: import on use
+
+        if name is None:
+            if len(self.binnings) != 1:
+                raise ValueError("SoftwareTCSPC.tol_data(): several binnings, name the one to return.")
+            name = next(iter(self.binnings))
+        return ToLData(
+            x_data=self.binnings[name].x_data(),
+            y_data=self.histograms[name].copy(),
+            acquisition_time_s=acquisition_time_s if acquisition_time_s is not None else self.acquisition_time_s(),
+        )
+
+
+def histogram_timestamp_files(
+    start_filepath,
+    stop_filepath,
+    binnings: Dict[Any, Binning],
+    with_ref_index: bool = False,
+    chunk_size: int = 1 << 22,
+) -> SoftwareTCSPC:
+    # Software ToL histograms of two DLT "bin" files (START channel and INPUTn channel), read memory-mapped in chunks
+    # of chunk_size timestamps. The next chunk always comes from the file furthest behind, so that few timestamps wait
+    # to be matched whatever the start and stop rates.
+    tcspc = SoftwareTCSPC(binnings, with_ref_index)
+    chunks = {
+        "start": TimestampFile(start_filepath, with_ref_index).chunks(chunk_size),
+        "stop": TimestampFile(stop_filepath, with_ref_index).chunks(chunk_size),
+    }
+    add = {"start": tcspc.add_starts, "stop": tcspc.add_stops}
+
+    last = {}               # channel -> (ref, timestamp) of the last chunk read
+    while chunks:
+        channel = min(chunks, key=lambda channel: last.get(channel, (-1, -1)))
+        chunk = next(chunks[channel], None)
+        if chunk is None:
+            del chunks[channel]
+            continue
+        timestamps, refs = chunk
+        add[channel](timestamps, refs)
+        last[channel] = (int(refs[-1]) if refs is not None else 0, int(timestamps[-1]))
+
+    tcspc.flush()
+    return tcspc
@@ -0,0 +1,132 @@
+import os
+import numpy as np
+from typing import Iterator, Tuple
+from .streams import TIMESTAMP_DTYPE, TIMESTAMP_REF_DTYPE
+
+
+class TimestampFile:
+    """Memory-mapped DataLinkTarget "bin" timestamps file (timestamps_C{channel}.bin).
+
+    Nothing is loaded: timestamps and ref_indexes are views on the mapped file and chunks() yields fixed-size views,
+    so files larger than RAM are analysed in bounded memory. build_index() scans the file once, chunk by chunk, and
+    keeps one entry per REC sub-acquisition (record) and per non-empty time block of block_ps:
+
+        records:  ref index, first position                    (--with-ref-index, else where the timestamps restart)
+        blocks:   ref index, block number, first position     (block number = timestamp // block_ps)
+
+    time_range() then finds any time interval of a record with two binary searches on the mapped file.
+    """
+
+    def __init__(self, filepath, with_ref_index: bool = False, block_ps: int = 10 ** 9, chunk_size: int = 1 << 20):
+        self.filepath = filepath
+        self.with_ref_index = with_ref_index
+        self.block_ps = block_ps
+        self.chunk_size = chunk_size
+
+        dtype = TIMESTAMP_REF_DTYPE if with_ref_index else TIMESTAMP_DTYPE
+        size = os.path.getsize(filepath) // dtype.itemsize          # a record being written may be incomplete
+        self.data = np.memmap(filepath, dtype=dtype, mode="r", shape=(size,)) if size else np.zeros(0, dtype=dtype)
+
+        self.record_refs = None
+        self.record_positions = None
+        self.block_refs = None
+        self.block_numbers = None
+        self.block_positions = None
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    @property
+    def timestamps(self) -> np.ndarray:
+        return self.data["timestamp"] if self.with_ref_index else self.data
+
+    @property
+    def ref_indexes(self) -> np.ndarray:
+        return self.data["ref_index"] if self.with_ref_index else None
+
+    def chunks(self, chunk_size: int = None, start: int = 0, stop: int = None) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        # (timestamps, ref indexes or None) views of chunk_size timestamps from position start to stop.
+        chunk_size = chunk_size or self.chunk_size
+        stop = len(self) if stop is None else min(stop, len(self))
+        for first in range(start, stop, chunk_size):
+            chunk = self.data[first:min(first + chunk_size, stop)]
+            if self.with_ref_index:
+                yield chunk["timestamp"], chunk["ref_index"]
+            else:
+                yield chunk, None
+
+    def _chunk_refs(self, timestamps: np.ndarray, refs: np.ndarray, previous: tuple) -> np.ndarray:
+        # Ref index of every timestamp; without ref index the records are counted where the timestamps go backwards.
+        if refs is not None:
+            return refs.astype(np.int64)
+        last_ref, last_timestamp = previous
+        restarts = np.diff(timestamps.astype(np.int64), prepend=np.int64(last_timestamp)) < 0
+        return last_ref + np.cumsum(restarts)
+
+    def build_index(self):
+        record_refs, record_positions, block_refs, block_numbers, block_positions = [], [], [], [], []
+        previous = (0, -1)              # (ref, timestamp) of the last timestamp of the previous chunk
+        previous_block = (-1, -1)       # (ref, block number)
+
+        for position, (timestamps, refs) in zip(range(0, len(self), self.chunk_size), self.chunks()):
+            refs = self._chunk_refs(timestamps, refs, previous if position else (0, 0))
+            blocks = timestamps.astype(np.int64) // self.block_ps
+
+            new_record = np.diff(refs, prepend=-1 if not position else previous[0]) != 0
+            new_block = new_record | (np.diff(blocks, prepend=previous_block[1]) != 0)
+
+            record_refs.append(refs[new_record])
+            record_positions.append(position + np.flatnonzero(new_record))
+            block_refs.append(refs[new_block])
+            block_numbers.append(blocks[new_block])
+            block_positions.append(position + np.flatnonzero(new_block))
+
+            previous = (int(refs[-1]), int(timestamps[-1]))
+            previous_block = (int(refs[-1]), int(blocks[-1]))
+
+        def join(parts) -> np.ndarray:
+            return np.concatenate(parts) if parts else np.zeros(0, dtype=np.int64)
+
+        self.record_refs, self.record_positions = join(record_refs), join(record_positions)
+        self.block_refs, self.block_numbers, self.block_positions = join(block_refs), join(block_numbers), join(block_positions)
+        return self
+
+    def _indexed(self):
+        if self.record_positions is None:
+            self.build_index()
+
+    def records(self) -> dict:
+        # {ref index: (first position, end position)}
+        self._indexed()
+        ends = np.r_[self.record_positions[1:], len(self)]
+        return {int(ref): (int(first), int(end)) for ref, first, end in zip(self.record_refs, self.record_positions, ends)}
+
+    def block_counts(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # (ref indexes, block numbers, timestamps per block) of the non-empty blocks: a count rate trace from the index.
+        self._indexed()
+        return self.block_refs, self.block_numbers, np.diff(np.r_[self.block_positions, len(self)])
+
+    def time_range(self, begin_ps: int, end_ps: int, ref: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        # Views of the timestamps of record ref (the first one by default) within [begin_ps, end_ps).
+        self._indexed()
+        records = self.records()
+        if not records:
+            return self.timestamps[:0], None if self.ref_indexes is None else self.ref_indexes[:0]
+        if ref is None:
+            ref = next(iter(records))
+        if ref not in records:
+            raise ValueError(f"TimestampFile.time_range(): no record with ref index {ref} in {self.filepath}.")
+
+        first, end = records[ref]
+        # Narrow down with the block index before the binary searches on the mapped file
+        in_record = self.block_refs == ref
+        numbers, positions = self.block_numbers[in_record], self.block_positions[in_record]
+        low = np.searchsorted(numbers, begin_ps // self.block_ps, side="right") - 1
+        high = np.searchsorted(numbers, -(-end_ps // self.block_ps))
+        first = int(positions[low]) if low >= 0 else first
+        end = int(positions[high]) if high < len(positions) else end
+
+        timestamps = self.timestamps[first:end]
+        low, high = first + np.searchsorted(timestamps, [begin_ps, end_ps])
+        refs = self.ref_indexes
+        return self.timestamps[low:high], None if refs is None else refs[low:high]
@@ -1,6 +1,6 @@
 import time
 import logging
-from utils.common import zmq_exec, dlt_exec
+from utils.common import zmq_exec, zmq_exec_batch, dlt_exec, ScpiBatch
 
 logger = logging.getLogger(__name__)
 
@@ -152,9 +152,9 @@ def close_timestamps_acquisition(tc, dlt, acquisitions_id):
                 f"End of acquisition(s) not properly registered ({acqu_count}/{expected_acqu_count})"
             )
 
-        zmq_exec(tc, f"RAW{channel}:SEND OFF")
+        _, raw_errors = zmq_exec_batch(tc, [f"RAW{channel}:SEND OFF", f"RAW{channel}:ERRORS?"])
 
-        if int(zmq_exec(tc, f"RAW{channel}:ERRORS?")):
+        if int(raw_errors):
             channel_errors.append(
                 f"The Time Controller reports timestamps acquisition errors"
             )
@@ -169,18 +169,19 @@ def close_timestamps_acquisition(tc, dlt, acquisitions_id):
 def acquire_timestamps(
     tc, dlt, tc_address, duration, channels, fmt, output_dir, with_ref_index
 ):
-    ### Configure the acquisition timer
-
-    # Trigger RECord signal manually (PLAY command)
-    zmq_exec(tc, "REC:TRIG:ARM:MODE MANUal")
-    # Enable the RECord generator
-    zmq_exec(tc, "REC:ENABle ON")
-    # STOP any already ongoing acquisition
-    zmq_exec(tc, "REC:STOP")
-    # Record a single acquisition
-    zmq_exec(tc, "REC:NUM 1")
-    # Record for the request duration (in ps)
-    zmq_exec(tc, f"REC:DURation {duration * 1e12}")
+    ### Configure the acquisition timer, all in one round trip
+
+    with ScpiBatch(tc) as batch:
+        # Trigger RECord signal manually (PLAY command)
+        batch.set("REC:TRIG:ARM:MODE", "MANUal")
+        # Enable the RECord generator
+        batch.set("REC:ENABle", "ON")
+        # STOP any already ongoing acquisition
+        batch.add("REC:STOP")
+        # Record a single acquisition
+        batch.set("REC:NUM", 1)
+        # Record for the request duration (in ps)
+        batch.set("REC:DURation", duration * 1e12)
 
     acquisitions_id = open_timestamps_acquisition(
         tc, dlt, tc_address, channels, fmt, output_dir, with_ref_index
@@ -1,10 +1,13 @@
 import os
 import time
+import asyncio
 import zmq
+import zmq.asyncio
 import json
 import socket
 import logging
 import subprocess
+from threading import Lock
 from pathlib import Path
 import __main__
 
@@ -12,6 +15,8 @@ DLT_PORT = 6060
 SCPI_PORT = 5555
 DEFAULT_DLT_PATH = Path("C:/Program Files/IDQ/Time Controller/packages/ScpiClient")
 DEFAULT_DLT_FILENAME = "DataLinkTargetService.exe"
+DEFAULT_TIMEOUT_MS = 5000
+DEFAULT_RETRIES = 2
 
 logger = logging.getLogger(__name__)
 
@@ -26,28 +31,278 @@ def check_host(address: str, port: int):
         return False
 
 
-def connect(address: str, port=SCPI_PORT):
+class ScpiTimeoutError(TimeoutError):
+    pass
+
+
+def _is_query(cmd: str) -> bool:
+    # Only commands made of queries are safe to send twice.
+    return all(part.strip().endswith("?") for part in cmd.split(";"))
+
+
+class ScpiClient:
+    # REQ socket to the Time Controller (or the DataLink) that never blocks forever: every reply is awaited with
+    # zmq.Poller for at most timeout_ms. When it does not come, the socket is dropped (linger 0) and a new one is
+    # connected ("lazy pirate"), so the REQ/REP state machine is reset. Queries are then sent again up to `retries`
+    # times; other commands are not repeated (a lost reply to REC:PLAY does not mean it was not executed) and raise
+    # ScpiTimeoutError right away, leaving a working socket behind.
+    def __init__(self, address: str, port: int = SCPI_PORT, timeout_ms: int = DEFAULT_TIMEOUT_MS, retries: int = DEFAULT_RETRIES):
+        self.endpoint = f"tcp://{address}:{port}"
+        self.timeout_ms = timeout_ms
+        self.retries = retries
+        self.reconnections = 0
+        self.context = zmq.Context.instance()
+        self._lock = Lock()                 # a REQ socket is not thread safe, scans also use it from worker threads
+        self.socket = None
+        self._open()
+
+    def _open(self):
+        if self.socket is not None:
+            self.socket.close(linger=0)
+            self.reconnections += 1
+        self.socket = self.context.socket(zmq.REQ)
+        self.socket.connect(self.endpoint)
+        self.poller = zmq.Poller()
+        self.poller.register(self.socket, zmq.POLLIN)
+
+    def exec(self, cmd: str, timeout_ms: int = None) -> str:
+        timeout_ms = timeout_ms or self.timeout_ms
+        attempts = 1 + (self.retries if _is_query(cmd) else 0)
+
+        with self._lock:
+            for attempt in range(1, attempts + 1):
+                self.socket.send_string(cmd)
+                if self.poller.poll(timeout_ms):
+                    return self.socket.recv().decode("utf-8")
+
+                logger.warning(f"no reply to \"{cmd}\" from {self.endpoint} in {timeout_ms} ms ({attempt}/{attempts}), reconnecting")
+                self._open()
+
+        raise ScpiTimeoutError(f'ScpiClient.exec(): no reply to "{cmd}" from {self.endpoint} after {attempts} attempt(s).')
+
+    def close(self):
+        self.socket.close(linger=0)
+
+
+class AsyncScpiClient:
+    # zmq.asyncio version of ScpiClient: replies are awaited on the event loop, so TC1000 queries can run alongside
+    # the HTTP calls of the asyncio Montana drivers. Same timeout and recovery rules.
+    def __init__(self, address: str, port: int = SCPI_PORT, timeout_ms: int = DEFAULT_TIMEOUT_MS, retries: int = DEFAULT_RETRIES):
+        self.endpoint = f"tcp://{address}:{port}"
+        self.timeout_ms = timeout_ms
+        self.retries = retries
+        self.reconnections = 0
+        self.context = zmq.asyncio.Context.instance()
+        self._lock = None                   # asyncio.Lock, created on first use inside the running loop
+        self.socket = None
+        self._open()
+
+    def _open(self):
+        if self.socket is not None:
+            self.socket.close(linger=0)
+            self.reconnections += 1
+        self.socket = self.context.socket(zmq.REQ)
+        self.socket.connect(self.endpoint)
+
+    async def exec(self, cmd: str, timeout_ms: int = None) -> str:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        timeout_ms = timeout_ms or self.timeout_ms
+        attempts = 1 + (self.retries if _is_query(cmd) else 0)
+
+        async with self._lock:
+            for attempt in range(1, attempts + 1):
+                await self.socket.send_string(cmd)
+                if await self.socket.poll(timeout_ms, zmq.POLLIN):
+                    return (await self.socket.recv()).decode("utf-8")
+
+                logger.warning(f"no reply to \"{cmd}\" from {self.endpoint} in {timeout_ms} ms ({attempt}/{attempts}), reconnecting")
+                self._open()
+
+        raise ScpiTimeoutError(f'AsyncScpiClient.exec(): no reply to "{cmd}" from {self.endpoint} after {attempts} attempt(s).')
+
+    def close(self):
+        self.socket.close(linger=0)
+
+
+def connect(address: str, port=SCPI_PORT, timeout_ms: int = DEFAULT_TIMEOUT_MS) -> ScpiClient:
     # Check if Time Controller is listening
     if not check_host(address, port):
         raise ConnectionError(f'Unable to connect to "{address}" on port {port}.')
 
-    # Create zmq socket and connect to the Time Controller
-    context = zmq.Context()
-    tc = context.socket(zmq.REQ)
-    tc.connect(f"tcp://{address}:{port}")
+    # Create zmq socket (shared context) and connect to the Time Controller
+    tc = ScpiClient(address, port, timeout_ms)
 
     logger.info("connection to DLT successful")
 
     return tc
 
 
+def async_connect(address: str, port=SCPI_PORT, timeout_ms: int = DEFAULT_TIMEOUT_MS) -> AsyncScpiClient:
+    if not check_host(address, port):
+        raise ConnectionError(f'Unable to connect to "{address}" on port {port}.')
+
+    return AsyncScpiClient(address, port, timeout_ms)
+
+
 def zmq_exec(zmq, cmd: str) -> str:
-    zmq.send_string(cmd)
-    ans = zmq.recv().decode("utf-8")
+    # Accepts a ScpiClient (timeouts and recovery) or a bare REQ socket (blocking).
+    if isinstance(zmq, ScpiClient):
+        ans = zmq.exec(cmd)
+    else:
+        zmq.send_string(cmd)
+        ans = zmq.recv().decode("utf-8")
     logger.debug(f"[command] {cmd}\n{ans}")
     return ans
 
 
+async def async_zmq_exec(zmq, cmd: str) -> str:
+    ans = await zmq.exec(cmd)
+    logger.debug(f"[command] {cmd}\n{ans}")
+    return ans
+
+
+class ScpiBatchError(Exception):
+    pass
+
+
+# Commands the Time Controller may execute without an answer line (short form, channel numbers left out)
+SILENT_COMMANDS = ("REC:PLAY", "REC:STOP", "HIST:FLUS", "DEVI:CONF:LOAD", "RAW:ERR:CLE")
+
+
+def _is_silent(cmd: str) -> bool:
+    # "HIST2:FLUSh", "RECord:PLAY", ... : every node is the short form of SILENT_COMMANDS or a longer form of it.
+    header = cmd.strip().lstrip(":").split(" ")[0].upper()
+    nodes = ["".join(c for c in node if not c.isdigit()) for node in header.split(":")]
+    for silent in SILENT_COMMANDS:
+        short_nodes = silent.split(":")
+        if len(nodes) == len(short_nodes) and all(node.startswith(short) for node, short in zip(nodes, short_nodes)):
+            return True
+    return False
+
+
+class ScpiBatch:
+    # Queue of SCPI commands sent to the Time Controller as one ";:"-chained message (one REQ/REP round trip).
+    # The answer holds one line per command (a command chaining subcommands with ";" answers one line per subcommand)
+    # and is split back so that execute() returns one result per queued command; an answer that does not line up with
+    # the commands raises ScpiBatchError rather than shift the results onto the wrong queries. Commands queued with check=True must
+    # answer "Value set to ...", otherwise they end up in `errors` and, with raise_on_error, a ScpiBatchError is raised.
+    # Long queues are sent in messages of `max_commands`. Used as a context manager the batch is sent on exit:
+    #
+    #   with ScpiBatch(tc) as batch:
+    #       batch.set("REC:NUM", 1)
+    #       stage = batch.query("REC:STAGe")
+    #   batch.results[stage]
+
+    def __init__(self, tc, raise_on_error: bool = True, max_commands: int = 64):
+        self.tc = tc
+        self.raise_on_error = raise_on_error
+        self.max_commands = max_commands
+        self.commands = []
+        self.checks = []
+        self.results = []
+        self.errors = []
+
+    def __len__(self):
+        return len(self.commands)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.execute()
+
+    def add(self, cmd: str, check: bool = False) -> int:
+        # Queues a command, returns the index of its result in execute()'s list.
+        cmd = cmd.strip().lstrip(":")
+        if not cmd:
+            raise ValueError("ScpiBatch.add(): empty command.")
+        self.commands.append(cmd)
+        self.checks.append(check)
+        return len(self.commands) - 1
+
+    def set(self, cmd: str, value) -> int:
+        # Setter whose answer is validated: "Value set to ...".
+        return self.add(f"{cmd} {value}", check=True)
+
+    def query(self, cmd: str) -> int:
+        return self.add(cmd if cmd.endswith("?") else f"{cmd}?")
+
+    def _split(self, commands: list, checks: list, answer: str) -> list:
+        # One line per subcommand, a blank (or error) line for the silent ones (SILENT_COMMANDS), or no line at all for
+        # them if the Time Controller leaves them out. Any other answer can not be mapped back onto the commands:
+        # ScpiBatchError, unless no query or checked setter of the message needs its answer.
+        silent = [[_is_silent(part) for part in cmd.split(";")] for cmd in commands]
+        layouts = [[[True] * len(flags) for flags in silent], [[not flag for flag in flags] for flags in silent]]
+
+        for answered in layouts:
+            count = sum(map(sum, answered))
+            lines = answer.split("\n")
+            if len(lines) > count and not any(line.strip() for line in lines[count:]):
+                lines = lines[:count]                           # trailing newline
+            if len(lines) != count:
+                continue
+
+            results, position, aligned = [], 0, True
+            for cmd_answered, cmd_silent in zip(answered, silent):
+                cmd_lines = []
+                for has_line, is_silent in zip(cmd_answered, cmd_silent):
+                    line = lines[position] if has_line else ""
+                    position += has_line
+                    # A silent command answering a value means the lines are shifted
+                    aligned &= not (is_silent and line.strip() and not line.strip().upper().startswith("ERROR"))
+                    cmd_lines.append(line)
+                results.append("\n".join(cmd_lines))
+            if aligned:
+                return results
+
+        if any(check or "?" in cmd for cmd, check in zip(commands, checks)):
+            raise ScpiBatchError(f"ScpiBatch._split(): answer does not match the commands {';:'.join(commands)}: {answer!r}.")
+        return [answer] + [""] * (len(commands) - 1)            # nobody reads these answers
+
+    def _take(self) -> tuple[list, list]:
+        commands, checks = self.commands, self.checks
+        self.commands, self.checks = [], []
+        self.results, self.errors = [], []
+        chunks = range(0, len(commands), self.max_commands)
+        return [commands[i:i + self.max_commands] for i in chunks], [checks[i:i + self.max_commands] for i in chunks]
+
+    def execute(self) -> list:
+        # Sends the queued commands, returns one answer per command (also kept in `results`) and empties the queue.
+        messages, checks = self._take()
+        for commands, message_checks in zip(messages, checks):
+            self.results += self._split(commands, message_checks, zmq_exec(self.tc, ";:".join(commands)))
+        return self._check(messages, checks)
+
+    async def execute_async(self) -> list:
+        # Same as execute() on an AsyncScpiClient.
+        messages, checks = self._take()
+        for commands, message_checks in zip(messages, checks):
+            self.results += self._split(commands, message_checks, await async_zmq_exec(self.tc, ";:".join(commands)))
+        return self._check(messages, checks)
+
+    def _check(self, messages: list, checks: list) -> list:
+        commands = [cmd for message in messages for cmd in message]
+        checks = [check for message_checks in checks for check in message_checks]
+        for cmd, check, result in zip(commands, checks, self.results):
+            if check and not all(line.strip().upper().startswith("VALUE SET TO") for line in result.split("\n")):
+                self.errors.append((cmd, result))
+
+        if self.errors and self.raise_on_error:
+            raise ScpiBatchError("; ".join(f"{cmd} -> {result.strip() or 'no answer'}" for cmd, result in self.errors))
+
+        return self.results
+
+
+def zmq_exec_batch(zmq, commands: list, check: bool = False) -> list:
+    # One round trip for a list of commands, one answer each. With check every answer must be "Value set to ...".
+    batch = ScpiBatch(zmq)
+    for cmd in commands:
+        batch.add(cmd, check)
+    return batch.execute()
+
+
 def trim_unit(value: str, unit: str ="TB") -> str:
     if unit and value.endswith(unit):
         return value[: -len(unit)]
@@ -130,4 +385,5 @@ def dlt_connect(output_dir: Path, dlt_path: Path = DEFAULT_DLT_PATH):
     logger.info("attempt to connect to DLT")
 
     # Create zmq socket and connect to the DataLink
-    return connect("localhost", port=DLT_PORT)
+    # Longer timeout: stopping an acquisition waits for the DataLink to flush its files
+    return connect("localhost", port=DLT_PORT, timeout_ms=30000)